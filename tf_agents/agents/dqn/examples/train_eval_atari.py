@@ -288,7 +288,7 @@ class TrainEval(object):
             py_hashed_replay_buffer.PyHashedReplayBuffer(
                 data_spec=data_spec, capacity=replay_buffer_capacity))
         ds = self._replay_buffer.as_dataset(
-            sample_batch_size=batch_size, num_steps=2).prefetch(4)
+            sample_batch_size=batch_size, num_steps=2, num_parallel_calls=3)
         self._ds_itr = ds.make_initializable_iterator()
         experience = self._ds_itr.get_next()
 
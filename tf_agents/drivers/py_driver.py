@@ -20,11 +20,19 @@ from __future__ import division
 from __future__ import print_function
 
 import numpy as np
+import tensorflow as tf
 from tf_agents.environments import trajectory
 
+nest = tf.contrib.framework.nest
+
 
 class PyDriver(object):
-  """A driver that runs a python policy in a python environment."""
+  """A driver that runs a python policy in a python environment.
+
+  If the environment has `auto_reset` enabled, the policy acts on its
+  `current_time_step`, so the observers are not notified of the boundary
+  trajectories from the last step of an episode to the first one of the next.
+  """
 
   def __init__(self,
                env,
@@ -84,7 +92,114 @@ class PyDriver(object):
       num_episodes += np.sum(traj.is_last())
       num_steps += np.sum(~traj.is_boundary())
 
-      time_step = next_time_step
+      if getattr(self._env, 'auto_reset', False):
+        # Ended episodes were already reset, skipping the boundary steps.
+        time_step = self._env.current_time_step()
+      else:
+        time_step = next_time_step
       policy_state = action_step.state
 
     return time_step, policy_state
+
+
+class AsyncPyDriver(PyDriver):
+  """A driver that steps each environment of a batch as soon as it is ready.
+
+  The environment must provide `step_async` and `step_wait`, as
+  `ParallelPyEnvironment` does. Instead of waiting for the slowest environment
+  of the batch, the policy acts on the environments that finished their step,
+  and the observers are notified with trajectories of these partial batches.
+  The policy must therefore accept batches of any size.
+
+  The steps still running when the limits are reached are waited for and
+  observed before `run` returns, so a run can go past `max_steps` or
+  `max_episodes` by up to one batch.
+  """
+
+  def __init__(self,
+               env,
+               policy,
+               observers,
+               max_steps=None,
+               max_episodes=None,
+               min_ready=None):
+    """A driver that steps each environment of a batch as soon as it is ready.
+
+    Args:
+      env: A batched py_environment.Base environment with `step_async` and
+        `step_wait` methods, such as a ParallelPyEnvironment.
+      policy: A py_policy.Base policy.
+      observers: A list of observers that are notified after every step
+        in the environment. Each observer is a callable(trajectory.Trajectory),
+        called with the environments that finished the step.
+      max_steps: Optional maximum number of steps for each run() call.
+        Default: 0.
+      max_episodes: Optional maximum number of episodes for each run() call.
+        At least one of max_steps or max_episodes must be provided.
+        Default: 0.
+      min_ready: Optional number of environments to wait for before acting.
+        Defaults to 1, acting as soon as any environment is ready.
+
+    Raises:
+      ValueError: If both max_steps and max_episodes are None.
+    """
+    super(AsyncPyDriver, self).__init__(env, policy, observers, max_steps,
+                                        max_episodes)
+    self._min_ready = min_ready or 1
+
+  def run(self, time_step, policy_state=()):
+    """Run policy in environment given initial time_step and policy_state.
+
+    Args:
+      time_step: The initial batched time_step.
+      policy_state: The initial batched policy_state.
+
+    Returns:
+      A tuple (final time_step, final policy_state).
+    """
+    time_step = nest.map_structure(np.array, time_step)
+    action_step = nest.map_structure(
+        np.array, self._policy.action(time_step, policy_state))
+    self._env.step_async(action_step.action)
+    num_pending = self._env.batch_size
+
+    num_steps = 0
+    num_episodes = 0
+    while num_pending:
+      done = (num_steps >= self._max_steps or
+              num_episodes >= self._max_episodes)
+      next_time_step, env_ids = self._env.step_wait(
+          num_pending if done else self._min_ready)
+      num_pending -= len(env_ids)
+
+      ready_time_step = _gather(time_step, env_ids)
+      ready_action_step = _gather(action_step, env_ids)
+      traj = trajectory.from_transition(ready_time_step, ready_action_step,
+                                        next_time_step)
+      for observer in self._observers:
+        observer(traj)
+
+      num_episodes += np.sum(traj.is_last())
+      num_steps += np.sum(~traj.is_boundary())
+
+      _scatter(time_step, env_ids, next_time_step)
+      if done or num_steps >= self._max_steps or (
+          num_episodes >= self._max_episodes):
+        continue
+      next_action_step = self._policy.action(next_time_step,
+                                             ready_action_step.state)
+      _scatter(action_step, env_ids, next_action_step)
+      self._env.step_async(next_action_step.action, env_ids)
+      num_pending += len(env_ids)
+
+    return time_step, action_step.state
+
+
+def _gather(batch, env_ids):
+  return nest.map_structure(lambda array: array[env_ids], batch)
+
+
+def _scatter(batch, env_ids, values):
+  def _set_rows(array, value):
+    array[env_ids] = value
+  nest.map_structure(_set_rows, batch, values)
@@ -19,6 +19,8 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import functools
+
 from absl.testing import parameterized
 
 import numpy as np
@@ -26,7 +28,9 @@ import tensorflow as tf
 from tf_agents.drivers import py_driver
 from tf_agents.drivers import test_utils as driver_test_utils
 from tf_agents.environments import batched_py_environment
+from tf_agents.environments import parallel_py_environment
 from tf_agents.environments import trajectory
+from tf_agents.policies import random_py_policy
 
 
 class MockReplayBufferObserver(object):
@@ -218,6 +222,70 @@ class PyDriverTest(parameterized.TestCase, tf.test.TestCase):
       for t1_field, t2_field in zip(t1, t2):
         self.assertAllEqual(t1_field, t2_field)
 
+  def testAutoResetEnvironmentSkipsBoundaries(self):
+    env = parallel_py_environment.ParallelPyEnvironment(
+        [functools.partial(driver_test_utils.PyEnvironmentMock,
+                           final_state=final_state)
+         for final_state in [3, 4]], auto_reset=True)
+    policy = random_py_policy.RandomPyPolicy(
+        env.time_step_spec(), env.action_spec(), seed=0)
+    replay_buffer_observer = MockReplayBufferObserver()
+    driver = py_driver.PyDriver(
+        env,
+        policy,
+        observers=[replay_buffer_observer],
+        max_steps=20,
+    )
+
+    driver.run(env.reset())
+    trajectories = replay_buffer_observer.gather_all()
+    # Every step of the envs is a transition of an episode.
+    self.assertEqual(10, len(trajectories))
+    self.assertFalse(any(np.any(traj.is_boundary()) for traj in trajectories))
+    self.assertTrue(any(np.any(traj.is_last()) for traj in trajectories))
+    env.close()
+
+
+class AsyncPyDriverTest(parameterized.TestCase, tf.test.TestCase):
+
+  @parameterized.named_parameters([
+      ('TenStepsOneReady', 10, None, None),
+      ('TenStepsTwoReady', 10, None, 2),
+      ('ThreeEpisodes', None, 3, None),
+  ])
+  def testRun(self, max_steps, max_episodes, min_ready):
+    env = parallel_py_environment.ParallelPyEnvironment(
+        [functools.partial(driver_test_utils.PyEnvironmentMock,
+                           final_state=final_state)
+         for final_state in [3, 4, 5]])
+    policy = random_py_policy.RandomPyPolicy(
+        env.time_step_spec(), env.action_spec(), seed=0)
+    replay_buffer_observer = MockReplayBufferObserver()
+    driver = py_driver.AsyncPyDriver(
+        env,
+        policy,
+        observers=[replay_buffer_observer],
+        max_steps=max_steps,
+        max_episodes=max_episodes,
+        min_ready=min_ready,
+    )
+
+    time_step, _ = driver.run(env.reset())
+    trajectories = replay_buffer_observer.gather_all()
+    num_steps = sum(np.sum(~traj.is_boundary()) for traj in trajectories)
+    num_episodes = sum(np.sum(traj.is_last()) for traj in trajectories)
+    # The limit is reached, and passed by at most the steps in flight.
+    if max_steps:
+      self.assertGreaterEqual(num_steps, max_steps)
+      self.assertLess(num_steps, max_steps + env.batch_size)
+    else:
+      self.assertGreaterEqual(num_episodes, max_episodes)
+    # The final time step gathers the last step of every env.
+    self.assertEqual((env.batch_size,), time_step.observation.shape)
+    # The time step can be used to continue.
+    driver.run(time_step)
+    env.close()
+
 
 if __name__ == '__main__':
   tf.test.main()
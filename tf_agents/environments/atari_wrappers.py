@@ -19,23 +19,37 @@ from __future__ import division
 from __future__ import print_function
 
 import collections
+import itertools
+import random
 
 import gym
 import numpy as np
 
+from tf_agents.environments import lazy_frames
 from tf_agents.environments import time_step as ts
 from tf_agents.environments import wrappers
 
 
 class FrameStack4(gym.Wrapper):
-  """Stack previous four frames (must be applied to Gym env, not our envs)."""
+  """Stack previous four frames (must be applied to Gym env, not our envs).
+
+  When `lazy` is True, observations are `lazy_frames.LazyFrames` referencing
+  the last four frames instead of a concatenated copy of them. Each frame gets
+  a unique key, which lets `PyHashedReplayBuffer` store each frame once
+  without splitting and hashing the stacked observations.
+  """
 
   STACK_SIZE = 4
 
-  def __init__(self, env):
+  def __init__(self, env, lazy=False):
     super(FrameStack4, self).__init__(env)
     self._env = env
+    self._lazy = lazy
     self._frames = collections.deque(maxlen=FrameStack4.STACK_SIZE)
+    self._keys = collections.deque(maxlen=FrameStack4.STACK_SIZE)
+    # Start from a random key so that keys from several environments, e.g. in
+    # different processes, feeding the same replay buffer do not collide.
+    self._next_key = itertools.count(random.SystemRandom().getrandbits(62))
     space = self._env.observation_space
     shape = space.shape[0:2] + (FrameStack4.STACK_SIZE,)
     self.observation_space = gym.spaces.Box(
@@ -46,17 +60,26 @@ class FrameStack4(gym.Wrapper):
     return getattr(self._env, name)
 
   def _generate_observation(self):
+    if self._lazy:
+      return lazy_frames.LazyFrames(
+          list(self._frames), keys=list(self._keys), axis=2)
     return np.concatenate(self._frames, axis=2)
 
+  def _append_frame(self, observation):
+    self._frames.append(observation)
+    self._keys.append(next(self._next_key))
+
   def reset(self):
     observation = self._env.reset()
-    for _ in range(FrameStack4.STACK_SIZE):
+    self._append_frame(observation)
+    for _ in range(FrameStack4.STACK_SIZE - 1):
       self._frames.append(observation)
+      self._keys.append(self._keys[-1])
     return self._generate_observation()
 
   def step(self, action):
     observation, reward, done, info = self._env.step(action)
-    self._frames.append(observation)
+    self._append_frame(observation)
     return self._generate_observation(), reward, done, info
 
 
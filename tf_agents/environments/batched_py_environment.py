@@ -25,15 +25,20 @@ from __future__ import print_function
 #   https://docs.python.org/2/library/multiprocessing.html#module-multiprocessing.dummy
 from multiprocessing import dummy as mp_threads
 # pylint: enable=line-too-long
+import time
 
 import numpy as np
 
 import tensorflow as tf
+from tf_agents.environments import lazy_frames
 from tf_agents.environments import py_environment
 import gin.tf
 
 nest = tf.contrib.framework.nest
 
+# Ways of stepping the environments of a BatchedPyEnvironment.
+_EXECUTION_MODES = ("serial", "threads", "chunked", "adaptive")
+
 
 @gin.configurable
 class BatchedPyEnvironment(py_environment.Base):
@@ -41,9 +46,20 @@ class BatchedPyEnvironment(py_environment.Base):
 
   The environments should only access shared python variables using
   shared mutex locks (from the threading module).
+
+  The environments are stepped according to `execution_mode`:
+
+    * "threads": in a thread pool with one thread per environment.
+    * "chunked": in a pool of `num_threads` threads, each stepping a
+      contiguous chunk of the environments.
+    * "serial": one after another in the calling thread, which avoids the pool
+      overhead and GIL handoffs for cheap python environments.
+    * "adaptive": measures the latency of the first steps with the serial and
+      the pool strategies in turn, then keeps the fastest.
   """
 
-  def __init__(self, envs):
+  def __init__(self, envs, double_buffered=False, execution_mode="threads",
+               num_threads=None, num_adaptive_trials=10):
     """Batch together multiple (non-batched) py environments.
 
     The environments can be different but must use the same action and
@@ -51,12 +67,26 @@ class BatchedPyEnvironment(py_environment.Base):
 
     Args:
       envs: List python environments (must be non-batched).
+      double_buffered: Boolean, whether to write the time steps into two
+        preallocated batches used in turn, instead of allocating new arrays
+        at every step. A returned time step is then only valid until the step
+        after the next one, so observers must copy the data they keep longer.
+      execution_mode: One of "threads", "chunked", "serial" or "adaptive",
+        see above.
+      num_threads: Number of threads of the "chunked" mode, and of the pool
+        tried by the "adaptive" mode. Defaults to one per environment.
+      num_adaptive_trials: Number of steps measured with each strategy by the
+        "adaptive" mode before choosing one.
 
     Raises:
       ValueError: If envs is not a list or tuple, or is zero length, or if
         one of the envs is already batched.
       ValueError: If the action or observation specs don't match.
+      ValueError: If execution_mode is unknown.
     """
+    if execution_mode not in _EXECUTION_MODES:
+      raise ValueError("execution_mode must be one of %s.  Got: %s" %
+                       (_EXECUTION_MODES, execution_mode))
     if not isinstance(envs, (list, tuple)):
       raise ValueError("envs must be a list or tuple.  Got: %s" % envs)
     batched_envs = [(i, env) for i, env in enumerate(envs) if env.batched]
@@ -76,8 +106,18 @@ class BatchedPyEnvironment(py_environment.Base):
       raise ValueError(
           "All environments must have the same time_step_spec.  Saw: %s" %
           [env.time_step_spec() for env in self._envs])
-    # Create a multiprocessing threadpool for execution.
-    self._pool = mp_threads.Pool(self._num_envs)
+    self._stacker = None
+    if double_buffered:
+      self._stacker = BatchStacker(self._time_step_spec, self._num_envs)
+    self._execution_mode = execution_mode
+    self._num_threads = min(num_threads or self._num_envs, self._num_envs)
+    self._num_adaptive_trials = num_adaptive_trials
+    # Step durations of each strategy tried by the adaptive mode.
+    self._step_durations = {"serial": [], "chunked": []}
+    self._pool = None
+    if execution_mode != "serial":
+      # Create a multiprocessing threadpool for execution.
+      self._pool = mp_threads.Pool(self._num_threads)
 
   @property
   def batched(self):
@@ -91,6 +131,13 @@ class BatchedPyEnvironment(py_environment.Base):
   def envs(self):
     return self._envs
 
+  @property
+  def execution_mode(self):
+    """The execution mode, or the strategy used next by the adaptive mode."""
+    if self._execution_mode == "adaptive":
+      return self._adaptive_mode()[0]
+    return self._execution_mode
+
   def observation_spec(self):
     return self._observation_spec
 
@@ -106,8 +153,8 @@ class BatchedPyEnvironment(py_environment.Base):
     Returns:
       Time step with batch dimension.
     """
-    time_steps = self._pool.map(lambda env: env.reset(), self._envs)
-    return stack_time_steps(time_steps)
+    time_steps = self._map(lambda env: env.reset(), self._envs)
+    return self._stack_time_steps(time_steps)
 
   def step(self, actions):
     """Forward a batch of actions to the wrapped environments.
@@ -126,26 +173,134 @@ class BatchedPyEnvironment(py_environment.Base):
       raise ValueError(
           "Primary dimension of action items does not match "
           "batch size: %d vs. %d" % (len(unstacked_actions), self.batch_size))
-    time_steps = self._pool.map(
+    time_steps = self._map(
         lambda env_action: env_action[0].step(env_action[1]),
-        zip(self._envs, unstacked_actions))
-    return stack_time_steps(time_steps)
+        list(zip(self._envs, unstacked_actions)), measure=True)
+    return self._stack_time_steps(time_steps)
 
   def close(self):
     """Send close messages to the external process and join them."""
-    self._pool.map(lambda env: env.close(), self._envs)
-    self._pool.close()
-    self._pool.join()
+    self._map(lambda env: env.close(), self._envs)
+    if self._pool is not None:
+      self._pool.close()
+      self._pool.join()
+
+  def _map(self, func, items, measure=False):
+    """Applies func to items with the execution mode.
+
+    Args:
+      func: Function to apply.
+      items: List of items, one per environment.
+      measure: Boolean, whether the call is a step whose duration the
+        adaptive mode can measure.
+
+    Returns:
+      The list of the results.
+    """
+    mode = self._execution_mode
+    if mode != "adaptive":
+      return self._map_with(mode, func, items)
+    mode, chosen = self._adaptive_mode()
+    if chosen or not measure:
+      return self._map_with(mode, func, items)
+    start_time = time.time()
+    results = self._map_with(mode, func, items)
+    self._step_durations[mode].append(time.time() - start_time)
+    if self._adaptive_mode()[1]:
+      tf.logging.info(
+          "BatchedPyEnvironment chose the %s mode, median step durations: %s",
+          self._adaptive_mode()[0],
+          {m: np.median(d) for m, d in self._step_durations.items()})
+    return results
+
+  def _adaptive_mode(self):
+    """Returns the mode to use next by the adaptive mode, and if it is final."""
+    num_trials = {m: len(d) for m, d in self._step_durations.items()}
+    if min(num_trials.values()) < self._num_adaptive_trials:
+      # Try the strategies in turn.
+      return min(sorted(num_trials), key=num_trials.get), False
+    return min(sorted(self._step_durations),
+               key=lambda m: np.median(self._step_durations[m])), True
+
+  def _map_with(self, mode, func, items):
+    if mode == "serial":
+      return [func(item) for item in items]
+    if mode == "threads":
+      return self._pool.map(func, items)
+    chunk_size = -(-len(items) // self._num_threads)
+    return self._pool.map(func, items, chunksize=chunk_size)
+
+  def _stack_time_steps(self, time_steps):
+    if self._stacker is not None:
+      return self._stacker.stack(time_steps)
+    return stack_time_steps(time_steps)
+
+
+class BatchStacker(object):
+  """Stacks nests into preallocated batches, reusing them in turn.
+
+  The arrays of the batches are allocated once from the spec and the nests
+  holding them are packed once, so stacking only copies the items into their
+  rows. A batch returned by `stack` is overwritten `num_buffers` calls later.
+  """
+
+  def __init__(self, spec, batch_size, num_buffers=2, rows_per_item=1):
+    """Allocates the batches.
+
+    Args:
+      spec: A nest of ArraySpec of the items.
+      batch_size: Number of rows of the batches.
+      num_buffers: Number of batches used in turn.
+      rows_per_item: Number of rows of each item, when the items are batches
+        themselves, which are then concatenated instead of stacked.
+    """
+    self._spec = spec
+    self._combine = np.stack if rows_per_item == 1 else np.concatenate
+    self._flat_batches = [
+        [np.zeros((batch_size,) + tuple(s.shape), s.dtype)
+         for s in nest.flatten(spec)]
+        for _ in range(num_buffers)]
+    self._batches = [nest.pack_sequence_as(spec, arrays)
+                     for arrays in self._flat_batches]
+    self._index = 0
+
+  def stack(self, items, flat=False):
+    """Copies items into the rows of the next batch.
+
+    Args:
+      items: List of nests matching the spec, or of their flattened values if
+        flat is True.
+      flat: Boolean, whether the items are already flattened.
+
+    Returns:
+      The next batch, a nest matching the spec with an outer batch dimension.
+    """
+    self._index = (self._index + 1) % len(self._batches)
+    if not flat:
+      items = [nest.flatten(item) for item in items]
+    for array, values in zip(self._flat_batches[self._index], zip(*items)):
+      self._combine(values, out=array)
+    return self._batches[self._index]
+
+  def copy(self, flat_arrays):
+    """Copies whole flattened batches into the next batch and returns it."""
+    self._index = (self._index + 1) % len(self._batches)
+    for array, values in zip(self._flat_batches[self._index], flat_arrays):
+      np.copyto(array, values)
+    return self._batches[self._index]
 
 
 # TODO(ebrevdo,sguada): Factor these helper functions out into common utils.
 def stack_time_steps(time_steps):
   """Given a list of TimeStep, combine to one with a batch dimension."""
-  return fast_map_structure(lambda *arrays: np.stack(arrays), *time_steps)
+  return fast_map_structure(lambda *arrays: lazy_frames.stack(arrays),
+                            *time_steps)
 
 
 def unstack_actions(batched_actions):
   """Returns a list of actions from potentially nested batch of actions."""
+  if not nest.is_sequence(batched_actions):
+    return list(batched_actions)
   flattened_actions = nest.flatten(batched_actions)
   unstacked_actions = [
       nest.pack_sequence_as(batched_actions, actions)
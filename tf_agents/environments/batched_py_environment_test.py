@@ -86,6 +86,90 @@ class BatchedPyEnvironmentTest(tf.test.TestCase):
                         time_step2.observation.shape)
     env.close()
 
+  def test_step_double_buffered(self):
+    num_envs = 3
+    constructors = [
+        functools.partial(random_py_environment.RandomPyEnvironment,
+                          self.observation_spec, self.action_spec, seed=seed)
+        for seed in range(num_envs)]
+    env = batched_py_environment.BatchedPyEnvironment(
+        [constructor() for constructor in constructors])
+    buffered_env = batched_py_environment.BatchedPyEnvironment(
+        [constructor() for constructor in constructors], double_buffered=True)
+    rng = np.random.RandomState()
+    action = np.stack([
+        array_spec.sample_bounded_spec(self.action_spec, rng)
+        for _ in range(num_envs)
+    ])
+
+    time_steps = [buffered_env.reset()]
+    for expected_time_step in [env.reset(), env.step(action),
+                               env.step(action)]:
+      time_step = time_steps[-1]
+      for array, expected_array in zip(time_step, expected_time_step):
+        self.assertAllEqual(expected_array, array)
+      self.assertEqual(np.float32, time_step.observation.dtype)
+      time_steps.append(buffered_env.step(action))
+    # The two batches are used in turn.
+    self.assertIsNot(time_steps[0], time_steps[1])
+    self.assertIs(time_steps[0], time_steps[2])
+    env.close()
+    buffered_env.close()
+
+  def test_step_execution_modes(self):
+    num_envs = 4
+    constructors = [
+        functools.partial(random_py_environment.RandomPyEnvironment,
+                          self.observation_spec, self.action_spec, seed=seed)
+        for seed in range(num_envs)]
+    env = batched_py_environment.BatchedPyEnvironment(
+        [constructor() for constructor in constructors])
+    rng = np.random.RandomState()
+    actions = [
+        np.stack([array_spec.sample_bounded_spec(self.action_spec, rng)
+                  for _ in range(num_envs)])
+        for _ in range(6)]
+    expected = [env.reset()] + [env.step(action) for action in actions]
+    env.close()
+
+    for execution_mode in ['serial', 'chunked', 'adaptive']:
+      mode_env = batched_py_environment.BatchedPyEnvironment(
+          [constructor() for constructor in constructors],
+          execution_mode=execution_mode, num_threads=2,
+          num_adaptive_trials=2)
+      time_steps = [mode_env.reset()] + [
+          mode_env.step(action) for action in actions]
+      for time_step, expected_time_step in zip(time_steps, expected):
+        for array, expected_array in zip(time_step, expected_time_step):
+          self.assertAllEqual(expected_array, array)
+      if execution_mode == 'adaptive':
+        # Each strategy was measured twice, then the fastest one was kept.
+        self.assertEqual(
+            [2, 2], sorted(len(d) for d in mode_env._step_durations.values()))
+        self.assertIn(mode_env.execution_mode, ['serial', 'chunked'])
+      else:
+        self.assertEqual(execution_mode, mode_env.execution_mode)
+      mode_env.close()
+
+  def test_invalid_execution_mode(self):
+    with self.assertRaises(ValueError):
+      batched_py_environment.BatchedPyEnvironment(
+          [random_py_environment.RandomPyEnvironment(
+              self.observation_spec, self.action_spec)],
+          execution_mode='processes')
+
+  def test_batch_stacker_concatenates_batched_items(self):
+    spec = {'a': array_spec.ArraySpec((2,), np.int64),
+            'b': array_spec.ArraySpec((), np.float32)}
+    stacker = batched_py_environment.BatchStacker(
+        spec, batch_size=4, rows_per_item=2)
+    items = [{'a': np.array([[0, 1], [2, 3]]), 'b': np.array([0., 1.])},
+             {'a': np.array([[4, 5], [6, 7]]), 'b': np.array([2., 3.])}]
+    batch = stacker.stack(items)
+    self.assertAllEqual(np.arange(8).reshape(4, 2), batch['a'])
+    self.assertAllEqual([0., 1., 2., 3.], batch['b'])
+    self.assertEqual(np.float32, batch['b'].dtype)
+
   def test_unstack_actions(self):
     num_envs = 5
     action_spec = self.action_spec
@@ -0,0 +1,107 @@
+# coding=utf-8
+# Copyright 2018 The TF-Agents Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Example of a vectorized environment simulating a batch of cart-poles.
+
+The physics follow gym's CartPole-v0, computed over all the environments at
+once with NumPy, so thousands of cart-poles can be stepped in one process.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import math
+
+import numpy as np
+
+from tf_agents.environments import py_environment
+from tf_agents.specs import array_spec
+
+
+class VectorizedCartPoleEnv(py_environment.VectorizedBase):
+  """A batch of cart-poles, each resetting when its pole falls.
+
+  Episodes reaching `max_episode_steps` are truncated rather than terminated,
+  so their last discount is 1.
+  """
+
+  gravity = 9.8
+  masscart = 1.0
+  masspole = 0.1
+  total_mass = masspole + masscart
+  length = 0.5  # Actually half the pole's length.
+  polemass_length = masspole * length
+  force_mag = 10.0
+  tau = 0.02  # Seconds between state updates.
+  theta_threshold_radians = 12 * 2 * math.pi / 360
+  x_threshold = 2.4
+
+  def __init__(self, batch_size, max_episode_steps=200, seed=None):
+    """Initializes the cart-poles.
+
+    Args:
+      batch_size: Number of cart-poles simulated.
+      max_episode_steps: Number of steps after which an episode ends if the
+        pole did not fall.
+      seed: Seed of the random initial states.
+    """
+    super(VectorizedCartPoleEnv, self).__init__(batch_size)
+    self._max_episode_steps = max_episode_steps
+    self._rng = np.random.RandomState(seed)
+    self._state = np.zeros((batch_size, 4))
+    self._steps = np.zeros(batch_size, dtype=np.int64)
+    self._action_spec = array_spec.BoundedArraySpec(
+        (), np.int64, minimum=0, maximum=1, name='action')
+    self._observation_spec = array_spec.ArraySpec(
+        (4,), np.float32, name='observation')
+
+  def observation_spec(self):
+    return self._observation_spec
+
+  def action_spec(self):
+    return self._action_spec
+
+  def _reset(self, env_ids):
+    self._state[env_ids] = self._rng.uniform(
+        low=-0.05, high=0.05, size=(len(env_ids), 4))
+    self._steps[env_ids] = 0
+    return self._state[env_ids].astype(np.float32)
+
+  def _step(self, action):
+    x, x_dot, theta, theta_dot = self._state.T
+    force = np.where(np.asarray(action) == 1, self.force_mag, -self.force_mag)
+    costheta = np.cos(theta)
+    sintheta = np.sin(theta)
+    temp = (force + self.polemass_length * theta_dot * theta_dot * sintheta
+           ) / self.total_mass
+    thetaacc = (self.gravity * sintheta - costheta * temp) / (
+        self.length *
+        (4.0 / 3.0 - self.masspole * costheta * costheta / self.total_mass))
+    xacc = temp - self.polemass_length * thetaacc * costheta / self.total_mass
+    self._state = np.stack([
+        x + self.tau * x_dot,
+        x_dot + self.tau * xacc,
+        theta + self.tau * theta_dot,
+        theta_dot + self.tau * thetaacc,
+    ], axis=1)
+    self._steps += 1
+
+    x, theta = self._state[:, 0], self._state[:, 2]
+    done = ((np.abs(x) > self.x_threshold) |
+            (np.abs(theta) > self.theta_threshold_radians))
+    truncated = self._steps >= self._max_episode_steps
+    reward = np.ones(self._batch_size, dtype=np.float32)
+    return self._state.astype(np.float32), reward, done, truncated
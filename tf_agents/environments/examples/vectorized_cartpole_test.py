@@ -0,0 +1,82 @@
+# coding=utf-8
+# Copyright 2018 The TF-Agents Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for environments.examples.vectorized_cartpole."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+from absl.testing import absltest
+import gym
+import numpy as np
+
+from tf_agents.environments import time_step as ts
+from tf_agents.environments.examples import vectorized_cartpole
+
+
+class VectorizedCartPoleEnvTest(absltest.TestCase):
+
+  def testStepMatchesGym(self):
+    batch_size = 4
+    env = vectorized_cartpole.VectorizedCartPoleEnv(batch_size, seed=0)
+    env.reset()
+    rng = np.random.RandomState(0)
+    state = rng.uniform(low=-0.1, high=0.1, size=(batch_size, 4))
+    env._state = state.copy()
+    action = np.array([0, 1, 1, 0])
+    time_step = env.step(action)
+
+    gym_env = gym.make('CartPole-v0').unwrapped
+    gym_env.reset()
+    for i in range(batch_size):
+      gym_env.state = state[i].copy()
+      observation, reward, done, _ = gym_env.step(int(action[i]))
+      np.testing.assert_allclose(observation, time_step.observation[i],
+                                 rtol=1e-6, atol=1e-6)
+      self.assertEqual(reward, time_step.reward[i])
+      self.assertEqual(done, time_step.is_last()[i])
+
+  def testRowsResetAutomatically(self):
+    env = vectorized_cartpole.VectorizedCartPoleEnv(
+        2, max_episode_steps=3, seed=0)
+    env.reset()
+    # The pole of the first cart-pole is about to fall.
+    env._state[0] = [0., 0., 0.2, 1.]
+    action = np.zeros(2, dtype=np.int64)
+
+    time_step = env.step(action)
+    self.assertEqual([ts.StepType.LAST, ts.StepType.MID],
+                     list(time_step.step_type))
+    self.assertEqual([0., 1.], list(time_step.discount))
+
+    time_step = env.step(action)
+    self.assertEqual([ts.StepType.FIRST, ts.StepType.MID],
+                     list(time_step.step_type))
+    self.assertEqual(0., time_step.reward[0])
+    self.assertTrue(np.all(np.abs(time_step.observation[0]) <= 0.05))
+
+    # The episode of the second cart-pole is truncated by the time limit.
+    time_step = env.step(action)
+    self.assertEqual([ts.StepType.MID, ts.StepType.LAST],
+                     list(time_step.step_type))
+    self.assertEqual([1., 1.], list(time_step.discount))
+    time_step = env.step(action)
+    self.assertEqual([ts.StepType.MID, ts.StepType.FIRST],
+                     list(time_step.step_type))
+
+
+if __name__ == '__main__':
+  absltest.main()
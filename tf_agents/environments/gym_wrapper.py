@@ -25,6 +25,7 @@ import numpy as np
 import tensorflow as tf
 
 from tf_agents import specs
+from tf_agents.environments import lazy_frames
 from tf_agents.environments import time_step as ts
 from tf_agents.environments import wrappers
 
@@ -175,7 +176,11 @@ class GymWrapper(wrappers.PyEnvironmentBaseWrapper):
 
     matched_observations = []
     for spec, obs in zip(self._flat_obs_spec, flat_obs):
-      matched_observations.append(np.asarray(obs, dtype=spec.dtype))
+      if isinstance(obs, lazy_frames.LazyFrames) and obs.dtype == spec.dtype:
+        # Keep stacked frames lazy, see atari_wrappers.FrameStack4.
+        matched_observations.append(obs)
+      else:
+        matched_observations.append(np.asarray(obs, dtype=spec.dtype))
     return nest.pack_sequence_as(self._observation_spec, matched_observations)
 
   def observation_spec(self):
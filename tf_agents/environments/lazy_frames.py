@@ -0,0 +1,149 @@
+# coding=utf-8
+# Copyright 2018 The TF-Agents Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Stacked observations that reference their frames instead of copying them.
+
+Frame stacking wrappers return overlapping observations: consecutive stacks
+share all but one of their frames. A `LazyFrames` keeps references to those
+frames, along with an optional key identifying each frame, and only
+concatenates them when it is converted to an array. Consumers that understand
+it, such as `PyHashedReplayBuffer`, can use the frames and keys directly.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import numpy as np
+
+
+class LazyFrames(object):
+  """A stack of frames which is concatenated along `axis` on demand.
+
+  The frames must not be modified after being added to a `LazyFrames`, since
+  they are shared with the other stacks which contain them.
+  """
+
+  def __init__(self, frames, keys=None, axis=-1):
+    """Creates a LazyFrames.
+
+    Args:
+      frames: List of numpy arrays with the same dtype and the same shape,
+        except along `axis`.
+      keys: Optional list of integers, one for each frame. Equal keys must
+        refer to equal frames, which lets consumers deduplicate frames without
+        hashing their content.
+      axis: Axis along which the frames are concatenated.
+
+    Raises:
+      ValueError: If `frames` is empty or the number of keys does not match the
+        number of frames.
+    """
+    if not frames:
+      raise ValueError('LazyFrames needs at least one frame.')
+    if keys is not None and len(keys) != len(frames):
+      raise ValueError('Got %d keys for %d frames.' % (len(keys), len(frames)))
+    self._frames = frames
+    self._keys = keys
+    self._axis = axis
+
+  @property
+  def frames(self):
+    return self._frames
+
+  @property
+  def keys(self):
+    return self._keys
+
+  @property
+  def axis(self):
+    return self._axis
+
+  @property
+  def shape(self):
+    shape = list(self._frames[0].shape)
+    shape[self._axis] = sum(frame.shape[self._axis] for frame in self._frames)
+    return tuple(shape)
+
+  @property
+  def dtype(self):
+    return self._frames[0].dtype
+
+  @property
+  def ndim(self):
+    return self._frames[0].ndim
+
+  def __array__(self, dtype=None):
+    array = np.concatenate(self._frames, axis=self._axis)
+    if dtype is not None and array.dtype != dtype:
+      array = array.astype(dtype)
+    return array
+
+
+class LazyFramesBatch(object):
+  """A batch of `LazyFrames`, stacked along a new outer axis on demand."""
+
+  def __init__(self, items):
+    """Creates a LazyFramesBatch.
+
+    Args:
+      items: List of `LazyFrames` with the same shape and dtype.
+    """
+    self._items = items
+
+  @property
+  def items(self):
+    return self._items
+
+  @property
+  def shape(self):
+    return (len(self._items),) + self._items[0].shape
+
+  @property
+  def dtype(self):
+    return self._items[0].dtype
+
+  @property
+  def ndim(self):
+    return self._items[0].ndim + 1
+
+  def __len__(self):
+    return len(self._items)
+
+  def __iter__(self):
+    return iter(self._items)
+
+  def __getitem__(self, index):
+    if isinstance(index, (int, np.integer)):
+      return self._items[index]
+    if isinstance(index, slice):
+      return LazyFramesBatch(self._items[index])
+    return np.asarray(self)[index]
+
+  def __array__(self, dtype=None):
+    return np.stack([np.asarray(item, dtype=dtype) for item in self._items])
+
+
+def stack(arrays):
+  """Stacks arrays along a new outer axis, keeping `LazyFrames` lazy.
+
+  Args:
+    arrays: List of numpy arrays, or list of `LazyFrames`.
+
+  Returns:
+    A `LazyFramesBatch` if `arrays` holds `LazyFrames`, else a numpy array.
+  """
+  if isinstance(arrays[0], LazyFrames):
+    return LazyFramesBatch(list(arrays))
+  return np.stack(arrays)
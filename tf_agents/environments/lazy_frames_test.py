@@ -0,0 +1,70 @@
+# coding=utf-8
+# Copyright 2018 The TF-Agents Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for tf_agents.environments.lazy_frames."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import numpy as np
+import tensorflow as tf
+
+from tf_agents.environments import lazy_frames
+
+
+class LazyFramesTest(tf.test.TestCase):
+
+  def _frames(self, count):
+    return [np.full((3, 2, 1), k, dtype=np.uint8) for k in range(count)]
+
+  def test_concatenates_on_demand(self):
+    frames = self._frames(4)
+    stacked = lazy_frames.LazyFrames(frames, keys=[0, 1, 2, 3], axis=2)
+    self.assertEqual((3, 2, 4), stacked.shape)
+    self.assertEqual(np.uint8, stacked.dtype)
+    self.assertEqual(3, stacked.ndim)
+    self.assertIs(frames[1], stacked.frames[1])
+    self.assertAllEqual(np.concatenate(frames, axis=2), np.asarray(stacked))
+    self.assertEqual(np.float32, np.asarray(stacked, dtype=np.float32).dtype)
+
+  def test_keys_must_match_frames(self):
+    with self.assertRaises(ValueError):
+      lazy_frames.LazyFrames(self._frames(4), keys=[0, 1])
+    with self.assertRaises(ValueError):
+      lazy_frames.LazyFrames([])
+
+  def test_stack(self):
+    frames = self._frames(5)
+    items = [lazy_frames.LazyFrames(frames[k:k + 4], axis=2) for k in range(2)]
+    batch = lazy_frames.stack(items)
+    self.assertIsInstance(batch, lazy_frames.LazyFramesBatch)
+    self.assertEqual((2, 3, 2, 4), batch.shape)
+    self.assertEqual(2, len(batch))
+    self.assertIs(items[1], batch[1])
+    self.assertIsInstance(batch[:1], lazy_frames.LazyFramesBatch)
+    expected = np.stack([np.asarray(item) for item in items])
+    self.assertAllEqual(expected, np.asarray(batch))
+    self.assertAllEqual(expected[:, 0], batch[:, 0])
+
+  def test_stack_arrays(self):
+    arrays = self._frames(2)
+    batch = lazy_frames.stack(arrays)
+    self.assertIsInstance(batch, np.ndarray)
+    self.assertAllEqual(np.stack(arrays), batch)
+
+
+if __name__ == '__main__':
+  tf.test.main()
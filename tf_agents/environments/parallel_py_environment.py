@@ -20,13 +20,22 @@ from __future__ import division
 from __future__ import print_function
 
 import atexit
+import functools
 import multiprocessing
+from multiprocessing import connection
+import os
+import select
+import shutil
 import sys
+import tempfile
+import time
 import traceback
 
 import numpy as np
 import tensorflow as tf
 
+from tf_agents.environments import batched_py_environment
+from tf_agents.environments import lazy_frames
 from tf_agents.environments import py_environment
 
 nest = tf.contrib.framework.nest
@@ -39,9 +48,38 @@ class ParallelPyEnvironment(py_environment.Base):
   callables. This can be an environment class, or a function creating the
   environment and potentially wrapping it. The returned environment should not
   access global variables.
+
+  Each process can host several environments, stepped together as a
+  `BatchedPyEnvironment`, which saves processes and round-trips when the
+  environments are cheap compared to the communication.
+
+  Besides `step`, which waits for all the environments, `step_async` and
+  `step_wait` let the caller act on whichever environments finish first, e.g.
+  with an `AsyncPyDriver`, so that slow steps do not hold up the others.
+
+  The worker processes are started concurrently. They can come from an
+  `EnvironmentPool`, which keeps them alive across ParallelPyEnvironments, e.g.
+  when rebuilding evaluation environments, and from a forkserver which imported
+  the heavy modules once.
+
+  With `restart_workers`, the workers are supervised: a worker whose process
+  died, whose environment raised, or which did not answer within
+  `step_timeout` is restarted with its constructor, and its environments
+  return the first time step of a new episode.
+
+  With `auto_reset`, the workers reset their environment as soon as an episode
+  ends. `step` still returns the terminal time steps, while
+  `current_time_step` holds the first time steps of the new episodes, to act
+  on next without going through a boundary step. The trajectories collected
+  then have no boundaries, so the terminal observations are not observed:
+  `PyNStepWriter` rejects them, while replay buffers sampling within episodes
+  end each episode at its last step.
   """
 
-  def __init__(self, env_constructors, blocking=False, flatten=False):
+  def __init__(self, env_constructors, blocking=False, flatten=False,
+               shared_memory=False, envs_per_worker=1, double_buffered=False,
+               auto_reset=False, start_method=None, preload_modules=None,
+               pool=None, restart_workers=False, step_timeout=None):
     """Batch together environments and simulate them in external processes.
 
     The environments can be different but must use the same action and
@@ -52,13 +90,53 @@ class ParallelPyEnvironment(py_environment.Base):
       blocking: Whether to step environments one after another.
       flatten: Boolean, whether to use flatten action and time_steps during
         communication to reduce overhead.
+      shared_memory: Boolean, whether the workers write their time steps
+        directly into their row of a batch in shared memory, so that the pipes
+        only carry actions and small control messages.
+      envs_per_worker: Number of environments created and stepped in each
+        process. Must evenly divide the number of environments.
+      double_buffered: Boolean, whether to write the time steps into two
+        preallocated batches used in turn, instead of allocating new arrays
+        at every step. A returned time step is then only valid until the step
+        after the next one, so observers must copy the data they keep longer.
+      auto_reset: Boolean, whether the workers reset their environment right
+        after the end of an episode, see `current_time_step`. Not supported
+        with shared_memory or several envs_per_worker.
+      start_method: (Optional.) Multiprocessing start method of the workers,
+        'fork', 'spawn' or 'forkserver'. Defaults to the platform default.
+      preload_modules: (Optional.) List of modules the forkserver imports once
+        before forking the workers, e.g. ['tensorflow', 'gym'].
+      pool: (Optional.) An EnvironmentPool providing the worker processes,
+        which are returned to it by `close`. start_method and preload_modules
+        are then the ones of the pool.
+      restart_workers: Boolean, whether to restart the workers which fail
+        during `reset` or `step` instead of raising.
+      step_timeout: (Optional.) Number of seconds after which a worker which
+        did not return the result of `reset` or `step` fails.
 
     Raises:
-      ValueError: If the action or observation specs don't match.
+      ValueError: If the action or observation specs don't match, if
+        envs_per_worker does not divide the number of environments, or if
+        auto_reset is combined with shared_memory or envs_per_worker.
     """
-    self._envs = [ProcessPyEnvironment(ctor, flatten=flatten)
+    if auto_reset and (shared_memory or envs_per_worker > 1):
+      raise ValueError('auto_reset is not supported with shared_memory or '
+                       'several envs_per_worker.')
+    if len(env_constructors) % envs_per_worker:
+      raise ValueError('envs_per_worker must evenly divide the number of '
+                       'environments, got {} and {}.'.format(
+                           envs_per_worker, len(env_constructors)))
+    self._envs_per_worker = envs_per_worker
+    if envs_per_worker > 1:
+      env_constructors = [
+          BatchedEnvConstructor(env_constructors[i:i + envs_per_worker])
+          for i in range(0, len(env_constructors), envs_per_worker)]
+    context = worker_context(start_method, preload_modules)
+    self._envs = [ProcessPyEnvironment(ctor, flatten=flatten,
+                                       auto_reset=auto_reset, context=context,
+                                       pool=pool, timeout=step_timeout)
                   for ctor in env_constructors]
-    self._num_envs = len(env_constructors)
+    self._num_envs = len(self._envs) * envs_per_worker
     self.start()
     self._action_spec = self._envs[0].action_spec()
     self._observation_spec = self._envs[0].observation_spec()
@@ -69,11 +147,32 @@ class ParallelPyEnvironment(py_environment.Base):
       raise ValueError('All environments must have the same time_step_spec.')
     self._blocking = blocking
     self._flatten = flatten
+    self._auto_reset = auto_reset
+    self._current_time_step = None
+    self._restart_workers = restart_workers
+    self._step_timeout = step_timeout
+    self._num_restarts = 0
+    # Promises of the workers stepped by step_async, and the times by which
+    # they must answer when step_timeout is set, by worker id.
+    self._pending = {}
+    self._step_deadlines = {}
+    self._stacker = None
+    if double_buffered:
+      self._stacker = batched_py_environment.BatchStacker(
+          self._time_step_spec, self._num_envs,
+          rows_per_item=envs_per_worker)
+    self._shared_batch = None
+    if shared_memory:
+      self._shared_batch = SharedBatch(self._time_step_spec, self._num_envs)
+      for i, env in enumerate(self._envs):
+        env.share_time_steps(self._shared_batch.paths, self._worker_rows(i))
 
   def start(self):
     tf.logging.info('Starting all processes.')
     for env in self._envs:
-      env.start()
+      env.start(wait_to_start=False)
+    for env in self._envs:
+      env.wait_start()
     tf.logging.info('All processes started.')
 
   @property
@@ -84,6 +183,15 @@ class ParallelPyEnvironment(py_environment.Base):
   def batch_size(self):
     return self._num_envs
 
+  @property
+  def auto_reset(self):
+    return self._auto_reset
+
+  @property
+  def num_restarts(self):
+    """Number of workers restarted after a failure."""
+    return self._num_restarts
+
   def observation_spec(self):
     return self._observation_spec
 
@@ -98,11 +206,22 @@ class ParallelPyEnvironment(py_environment.Base):
 
     Returns:
       Time step with batch dimension.
+
+    Raises:
+      ValueError: If environments are being stepped by step_async.
     """
-    time_steps = [env.reset(self._blocking) for env in self._envs]
-    if not self._blocking:
-      time_steps = [promise() for promise in time_steps]
-    return self._stack_time_steps(time_steps)
+    self._check_not_pending()
+    if self._blocking:
+      time_steps = [self._supervised(i, env.reset)
+                    for i, env in enumerate(self._envs)]
+    else:
+      promises = [env.reset(blocking=False) for env in self._envs]
+      time_steps = [self._supervised(i, promise)
+                    for i, promise in enumerate(promises)]
+    time_step = self._stack_time_steps(time_steps)
+    if self._auto_reset:
+      self._current_time_step = nest.map_structure(np.array, time_step)
+    return time_step
 
   def step(self, actions):
     """Forward a batch of actions to the wrapped environments.
@@ -111,37 +230,268 @@ class ParallelPyEnvironment(py_environment.Base):
       actions: Batched action, possibly nested, to apply to the environment.
 
     Raises:
-      ValueError: Invalid actions.
+      ValueError: Invalid actions, or environments are being stepped by
+        step_async.
 
     Returns:
       Batch of observations, rewards, and done flags.
     """
-    time_steps = [
-        env.step(action, self._blocking)
-        for env, action in zip(self._envs, self._unstack_actions(actions))]
-    # When blocking is False we get promises that need to be called.
-    if not self._blocking:
-      time_steps = [promise() for promise in time_steps]
-    return self._stack_time_steps(time_steps)
+    self._check_not_pending()
+    worker_actions = self._worker_actions(actions)
+    if self._blocking:
+      time_steps = [
+          self._supervised(i, functools.partial(env.step, action), step=True)
+          for i, (env, action) in enumerate(zip(self._envs, worker_actions))]
+    else:
+      # When blocking is False we get promises that need to be called.
+      promises = [env.step(action, blocking=False)
+                  for env, action in zip(self._envs, worker_actions)]
+      time_steps = [self._supervised(i, promise, step=True)
+                    for i, promise in enumerate(promises)]
+    if not self._auto_reset:
+      return self._stack_time_steps(time_steps)
+    time_steps, reset_time_steps = zip(*time_steps)
+    time_step = self._stack_time_steps(time_steps)
+    self._current_time_step = self._apply_resets(time_step, reset_time_steps)
+    return time_step
+
+  def current_time_step(self):
+    """Returns the time step the next actions apply to, with auto_reset.
+
+    This is the time step returned by the last `reset` or `step`, except for
+    the environments whose episode ended at the last step, which hold the
+    first time step of their new episode.
+
+    Raises:
+      ValueError: If auto_reset is off or the environments were not reset.
+    """
+    if self._current_time_step is None:
+      raise ValueError('current_time_step requires auto_reset and a reset of '
+                       'the environments.')
+    return self._current_time_step
+
+  def step_async(self, actions, env_ids=None):
+    """Starts stepping some of the environments, without waiting for them.
+
+    The results are collected with `step_wait`.
+
+    Args:
+      actions: Batched action, possibly nested, with one entry per env id.
+      env_ids: (Optional.) Ids of the environments to step, i.e. their rows in
+        the batch. The environments of a worker must be stepped together, with
+        consecutive ids. Defaults to all the environments.
+
+    Raises:
+      ValueError: If env_ids do not cover whole workers, or if some of the
+        environments are already being stepped.
+    """
+    if self._auto_reset:
+      raise ValueError('step_async is not supported with auto_reset.')
+    env_ids = (np.arange(self._num_envs) if env_ids is None
+               else np.asarray(env_ids, dtype=np.int64))
+    worker_ids = env_ids[::self._envs_per_worker] // self._envs_per_worker
+    if not np.array_equal(env_ids, self._worker_env_ids(worker_ids)):
+      raise ValueError('env_ids must list all the {} environments of each '
+                       'worker in order, got {}.'.format(
+                           self._envs_per_worker, env_ids))
+    busy = [i for i in worker_ids if i in self._pending]
+    if busy:
+      raise ValueError('The environments of workers {} are already being '
+                       'stepped.'.format(busy))
+    step_deadline = (None if self._step_timeout is None
+                     else time.time() + self._step_timeout)
+    for worker_id, action in zip(worker_ids, self._worker_actions(actions)):
+      self._pending[worker_id] = self._envs[worker_id].step(
+          action, blocking=False)
+      self._step_deadlines[worker_id] = step_deadline
+
+  def step_wait(self, min_ready=None, timeout=None):
+    """Waits for environments stepped by `step_async` to finish their step.
+
+    Args:
+      min_ready: (Optional.) Number of environments to wait for. All the
+        environments ready are returned, which can be more. Defaults to all
+        the environments being stepped.
+      timeout: (Optional.) Maximum number of seconds to wait. The environments
+        ready by then are returned, which can be fewer than min_ready.
+
+    Workers which did not answer within `step_timeout` of their `step_async`
+    fail, and are restarted when `restart_workers` is set.
+
+    Returns:
+      A tuple (time_step, env_ids) of the time steps of the environments ready,
+      with batch dimension, and of their ids, in increasing order.
+
+    Raises:
+      ValueError: If no environment is being stepped.
+      WorkerError: If a worker failed and restart_workers is False.
+    """
+    if not self._pending:
+      raise ValueError('No environment is being stepped, call step_async '
+                       'first.')
+    num_workers = len(self._pending)
+    if min_ready is not None:
+      num_workers = min(-(-min_ready // self._envs_per_worker), num_workers)
+    deadline = None if timeout is None else time.time() + timeout
+    waiting = {self._envs[i]: i for i in self._pending}
+    ready = []
+    expired = set()
+    while len(ready) < num_workers:
+      now = time.time()
+      for env, i in list(waiting.items()):
+        if self._step_deadlines[i] is not None and (
+            self._step_deadlines[i] <= now):
+          expired.add(waiting.pop(env))
+          ready.append(i)
+      if len(ready) >= num_workers or (deadline is not None and
+                                       deadline <= now):
+        break
+      # Wake up by the first step deadline, to fail workers which hang.
+      deadlines = [self._step_deadlines[i] for i in waiting.values()
+                   if self._step_deadlines[i] is not None]
+      if deadline is not None:
+        deadlines.append(deadline)
+      remaining = min(deadlines) - now if deadlines else None
+      for env in _wait_ready(list(waiting), remaining):
+        ready.append(waiting.pop(env))
+    worker_ids = np.array(sorted(ready), dtype=np.int64)
+
+    time_steps = []
+    for i in worker_ids:
+      promise = self._pending.pop(i)
+      del self._step_deadlines[i]
+      if i in expired:
+        promise = functools.partial(_raise_timeout, self._step_timeout)
+      time_steps.append(self._supervised(i, promise, step=True))
+    env_ids = self._worker_env_ids(worker_ids)
+    if self._shared_batch is not None:
+      return self._shared_batch.read(env_ids), env_ids
+    if not time_steps:
+      return nest.map_structure(
+          lambda spec: np.zeros((0,) + spec.shape, spec.dtype),
+          self._time_step_spec), env_ids
+    if len(time_steps) == len(self._envs):
+      return self._stack_time_steps(time_steps), env_ids
+    return self._concat_time_steps(time_steps), env_ids
 
   def close(self):
     """Close all external process."""
     tf.logging.info('Closing all processes.')
     for env in self._envs:
       env.close()
+    if self._shared_batch is not None:
+      self._shared_batch.close()
     tf.logging.info('All processes closed.')
 
   def _stack_time_steps(self, time_steps):
+    """Combines the TimeStep of every worker to one with a batch dimension.
+
+    Args:
+      time_steps: List of the time steps of each worker, which are batched
+        when workers host several environments.
+    Returns:
+      A TimeStep of arrays with a [batch_size] outer dimension.
+    """
+    if self._shared_batch is not None:
+      if self._stacker is not None:
+        return self._stacker.copy(self._shared_batch.arrays)
+      return self._shared_batch.read()
+    if self._stacker is not None:
+      return self._stacker.stack(time_steps, flat=self._flatten)
+    return self._concat_time_steps(time_steps)
+
+  def _concat_time_steps(self, time_steps):
     """Given a list of TimeStep, combine to one with a batch dimension."""
+    if self._envs_per_worker == 1:
+      combine = lambda *arrays: lazy_frames.stack(arrays)
+    else:
+      combine = lambda *arrays: np.concatenate(arrays)
     if self._flatten:
-      return fast_map_structure_flatten(lambda *arrays: np.stack(arrays),
-                                        self._time_step_spec,
+      return fast_map_structure_flatten(combine, self._time_step_spec,
                                         *time_steps)
     else:
-      return fast_map_structure(lambda *arrays: np.stack(arrays), *time_steps)
+      return fast_map_structure(combine, *time_steps)
+
+  def _supervised(self, worker_id, get_result, step=False):
+    """Returns the result of a worker, restarting the worker if it failed.
+
+    Args:
+      worker_id: Index of the worker.
+      get_result: Callable returning the result of the worker.
+      step: Boolean, whether the result is the one of a step.
+
+    Returns:
+      The result, or the first time step of the restarted worker.
+
+    Raises:
+      WorkerError: If the worker failed and restart_workers is False.
+    """
+    try:
+      return get_result()
+    except WorkerError as e:
+      if not self._restart_workers:
+        raise
+      tf.logging.warning('Restarting the environment process %d: %s',
+                         worker_id, e)
+    env = self._envs[worker_id]
+    env.restart()
+    self._num_restarts += 1
+    if self._shared_batch is not None:
+      env.share_time_steps(self._shared_batch.paths,
+                           self._worker_rows(worker_id))
+    time_step = env.reset()
+    if step and self._auto_reset:
+      return time_step, None
+    return time_step
+
+  def _apply_resets(self, time_step, reset_time_steps):
+    """Returns a copy of time_step with the reset time steps in their rows."""
+    time_step = nest.map_structure(np.array, time_step)
+    flat_time_step = nest.flatten(time_step)
+    for i, reset_time_step in enumerate(reset_time_steps):
+      if reset_time_step is None:
+        continue
+      if not self._flatten:
+        reset_time_step = nest.flatten(reset_time_step)
+      for array, value in zip(flat_time_step, reset_time_step):
+        array[i] = value
+    return time_step
+
+  def _check_not_pending(self):
+    if self._pending:
+      raise ValueError('Environments are being stepped, call step_wait '
+                       'first.')
+
+  def _worker_rows(self, worker_id):
+    """Returns the index or slice of the rows of a worker in the batch."""
+    if self._envs_per_worker == 1:
+      return worker_id
+    return slice(worker_id * self._envs_per_worker,
+                 (worker_id + 1) * self._envs_per_worker)
+
+  def _worker_env_ids(self, worker_ids):
+    """Returns the ids of the environments of workers, in order."""
+    return (np.expand_dims(worker_ids, 1) * self._envs_per_worker +
+            np.arange(self._envs_per_worker)).reshape(-1)
+
+  def _worker_actions(self, batched_actions):
+    """Returns the list of the actions of each worker in a batch."""
+    if self._envs_per_worker == 1:
+      return self._unstack_actions(batched_actions)
+    flattened_actions = nest.flatten(batched_actions)
+    worker_actions = []
+    for start in range(0, len(flattened_actions[0]), self._envs_per_worker):
+      actions = [action[start:start + self._envs_per_worker]
+                 for action in flattened_actions]
+      if not self._flatten:
+        actions = nest.pack_sequence_as(batched_actions, actions)
+      worker_actions.append(actions)
+    return worker_actions
 
   def _unstack_actions(self, batched_actions):
     """Returns a list of actions from potentially nested batch of actions."""
+    if not self._flatten and not nest.is_sequence(batched_actions):
+      return list(batched_actions)
     flattened_actions = nest.flatten(batched_actions)
     if self._flatten:
       unstacked_actions = zip(*flattened_actions)
@@ -165,6 +515,206 @@ def fast_map_structure(func, *structure):
       structure[0], [func(*x) for x in entries])
 
 
+class BatchedEnvConstructor(object):
+  """Creates a BatchedPyEnvironment of several environments.
+
+  Used as the constructor of the environments of a worker process hosting
+  several environments. Unlike a lambda, it can be pickled when the
+  constructors of the environments can. The environments are stepped serially,
+  since the parallelism comes from the processes.
+  """
+
+  def __init__(self, env_constructors):
+    self._env_constructors = env_constructors
+
+  def __call__(self):
+    return batched_py_environment.BatchedPyEnvironment(
+        [ctor() for ctor in self._env_constructors], execution_mode='serial')
+
+
+class SharedBatch(object):
+  """A batch of nested arrays in shared memory, written by worker processes.
+
+  Each flat leaf is a memory-mapped `.npy` file in a temporary directory,
+  under /dev/shm when available, which workers map with `open_shared_arrays`.
+  """
+
+  def __init__(self, spec, batch_size):
+    """Creates a SharedBatch.
+
+    Args:
+      spec: A nest of ArraySpecs describing a single entry of the batch.
+      batch_size: Number of entries of the batch.
+    """
+    self._spec = spec
+    shm_directory = '/dev/shm'
+    self._directory = tempfile.mkdtemp(
+        prefix='tf_agents_shared_batch_',
+        dir=shm_directory if os.path.isdir(shm_directory) else None)
+    flat_spec = nest.flatten(spec)
+    self.paths = [os.path.join(self._directory, 'leaf{}.npy'.format(i))
+                  for i in range(len(flat_spec))]
+    self._arrays = [
+        np.lib.format.open_memmap(path, mode='w+', dtype=leaf_spec.dtype,
+                                  shape=(batch_size,) + tuple(leaf_spec.shape))
+        for path, leaf_spec in zip(self.paths, flat_spec)]
+
+  @property
+  def arrays(self):
+    """The flattened arrays of the batch, mapped in shared memory."""
+    return self._arrays
+
+  def read(self, rows=None):
+    """Returns a copy of the batch, or of some of its rows, packed as the spec.
+
+    Args:
+      rows: (Optional.) Array of the rows to read. Defaults to all the rows.
+
+    Returns:
+      A nest of arrays matching the spec, with an outer batch dimension.
+    """
+    if rows is None:
+      arrays = [np.array(array) for array in self._arrays]
+    else:
+      arrays = [np.asarray(array)[rows] for array in self._arrays]
+    return nest.pack_sequence_as(self._spec, arrays)
+
+  def close(self):
+    """Deletes the files, which stay mapped by the processes using them."""
+    shutil.rmtree(self._directory, ignore_errors=True)
+
+
+def open_shared_arrays(paths):
+  """Maps the flat arrays of a SharedBatch for writing."""
+  return [np.lib.format.open_memmap(path, mode='r+') for path in paths]
+
+
+def _wait_ready(envs, timeout=None):
+  """Waits until some of the environments have a result to receive.
+
+  Uses `multiprocessing.connection.wait`, or `select` on Python 2 where it does
+  not exist.
+
+  Args:
+    envs: List of ProcessPyEnvironments, or other objects with a `fileno`.
+    timeout: (Optional.) Maximum number of seconds to wait.
+
+  Returns:
+    The list of the environments ready, empty if the timeout expired.
+  """
+  if hasattr(connection, 'wait'):
+    return connection.wait(envs, timeout)
+  ready, _, _ = select.select(envs, [], [], timeout)
+  return ready
+
+
+class WorkerError(Exception):
+  """An environment process failed, died or did not answer in time."""
+
+
+def _raise_timeout(timeout):
+  raise WorkerError('The environment process did not answer within {} '
+                    'seconds.'.format(timeout))
+
+
+def worker_context(start_method=None, preload_modules=None):
+  """Returns the multiprocessing context to start worker processes with.
+
+  Args:
+    start_method: (Optional.) Multiprocessing start method, 'fork', 'spawn' or
+      'forkserver'. Defaults to the platform default.
+    preload_modules: (Optional.) List of modules the forkserver imports once,
+      so that the workers forked from it do not import them again.
+
+  Returns:
+    The multiprocessing module, or a multiprocessing context.
+
+  Raises:
+    ValueError: If preload_modules are given without the forkserver, or if a
+      start_method is given on Python 2, which only supports the default one.
+  """
+  if preload_modules and start_method != 'forkserver':
+    raise ValueError('preload_modules require the forkserver start method.')
+  if start_method is None:
+    return multiprocessing
+  if not hasattr(multiprocessing, 'get_context'):
+    raise ValueError('start_method {!r} requires Python 3, where '
+                     'multiprocessing supports start methods.'.format(
+                         start_method))
+  context = multiprocessing.get_context(start_method)
+  if preload_modules:
+    context.set_forkserver_preload(list(preload_modules))
+  return context
+
+
+class EnvironmentPool(object):
+  """Worker processes reused by the environments of ParallelPyEnvironments.
+
+  The workers start without environment. A ProcessPyEnvironment using the pool
+  sends its constructor to an idle worker, and returns the worker to the pool
+  when closed. The processes, and the modules they imported, are then kept for
+  the next environments, e.g. when rebuilding evaluation environments.
+  """
+
+  def __init__(self, num_workers=0, start_method=None, preload_modules=None):
+    """Creates an EnvironmentPool.
+
+    Args:
+      num_workers: Number of workers started right away. More are started when
+        needed.
+      start_method: (Optional.) Multiprocessing start method of the workers.
+      preload_modules: (Optional.) List of modules the forkserver imports once
+        before forking the workers.
+    """
+    self._context = worker_context(start_method, preload_modules)
+    self._closed = False
+    self._idle = [self._start_worker() for _ in range(num_workers)]
+    atexit.register(self.close)
+
+  @property
+  def num_idle(self):
+    return len(self._idle)
+
+  def acquire(self):
+    """Returns an idle worker, starting a new one if there is none.
+
+    Returns:
+      A tuple (process, connection) of a worker waiting for an environment.
+    """
+    if self._idle:
+      return self._idle.pop()
+    return self._start_worker()
+
+  def release(self, process, conn):
+    """Returns a worker whose environment was released to the pool."""
+    self._idle.append((process, conn))
+    if self._closed:
+      self.close()
+
+  def close(self):
+    """Closes the idle workers, and the ones released from now on."""
+    self._closed = True
+    for process, conn in self._idle:
+      try:
+        conn.send((ProcessPyEnvironment._CLOSE, None))  # pylint: disable=protected-access
+        conn.close()
+      except IOError:
+        # The connection was already closed.
+        pass
+      process.join(5)
+    self._idle = []
+
+  def _start_worker(self):
+    conn, worker_conn = self._context.Pipe()
+    process = self._context.Process(
+        target=ProcessPyEnvironment._worker,  # pylint: disable=protected-access
+        args=(worker_conn, None))
+    process.start()
+    # Only the worker holds its end, so that its death closes the pipe.
+    worker_conn.close()
+    return process, conn
+
+
 class ProcessPyEnvironment(object):
   """Step a single env in a separate process for lock free paralellism."""
 
@@ -175,8 +725,15 @@ class ProcessPyEnvironment(object):
   _RESULT = 4
   _EXCEPTION = 5
   _CLOSE = 6
+  _SHARE = 7
+  _CREATE = 8
+  _RELEASE = 9
+
+  # Seconds between checks that the process is alive while waiting for it.
+  _LIVENESS_INTERVAL = 1.0
 
-  def __init__(self, env_constructor, flatten=False):
+  def __init__(self, env_constructor, flatten=False, auto_reset=False,
+               context=None, pool=None, timeout=None):
     """Step environment in a separate process for lock free paralellism.
 
     The environment is created in an external process by calling the provided
@@ -188,6 +745,16 @@ class ProcessPyEnvironment(object):
       env_constructor: Callable that creates and returns a Python environment.
       flatten: Boolean, whether to assume flattened actions and time_steps
         during communication to avoid overhead.
+      auto_reset: Boolean, whether the worker resets the environment right
+        after a step ending an episode. `step` then returns the pair of the
+        time step and of the first time step of the new episode, or None when
+        the episode goes on.
+      context: (Optional.) The multiprocessing module or context used to start
+        the process, see `worker_context`.
+      pool: (Optional.) An EnvironmentPool providing the process, to which
+        `close` returns it.
+      timeout: (Optional.) Number of seconds after which waiting for a result
+        of the process fails with a WorkerError.
 
     Attributes:
       observation_spec: The cached observation spec of the environment.
@@ -196,19 +763,53 @@ class ProcessPyEnvironment(object):
     """
     self._env_constructor = env_constructor
     self._flatten = flatten
+    self._auto_reset = auto_reset
+    self._context = context or multiprocessing
+    self._pool = pool
+    self._timeout = timeout
+    self._conn = None
+    self._process = None
     self._observation_spec = None
     self._action_spec = None
     self._time_step_spec = None
+    if self._pool is None:
+      atexit.register(self.close)
 
-  def start(self):
-    """Start the process."""
-    self._conn, conn = multiprocessing.Pipe()
-    self._process = multiprocessing.Process(
-        target=self._worker,
-        args=(conn, self._env_constructor, self._flatten))
-    atexit.register(self.close)
-    self._process.start()
-    result = self._conn.recv()
+  def start(self, wait_to_start=True):
+    """Start the process.
+
+    Args:
+      wait_to_start: Whether to wait for the environment to be created. When
+        False, `wait_start` must be called before using the environment, which
+        lets several processes start concurrently.
+    """
+    if self._pool is not None:
+      self._process, self._conn = self._pool.acquire()
+      self._conn.send((self._CREATE, (self._env_constructor, self._flatten,
+                                      self._auto_reset)))
+    else:
+      self._conn, conn = self._context.Pipe()
+      self._process = self._context.Process(
+          target=type(self)._worker,
+          args=(conn, self._env_constructor, self._flatten, self._auto_reset))
+      self._process.start()
+      # Only the worker holds its end, so that its death closes the pipe.
+      conn.close()
+    if wait_to_start:
+      self.wait_start()
+
+  def wait_start(self):
+    """Wait for the environment of a started process to be created.
+
+    Raises:
+      Exception: The environment could not be created.
+    """
+    try:
+      result = self._conn.recv()
+    except EOFError:
+      result = WorkerError('The environment process died while starting.')
+    if isinstance(result, tuple) and result[0] == self._EXCEPTION:
+      result = WorkerError(result[1])
     if isinstance(result, Exception):
       self._conn.close()
       self._process.join(5)
@@ -257,11 +858,74 @@ class ProcessPyEnvironment(object):
       Promise object that blocks and provides the return value when called.
     """
     payload = name, args, kwargs
-    self._conn.send((self._CALL, payload))
+    try:
+      self._conn.send((self._CALL, payload))
+    except IOError as e:
+      error = WorkerError('Could not reach the environment process: {}'.format(
+          e))
+      def _raise_error():
+        raise error
+      return _raise_error
     return self._receive
 
+  def fileno(self):
+    """File descriptor of the pipe, to wait for results with select.
+
+    This lets `multiprocessing.connection.wait`, or `select`, wait on
+    environments directly.
+
+    Returns:
+      The file descriptor of the connection to the worker process.
+    """
+    return self._conn.fileno()
+
+  def share_time_steps(self, paths, rows):
+    """Makes the worker write its time steps to a SharedBatch.
+
+    The results of `step` and `reset` are then None, and the time steps are
+    read from the shared batch instead.
+
+    Args:
+      paths: Paths of the flat arrays of a SharedBatch of time steps.
+      rows: Index or slice of the rows of the batch written by this worker.
+    """
+    self._conn.send((self._SHARE, (paths, rows)))
+    self._receive()
+
+  def restart(self):
+    """Kill the process and start a new one with the environment constructor.
+
+    A process from an EnvironmentPool is not returned to the pool, a new one is
+    acquired instead.
+    """
+    if self._process.is_alive():
+      self._process.terminate()
+    self._process.join(5)
+    try:
+      self._conn.close()
+    except IOError:
+      pass
+    self._conn = None
+    self.start()
+
   def close(self):
-    """Send a close message to the external process and join it."""
+    """Send a close message to the external process and join it.
+
+    A process from an EnvironmentPool closes the environment instead, and
+    returns to the pool.
+    """
+    if self._conn is None:
+      return
+    if self._pool is not None:
+      conn, self._conn = self._conn, None
+      try:
+        conn.send((self._RELEASE, None))
+        conn.recv()
+      except (IOError, EOFError):
+        # The process died, it is not returned to the pool.
+        return
+      self._pool.release(self._process, conn)
+      return
     try:
       self._conn.send((self._CLOSE, None))
       self._conn.close()
@@ -279,6 +943,8 @@ class ProcessPyEnvironment(object):
 
     Returns:
       time step when blocking, otherwise callable that returns the time step.
+      With auto_reset, the time step is paired with the first time step of
+      the new episode when the episode ended, or None.
     """
     promise = self.call('step', action)
     if blocking:
@@ -305,70 +971,155 @@ class ProcessPyEnvironment(object):
   def _receive(self):
     """Wait for a message from the worker process and return its payload.
 
+    The process is checked to be alive while waiting.
+
     Raises:
-      Exception: An exception was raised inside the worker process.
+      WorkerError: An exception was raised inside the worker process, the
+        process died, or it did not answer within the timeout.
       KeyError: The reveived message is of an unknown type.
 
     Returns:
       Payload object of the message.
     """
-    message, payload = self._conn.recv()
+    deadline = None if self._timeout is None else time.time() + self._timeout
+    interval = self._LIVENESS_INTERVAL
+    if self._timeout is not None:
+      interval = min(interval, self._timeout)
+    while not self._conn.poll(interval):
+      if not self._process.is_alive():
+        raise WorkerError('The environment process died with exit code '
+                          '{}.'.format(self._process.exitcode))
+      if deadline is not None and time.time() > deadline:
+        _raise_timeout(self._timeout)
+    try:
+      message, payload = self._conn.recv()
+    except EOFError:
+      raise WorkerError('The environment process closed its connection.')
     # Re-raise exceptions in the main process.
     if message == self._EXCEPTION:
       stacktrace = payload
-      raise Exception(stacktrace)
+      raise WorkerError(stacktrace)
     if message == self._RESULT:
       return payload
     self.close()
     raise KeyError('Received message of unexpected type {}'.format(message))
 
-  def _worker(self, conn, env_constructor, flatten=False):
+  @classmethod
+  def _worker(cls, conn, env_constructor, flatten=False, auto_reset=False):
     """The process waits for actions and sends back environment results.
 
+    A worker of an EnvironmentPool starts without environment. It waits for the
+    constructor, and goes back to waiting for one when the environment is
+    released.
+
     Args:
       conn: Connection for communication to the main process.
-      env_constructor: env_constructor for the OpenAI Gym environment.
+      env_constructor: env_constructor for the OpenAI Gym environment, or None
+        to wait for one.
       flatten: Boolean, whether to assume flattened actions and time_steps
         during communication to avoid overhead.
+      auto_reset: Boolean, whether to reset the environment right after a step
+        ending an episode, and send both time steps.
 
     Raises:
       KeyError: When receiving a message of unknown type.
     """
     try:
-      env = env_constructor()
-      action_spec = env.action_spec()
-      conn.send(self._READY)  # Ready.
       while True:
-        try:
-          # Only block for short times to have keyboard exceptions be raised.
-          if not conn.poll(0.1):
-            continue
-          message, payload = conn.recv()
-        except (EOFError, KeyboardInterrupt):
-          break
-        if message == self._ACCESS:
-          name = payload
-          result = getattr(env, name)
-          conn.send((self._RESULT, result))
-          continue
-        if message == self._CALL:
-          name, args, kwargs = payload
-          if flatten and name == 'step':
-            args = [nest.pack_sequence_as(action_spec, args[0])]
-          result = getattr(env, name)(*args, **kwargs)
-          if flatten and name in ['step', 'reset']:
-            result = nest.flatten(result)
-          conn.send((self._RESULT, result))
-          continue
-        if message == self._CLOSE:
-          assert payload is None
+        if env_constructor is None:
+          message, payload = cls._wait_for_message(conn)
+          if message in [None, cls._CLOSE]:
+            break
+          if message != cls._CREATE:
+            raise KeyError('Received message of unknown type {}'.format(
+                message))
+          env_constructor, flatten, auto_reset = payload
+        env = env_constructor()
+        conn.send(cls._READY)  # Ready.
+        if not cls._serve(conn, env, flatten, auto_reset):
           break
-        raise KeyError('Received message of unknown type {}'.format(message))
+        env.close()
+        env_constructor = None
+        conn.send((cls._RESULT, None))
     except Exception:  # pylint: disable=broad-except
       etype, evalue, tb = sys.exc_info()
       stacktrace = ''.join(traceback.format_exception(etype, evalue, tb))
       message = 'Error in environment process: {}'.format(stacktrace)
       tf.logging.error(message)
-      conn.send((self._EXCEPTION, stacktrace))
+      conn.send((cls._EXCEPTION, stacktrace))
     finally:
       conn.close()
+
+  @classmethod
+  def _wait_for_message(cls, conn):
+    """Returns the next message, or (None, None) if the pipe was closed."""
+    while True:
+      try:
+        # Only block for short times to have keyboard exceptions be raised.
+        if conn.poll(0.1):
+          return conn.recv()
+      except (EOFError, KeyboardInterrupt):
+        return None, None
+
+  @classmethod
+  def _serve(cls, conn, env, flatten, auto_reset):
+    """Serves the requests on an environment until it is closed or released.
+
+    Args:
+      conn: Connection for communication to the main process.
+      env: The environment.
+      flatten: Boolean, whether to assume flattened actions and time_steps
+        during communication to avoid overhead.
+      auto_reset: Boolean, whether to reset the environment right after a step
+        ending an episode, and send both time steps.
+
+    Returns:
+      True if the environment was released, False if the worker must exit.
+
+    Raises:
+      KeyError: When receiving a message of unknown type.
+    """
+    action_spec = env.action_spec()
+    # Flat arrays of a SharedBatch and rows of this worker, when shared.
+    shared_arrays = None
+    shared_rows = None
+    while True:
+      message, payload = cls._wait_for_message(conn)
+      if message is None:
+        return False
+      if message == cls._ACCESS:
+        name = payload
+        result = getattr(env, name)
+        conn.send((cls._RESULT, result))
+        continue
+      if message == cls._CALL:
+        name, args, kwargs = payload
+        if flatten and name == 'step':
+          args = [nest.pack_sequence_as(action_spec, args[0])]
+        result = getattr(env, name)(*args, **kwargs)
+        reset_result = None
+        if auto_reset and name == 'step' and result.is_last():
+          reset_result = env.reset()
+        if shared_arrays and name in ['step', 'reset']:
+          for array, value in zip(shared_arrays, nest.flatten(result)):
+            array[shared_rows] = value
+          result = None
+        elif flatten and name in ['step', 'reset']:
+          result = nest.flatten(result)
+          if reset_result is not None:
+            reset_result = nest.flatten(reset_result)
+        if auto_reset and name == 'step':
+          result = (result, reset_result)
+        conn.send((cls._RESULT, result))
+        continue
+      if message == cls._SHARE:
+        paths, shared_rows = payload
+        shared_arrays = open_shared_arrays(paths)
+        conn.send((cls._RESULT, None))
+        continue
+      if message == cls._RELEASE:
+        return True
+      if message == cls._CLOSE:
+        assert payload is None
+        return False
+      raise KeyError('Received message of unknown type {}'.format(message))
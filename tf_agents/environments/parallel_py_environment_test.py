@@ -21,6 +21,8 @@ from __future__ import print_function
 
 import collections
 import functools
+import os
+import time
 
 import numpy as np
 import tensorflow as tf
@@ -33,11 +35,14 @@ from tf_agents.specs import array_spec
 
 class ParallelPyEnvironmentTest(tf.test.TestCase):
 
-  def _make_parallel_py_environment(self, constructor=None, num_envs=2):
+  def setUp(self):
+    super(ParallelPyEnvironmentTest, self).setUp()
     self.observation_spec = array_spec.ArraySpec((3, 3), np.float32)
     self.time_step_spec = ts.time_step_spec(self.observation_spec)
     self.action_spec = array_spec.BoundedArraySpec(
         [7], dtype=np.float32, minimum=-1.0, maximum=1.0)
+
+  def _make_parallel_py_environment(self, constructor=None, num_envs=2):
     constructor = constructor or functools.partial(
         random_py_environment.RandomPyEnvironment,
         self.observation_spec,
@@ -45,6 +50,19 @@ class ParallelPyEnvironmentTest(tf.test.TestCase):
     return parallel_py_environment.ParallelPyEnvironment(
         env_constructors=[constructor] * num_envs, blocking=True)
 
+  def _make_constructors(self, num_envs, **kwargs):
+    """Returns constructors of RandomPyEnvironments with different seeds."""
+    return [
+        functools.partial(random_py_environment.RandomPyEnvironment,
+                          self.observation_spec, self.action_spec, seed=seed,
+                          **kwargs)
+        for seed in range(num_envs)]
+
+  def _sample_actions(self, num_envs):
+    rng = np.random.RandomState()
+    return np.array([array_spec.sample_bounded_spec(self.action_spec, rng)
+                     for _ in range(num_envs)])
+
   def test_close_no_hang_after_init(self):
     env = self._make_parallel_py_environment()
     env.close()
@@ -80,6 +98,233 @@ class ParallelPyEnvironmentTest(tf.test.TestCase):
                         time_step2.observation.shape)
     env.close()
 
+  def test_step_shared_memory(self):
+    constructors = self._make_constructors(3)
+    env = parallel_py_environment.ParallelPyEnvironment(
+        constructors, blocking=True)
+    shared_env = parallel_py_environment.ParallelPyEnvironment(
+        constructors, shared_memory=True)
+    action = self._sample_actions(3)
+
+    # The time steps written to shared memory match the ones sent by pipes.
+    for time_step, shared_time_step in [
+        (env.reset(), shared_env.reset()),
+        (env.step(action), shared_env.step(action)),
+        (env.step(action), shared_env.step(action))]:
+      self.assertEqual(np.float32, shared_time_step.observation.dtype)
+      for array, shared_array in zip(time_step, shared_time_step):
+        self.assertAllEqual(array, shared_array)
+    env.close()
+    shared_env.close()
+
+  def test_step_double_buffered(self):
+    constructors = self._make_constructors(3)
+    env = parallel_py_environment.ParallelPyEnvironment(
+        constructors, blocking=True)
+    buffered_envs = [
+        parallel_py_environment.ParallelPyEnvironment(
+            constructors, flatten=True, double_buffered=True),
+        parallel_py_environment.ParallelPyEnvironment(
+            constructors, shared_memory=True, double_buffered=True)]
+    action = self._sample_actions(3)
+
+    expected = [env.reset(), env.step(action), env.step(action)]
+    for buffered_env in buffered_envs:
+      time_step = buffered_env.reset()
+      for expected_time_step in expected:
+        for array, expected_array in zip(time_step, expected_time_step):
+          self.assertAllEqual(expected_array, array)
+        next_time_step = buffered_env.step(action)
+        # The batch being returned is not the one of the previous step.
+        self.assertIsNot(time_step, next_time_step)
+        time_step = next_time_step
+      buffered_env.close()
+    env.close()
+
+  def test_step_envs_per_worker(self):
+    constructors = self._make_constructors(4)
+    env = parallel_py_environment.ParallelPyEnvironment(
+        constructors, blocking=True)
+    grouped_envs = [
+        parallel_py_environment.ParallelPyEnvironment(
+            constructors, envs_per_worker=2, flatten=True),
+        parallel_py_environment.ParallelPyEnvironment(
+            constructors, envs_per_worker=2, shared_memory=True),
+        parallel_py_environment.ParallelPyEnvironment(
+            constructors, envs_per_worker=2, double_buffered=True)]
+    self.assertEqual(2, len(grouped_envs[0]._envs))
+    self.assertEqual(4, grouped_envs[0].batch_size)
+    action = self._sample_actions(4)
+
+    # Each env keeps its row of the batch.
+    expected = [env.reset(), env.step(action), env.step(action)]
+    for grouped_env in grouped_envs:
+      time_step = grouped_env.reset()
+      for expected_time_step in expected:
+        for array, expected_array in zip(time_step, expected_time_step):
+          self.assertAllEqual(expected_array, array)
+        time_step = grouped_env.step(action)
+      grouped_env.close()
+    env.close()
+
+  def test_envs_per_worker_must_divide_num_envs(self):
+    with self.assertRaises(ValueError):
+      parallel_py_environment.ParallelPyEnvironment(
+          [random_py_environment.RandomPyEnvironment] * 3, envs_per_worker=2)
+
+  def test_step_auto_reset(self):
+    constructors = self._make_constructors(3, episode_end_probability=0.5)
+    action = self._sample_actions(3)
+    for flatten in [False, True]:
+      env = parallel_py_environment.ParallelPyEnvironment(
+          constructors, flatten=flatten, auto_reset=True)
+      self.assertTrue(env.auto_reset)
+      env.reset()
+      num_ended = 0
+      for _ in range(20):
+        time_step = env.step(action)
+        current_time_step = env.current_time_step()
+        # Steps never start episodes, the ended ones were reset right away.
+        self.assertFalse(np.any(time_step.is_first()))
+        is_last = time_step.is_last()
+        self.assertAllEqual(is_last, current_time_step.is_first())
+        self.assertAllEqual(time_step.observation[~is_last],
+                            current_time_step.observation[~is_last])
+        num_ended += np.sum(is_last)
+      self.assertGreater(num_ended, 0)
+      env.close()
+
+  def test_auto_reset_requires_pipes(self):
+    with self.assertRaises(ValueError):
+      parallel_py_environment.ParallelPyEnvironment(
+          [random_py_environment.RandomPyEnvironment] * 2, shared_memory=True,
+          auto_reset=True)
+
+  def test_start_with_forkserver(self):
+    env = parallel_py_environment.ParallelPyEnvironment(
+        self._make_constructors(3), start_method='forkserver',
+        preload_modules=['numpy'])
+    env.reset()
+    time_step = env.step(np.zeros((3, 7), np.float32))
+    self.assertEqual((3, 3, 3), time_step.observation.shape)
+    env.close()
+
+  def test_preload_modules_require_forkserver(self):
+    with self.assertRaises(ValueError):
+      parallel_py_environment.worker_context('spawn', ['numpy'])
+
+  def test_environment_pool_reuses_workers(self):
+    constructors = self._make_constructors(2)
+    pool = parallel_py_environment.EnvironmentPool(num_workers=2)
+    train_env = parallel_py_environment.ParallelPyEnvironment(
+        constructors, pool=pool)
+    self.assertEqual(0, pool.num_idle)
+    pids = set(env._process.pid for env in train_env._envs)
+    train_env.reset()
+    train_env.close()
+    self.assertEqual(2, pool.num_idle)
+
+    # The eval environments are created in the same processes.
+    eval_env = parallel_py_environment.ParallelPyEnvironment(
+        constructors, flatten=True, pool=pool)
+    self.assertEqual(pids, set(env._process.pid for env in eval_env._envs))
+    eval_env.reset()
+    time_step = eval_env.step(np.zeros((2, 7), np.float32))
+    self.assertEqual((2, 3, 3), time_step.observation.shape)
+    eval_env.close()
+    pool.close()
+    self.assertEqual(0, pool.num_idle)
+
+  def test_restart_failed_workers(self):
+    constructors = [
+        functools.partial(MockEnvironmentCrashInStep, crash_at_step=2),
+        functools.partial(MockEnvironmentFailInStep, fail_at_step=2),
+        functools.partial(MockEnvironmentFailInStep, fail_at_step=2,
+                          hang=True),
+        functools.partial(MockEnvironmentCrashInStep, crash_at_step=10)]
+    env = parallel_py_environment.ParallelPyEnvironment(
+        constructors, restart_workers=True, step_timeout=2)
+    action = np.zeros((4, 1), np.float32)
+    env.reset()
+    time_step = env.step(action)
+    self.assertAllEqual([ts.StepType.MID] * 4, time_step.step_type)
+
+    # The failed workers restart and begin a new episode in their slot.
+    time_step = env.step(action)
+    self.assertAllEqual(
+        [ts.StepType.FIRST] * 3 + [ts.StepType.MID], time_step.step_type)
+    self.assertEqual(3, env.num_restarts)
+    time_step = env.step(action)
+    self.assertAllEqual([ts.StepType.MID] * 4, time_step.step_type)
+    env.close()
+
+  def test_step_wait_restarts_hung_workers(self):
+    constructors = [
+        functools.partial(MockEnvironmentFailInStep, fail_at_step=2,
+                          hang=True),
+        functools.partial(MockEnvironmentCrashInStep, crash_at_step=10)]
+    env = parallel_py_environment.ParallelPyEnvironment(
+        constructors, restart_workers=True, step_timeout=2)
+    action = np.zeros((2, 1), np.float32)
+    env.reset()
+    env.step_async(action)
+    env.step_wait()
+    env.step_async(action)
+    # The hung worker is restarted once its step times out, even though
+    # step_wait has no timeout.
+    time_step, env_ids = env.step_wait()
+    self.assertAllEqual([0, 1], env_ids)
+    self.assertAllEqual([ts.StepType.FIRST, ts.StepType.MID],
+                        time_step.step_type)
+    self.assertEqual(1, env.num_restarts)
+    env.close()
+
+  def test_step_async(self):
+    constructors = self._make_constructors(4)
+    env = parallel_py_environment.ParallelPyEnvironment(
+        constructors, blocking=True)
+    async_envs = [
+        parallel_py_environment.ParallelPyEnvironment(constructors),
+        parallel_py_environment.ParallelPyEnvironment(
+            constructors, envs_per_worker=2, shared_memory=True)]
+    action = self._sample_actions(4)
+    env.reset()
+    expected = env.step(action)
+
+    for async_env in async_envs:
+      async_env.reset()
+      async_env.step_async(action[2:], env_ids=[2, 3])
+      with self.assertRaises(ValueError):
+        async_env.step_async(action[2:], env_ids=[2, 3])
+      with self.assertRaises(ValueError):
+        async_env.step(action)
+      async_env.step_async(action[:2], env_ids=[0, 1])
+      time_steps = []
+      env_ids = []
+      while len(env_ids) < 4:
+        time_step, ready_ids = async_env.step_wait(min_ready=1)
+        self.assertEqual(len(ready_ids), len(time_step.observation))
+        time_steps.append(time_step)
+        env_ids.extend(ready_ids)
+      # Each env finished its step once, with the time step of its row.
+      self.assertEqual([0, 1, 2, 3], sorted(env_ids))
+      for array, expected_array in zip(
+          ts.TimeStep(*[np.concatenate(x) for x in zip(*time_steps)]),
+          expected):
+        self.assertAllEqual(expected_array[env_ids], array)
+      with self.assertRaises(ValueError):
+        async_env.step_wait()
+      async_env.close()
+    env.close()
+
+  def test_step_async_env_ids_must_cover_workers(self):
+    grouped_env = parallel_py_environment.ParallelPyEnvironment(
+        self._make_constructors(4), envs_per_worker=2)
+    grouped_env.reset()
+    with self.assertRaises(ValueError):
+      grouped_env.step_async(np.zeros((2, 7), np.float32), env_ids=[1, 2])
+    grouped_env.close()
+
   def test_unstack_actions(self):
     num_envs = 2
     env = self._make_parallel_py_environment(num_envs=num_envs)
@@ -157,6 +402,27 @@ class ProcessPyEnvironmentTest(tf.test.TestCase):
     with self.assertRaises(Exception):
       env.reset()
 
+  def test_raise_when_process_dies(self):
+    constructor = functools.partial(MockEnvironmentFailInStep, fail_at_step=1)
+    env = parallel_py_environment.ProcessPyEnvironment(constructor)
+    env.start()
+    env.reset()
+    with self.assertRaises(parallel_py_environment.WorkerError):
+      env.step(np.zeros(1, np.float32))
+    env.close()
+
+  def test_raise_on_timeout(self):
+    constructor = functools.partial(
+        MockEnvironmentFailInStep, fail_at_step=1, hang=True)
+    env = parallel_py_environment.ProcessPyEnvironment(constructor, timeout=1)
+    env.start()
+    env.reset()
+    with self.assertRaises(parallel_py_environment.WorkerError):
+      env.step(np.zeros(1, np.float32))
+    env.restart()
+    env.reset()
+    env.close()
+
   def test_reraise_exception_in_step(self):
     constructor = functools.partial(
         MockEnvironmentCrashInStep, crash_at_step=3)
@@ -215,5 +481,29 @@ class MockEnvironmentCrashInStep(random_py_environment.RandomPyEnvironment):
     return transition
 
 
+class MockEnvironmentFailInStep(random_py_environment.RandomPyEnvironment):
+  """Kill the process, or hang, after specified number of steps."""
+
+  def __init__(self, fail_at_step, hang=False):
+    super(MockEnvironmentFailInStep, self).__init__(
+        array_spec.ArraySpec((3, 3), np.float32),
+        array_spec.BoundedArraySpec([1], np.float32, minimum=-1.0, maximum=1.0),
+        episode_end_probability=0,
+        min_duration=fail_at_step + 1,
+        max_duration=fail_at_step + 1)
+    self._fail_at_step = fail_at_step
+    self._hang = hang
+    self._steps = 0
+
+  def step(self, *args, **kwargs):
+    self._steps += 1
+    if self._steps == self._fail_at_step:
+      if self._hang:
+        time.sleep(60)
+      else:
+        os._exit(1)  # pylint: disable=protected-access
+    return super(MockEnvironmentFailInStep, self).step(*args, **kwargs)
+
+
 if __name__ == '__main__':
   tf.test.main()
@@ -26,10 +26,14 @@ from __future__ import division
 from __future__ import print_function
 
 import abc
+import numpy as np
 import six
+import tensorflow as tf
 
 from tf_agents.environments import time_step as ts
 
+nest = tf.contrib.framework.nest
+
 
 @six.add_metaclass(abc.ABCMeta)
 class Base(object):
@@ -197,3 +201,118 @@ class Base(object):
     """
     del mode  # unused
     raise NotImplementedError('No rendering support.')
+
+
+@six.add_metaclass(abc.ABCMeta)
+class VectorizedBase(Base):
+  """Base class for environments natively simulating a batch of environments.
+
+  Instead of looping over non-batched environments, subclasses implement the
+  dynamics of all the environments at once over `[batch_size, ...]` arrays, in
+  `_step` and `_reset`.
+
+  Each environment of the batch resets on its own: at the `step` following a
+  `LAST` time step of an environment, its row starts a new episode and its
+  action is ignored, while the other rows keep going.
+
+  Episodes which terminate get a discount of 0. Episodes which are truncated,
+  e.g. by a time limit, keep the discount so that their value is bootstrapped,
+  as with the `TimeLimit` wrapper.
+  """
+
+  def __init__(self, batch_size, discount=1.0):
+    """Initializes the batch of environments.
+
+    Args:
+      batch_size: Number of environments simulated.
+      discount: Discount of the time steps which are not `LAST`.
+    """
+    self._batch_size = batch_size
+    self._discount = np.float32(discount)
+    self._needs_reset = np.ones(batch_size, dtype=np.bool_)
+
+  @property
+  def batched(self):
+    return True
+
+  @property
+  def batch_size(self):
+    return self._batch_size
+
+  def reset(self):
+    """Starts a new episode in all the environments.
+
+    Returns:
+      A batched `TimeStep` with `step_type` `FIRST` in all the rows.
+    """
+    observation = self._reset(np.arange(self._batch_size))
+    self._needs_reset[:] = False
+    return ts.restart(observation, self._batch_size)
+
+  def step(self, action):
+    """Steps all the environments, restarting the ones which ended.
+
+    Args:
+      action: A batched NumPy array, or a nested dict, list or tuple of
+        batched arrays corresponding to `action_spec()`.
+
+    Returns:
+      A batched `TimeStep`, whose rows are `FIRST` for the environments that
+      were reset.
+    """
+    if self._needs_reset.all():
+      return self.reset()
+    result = self._step(action)
+    observation, reward, done = result[:3]
+    done = np.array(done, dtype=np.bool_)
+    truncated = np.zeros_like(done)
+    if len(result) > 3:
+      truncated = np.asarray(result[3], dtype=np.bool_) & ~done
+    reward = np.array(reward, dtype=np.float32)
+    step_type = np.where(done | truncated, ts.StepType.LAST, ts.StepType.MID)
+    discount = np.where(done, np.float32(0), self._discount)
+    done |= truncated
+
+    reset_ids = np.flatnonzero(self._needs_reset)
+    if reset_ids.size:
+      def _set_rows(array, value):
+        array[reset_ids] = value
+      nest.map_structure(_set_rows, observation, self._reset(reset_ids))
+      step_type[reset_ids] = ts.StepType.FIRST
+      reward[reset_ids] = 0
+      discount[reset_ids] = 1
+      done[reset_ids] = False
+    self._needs_reset = done
+    return ts.TimeStep(step_type, reward, discount, observation)
+
+  @abc.abstractmethod
+  def _reset(self, env_ids):
+    """Starts new episodes in some of the environments.
+
+    Args:
+      env_ids: Array of the rows of the environments to reset.
+
+    Returns:
+      The first observations of these environments, a nest of arrays
+      corresponding to `observation_spec()` with an outer dimension of the size
+      of env_ids.
+    """
+
+  @abc.abstractmethod
+  def _step(self, action):
+    """Steps all the environments.
+
+    Rows being reset at this step are stepped too, from their ended episode,
+    then their results are replaced by the ones of `_reset`.
+
+    Args:
+      action: A batched NumPy array, or a nested dict, list or tuple of
+        batched arrays corresponding to `action_spec()`.
+
+    Returns:
+      A tuple (observation, reward, done) of batched arrays: a nest of
+      writable observation arrays corresponding to `observation_spec()`, the
+      rewards, and booleans set for the environments whose episode
+      terminated. A fourth array of booleans can be returned, set for the
+      environments whose episode was truncated without terminating.
+    """
@@ -171,3 +171,88 @@ class RandomPyEnvironment(py_environment.Base):
           format(mode))
 
     return self._rng.randint(0, 256, size=self._render_size, dtype=np.uint8)
+
+
+class VectorizedRandomPyEnvironment(py_environment.VectorizedBase):
+  """Randomly generates a batch of observations with vectorized NumPy calls.
+
+  Unlike `RandomPyEnvironment` with a `batch_size`, whose episodes end at the
+  same time for the whole batch, the episode of each row ends on its own and
+  the row resets automatically.
+  """
+
+  def __init__(self,
+               observation_spec,
+               action_spec=None,
+               batch_size=1,
+               episode_end_probability=0.1,
+               discount=1.0,
+               reward_fn=None,
+               seed=42,
+               min_duration=0,
+               max_duration=None):
+    """Initializes the environment.
+
+    Args:
+      observation_spec: An `ArraySpec`, or a nested dict, list or tuple of
+        `ArraySpec`s.
+      action_spec: An `ArraySpec`, or a nested dict, list or tuple of
+        `ArraySpec`s.
+      batch_size: Number of environments simulated.
+      episode_end_probability: Probability an episode will end when the
+        environment is stepped.
+      discount: Discount to set in time_steps.
+      reward_fn: Callable that takes in the batched step_type, action and
+        observation, and returns a numpy array of rewards of size batch_size.
+      seed: Seed to use for rng used in observation generation.
+      min_duration: Number of steps at the beginning of the
+        episode during which the episode can not terminate.
+      max_duration: Optional number of steps after which the episode
+        terminates regarless of the termination probability.
+    """
+    super(VectorizedRandomPyEnvironment, self).__init__(batch_size, discount)
+    self._observation_spec = observation_spec
+    self._action_spec = action_spec or []
+    self._episode_end_probability = episode_end_probability
+    self._reward_fn = reward_fn
+    self._min_duration = min_duration
+    self._max_duration = max_duration
+    self._rng = np.random.RandomState(seed)
+    self._steps = np.zeros(batch_size, dtype=np.int64)
+
+  def _get_observation(self, num_envs):
+    return array_spec.sample_spec_nest(self._observation_spec, self._rng,
+                                       (num_envs,))
+
+  def _reset(self, env_ids):
+    self._steps[env_ids] = 0
+    return self._get_observation(len(env_ids))
+
+  def _step(self, action):
+    if self._action_spec:
+      nest.assert_same_structure(self._action_spec, action)
+
+    self._steps += 1
+    observation = self._get_observation(self._batch_size)
+    done = self._rng.uniform(size=self._batch_size) < (
+        self._episode_end_probability)
+    done &= self._steps >= self._min_duration
+    if self._max_duration:
+      done |= self._steps >= self._max_duration
+
+    if self._reward_fn is None:
+      reward = np.zeros(self._batch_size, dtype=np.float32)
+    else:
+      step_type = np.where(done, ts.StepType.LAST, ts.StepType.MID)
+      reward = self._reward_fn(step_type, action, observation)
+      if np.asarray(reward).shape != (self._batch_size,):
+        raise ValueError(
+            '%r != %r. Size of reward must equal the batch size.' %
+            (np.asarray(reward).shape, self._batch_size))
+    return observation, reward, done
+
+  def observation_spec(self):
+    return self._observation_spec
+
+  def action_spec(self):
+    return self._action_spec
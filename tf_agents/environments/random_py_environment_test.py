@@ -172,5 +172,75 @@ class RandomPyEnvironmentTest(parameterized.TestCase, absltest.TestCase):
       env.step([0])
 
 
+class VectorizedRandomPyEnvironmentTest(parameterized.TestCase,
+                                        absltest.TestCase):
+
+  def testRowsResetAutomatically(self):
+    batch_size = 8
+    obs_spec = array_spec.BoundedArraySpec((2, 3), np.int32, -10, 10)
+    env = random_py_environment.VectorizedRandomPyEnvironment(
+        obs_spec, batch_size=batch_size, episode_end_probability=0.3)
+    action = np.zeros(batch_size)
+
+    time_step = env.step(action)
+    self.assertTrue(np.all(time_step.is_first()))
+    saw_mixed_batch = False
+    for _ in range(50):
+      next_time_step = env.step(action)
+      self.assertEqual((batch_size, 2, 3), next_time_step.observation.shape)
+      self.assertTrue(np.all(next_time_step.observation >= -10))
+      self.assertTrue(np.all(next_time_step.observation <= 10))
+      # Exactly the rows which ended restart, the others keep going.
+      np.testing.assert_array_equal(time_step.is_last(),
+                                    next_time_step.is_first())
+      np.testing.assert_array_equal(next_time_step.is_last(),
+                                    next_time_step.discount == 0)
+      self.assertTrue(np.all(next_time_step.reward[
+          next_time_step.is_first()] == 0))
+      saw_mixed_batch |= 0 < np.sum(next_time_step.is_first()) < batch_size
+      time_step = next_time_step
+    self.assertTrue(saw_mixed_batch)
+
+  @parameterized.named_parameters([
+      ('MinDuration', 5, None),
+      ('MaxDuration', 0, 3),
+  ])
+  def testEpisodeDuration(self, min_duration, max_duration):
+    batch_size = 4
+    obs_spec = array_spec.BoundedArraySpec((2, 3), np.int32, -10, 10)
+    env = random_py_environment.VectorizedRandomPyEnvironment(
+        obs_spec, batch_size=batch_size, episode_end_probability=0.5,
+        min_duration=min_duration, max_duration=max_duration)
+    num_steps = np.zeros(batch_size)
+    env.reset()
+    for _ in range(100):
+      time_step = env.step(np.zeros(batch_size))
+      num_steps = np.where(time_step.is_first(), 0, num_steps + 1)
+      lengths = num_steps[time_step.is_last()]
+      self.assertTrue(np.all(lengths >= min_duration))
+      if max_duration:
+        self.assertTrue(np.all(lengths <= max_duration))
+
+  def testRewardFnCalled(self):
+    batch_size = 3
+
+    def reward_fn(unused_step_type, action, unused_observation):
+      return action
+
+    obs_spec = array_spec.BoundedArraySpec((1,), np.int32, -10, 10)
+    env = random_py_environment.VectorizedRandomPyEnvironment(
+        obs_spec, batch_size=batch_size, reward_fn=reward_fn,
+        episode_end_probability=0)
+    env.reset()
+    time_step = env.step(np.arange(batch_size))
+    self.assertSequenceAlmostEqual([0., 1., 2.], time_step.reward)
+
+    env = random_py_environment.VectorizedRandomPyEnvironment(
+        obs_spec, batch_size=batch_size, reward_fn=lambda *_: 1.0)
+    env.reset()
+    with self.assertRaises(ValueError):
+      env.step(np.arange(batch_size))
+
+
 if __name__ == '__main__':
   absltest.main()
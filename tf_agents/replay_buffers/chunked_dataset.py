@@ -0,0 +1,378 @@
+# coding=utf-8
+# Copyright 2018 The TF-Agents Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Chunked on-disk datasets of replay buffer items.
+
+A dataset is a directory holding `num_shards` shard files and an index. Items
+are written in chunks of consecutive items of the same stream, e.g. of the
+same environment of a batch. Each chunk is stored column by column: one block
+of bytes per flat leaf of the data_spec, optionally compressed with zlib. The
+index, a JSON file, records the flat specs and the offset and length of every
+block, so that a chunk is read without scanning its shard.
+
+Datasets can be exported from a replay buffer,
+
+  with ChunkedDatasetWriter(directory, replay_buffer.data_spec) as writer:
+    writer.write(py_replay_buffer.gather_all())
+    # Or, for a TF replay buffer.
+    writer.write(sess.run(tf_replay_buffer.gather_all()))
+
+or written live by passing a writer as an observer to a `PyDriver`. They are
+read back with `read_items`, e.g. to warm start a Python replay buffer, or
+streamed with `as_dataset` for offline training.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import json
+import os
+import zlib
+
+import numpy as np
+import tensorflow as tf
+
+from tf_agents.specs import array_spec
+from tf_agents.specs import tensor_spec
+from tf_agents.utils import nest_utils
+
+nest = tf.contrib.framework.nest
+
+INDEX_FILENAME = 'index.json'
+_COMPRESSIONS = (None, 'zlib')
+
+
+def _shard_filename(shard_id, num_shards):
+  return 'shard-{:05d}-of-{:05d}'.format(shard_id, num_shards)
+
+
+def _flat_array_specs(data_spec):
+  """Returns the flat ArraySpecs of a nest of ArraySpecs or TensorSpecs."""
+  def to_array_spec(spec):
+    if isinstance(spec, array_spec.ArraySpec):
+      return spec
+    if isinstance(spec, tensor_spec.TensorSpec):
+      return tensor_spec.to_array_spec(spec)
+    raise ValueError('The data_spec parameter must be a nest of ArraySpecs or '
+                     'TensorSpecs. Got: {}'.format(data_spec))
+  return [to_array_spec(spec) for spec in nest.flatten(data_spec)]
+
+
+def _spec_to_json(spec):
+  return {'shape': [int(d) for d in spec.shape],
+          'dtype': np.dtype(spec.dtype).str,
+          'name': spec.name}
+
+
+class ChunkedDatasetWriter(object):
+  """Writes items to a chunked dataset.
+
+  Items are accumulated per stream until `chunk_size` of them are available,
+  and each full chunk is appended to the next shard in turn. The index is
+  written by `flush` and `close`, so a dataset is only readable up to the last
+  of these calls.
+
+  The writer can be used as an observer, e.g. of a `PyDriver`.
+  """
+
+  def __init__(self,
+               directory,
+               data_spec,
+               num_shards=1,
+               chunk_size=1000,
+               compression=None):
+    """Creates a ChunkedDatasetWriter.
+
+    Args:
+      directory: Directory of the dataset, created if needed. Existing shards
+        and index are overwritten.
+      data_spec: An ArraySpec, TensorSpec or a nest of them describing a
+        single item.
+      num_shards: Number of shard files to spread the chunks over.
+      chunk_size: Number of items of each chunk. A chunk may be smaller when
+        the writer is flushed.
+      compression: (Optional.) None or 'zlib'.
+
+    Raises:
+      ValueError: If compression is not supported.
+    """
+    if compression not in _COMPRESSIONS:
+      raise ValueError('compression must be one of {}, got {}.'.format(
+          _COMPRESSIONS, compression))
+    self._directory = directory
+    self._data_spec = data_spec
+    self._flat_specs = _flat_array_specs(data_spec)
+    self._num_shards = num_shards
+    self._chunk_size = chunk_size
+    self._compression = compression
+    # Lists of flat arrays of consecutive items, per stream.
+    self._pending = {}
+    self._num_pending = {}
+    self._num_chunks = 0
+
+    if not tf.gfile.Exists(directory):
+      tf.gfile.MakeDirs(directory)
+    self._index = {
+        'compression': compression,
+        'specs': [_spec_to_json(spec) for spec in self._flat_specs],
+        'shards': [{'filename': _shard_filename(i, num_shards), 'chunks': []}
+                   for i in range(num_shards)],
+    }
+    self._files = [
+        tf.gfile.GFile(os.path.join(directory, shard['filename']), 'wb')
+        for shard in self._index['shards']]
+    self._offsets = [0] * num_shards
+
+  def __call__(self, items):
+    self.write(items)
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *unused_exc_info):
+    self.close()
+
+  def write(self, items):
+    """Writes items.
+
+    Args:
+      items: A nest of arrays matching the data_spec, with up to two outer
+        dimensions. Without outer dimensions, a single item is written. With
+        [batch_size], each batch entry is a separate stream, as for the
+        trajectories of batched environments. With [batch_size, time], as
+        returned by `gather_all`, each batch entry is a stream of `time`
+        consecutive items.
+
+    Raises:
+      ValueError: If items have more than two outer dimensions.
+    """
+    nest.assert_same_structure(items, self._data_spec)
+    outer_shape = nest_utils.get_outer_array_shape(items, self._data_spec)
+    if len(outer_shape) > 2:
+      raise ValueError('Items can have at most two outer dimensions, got '
+                       'shape {}.'.format(outer_shape))
+    num_streams = outer_shape[0] if outer_shape else 1
+    num_steps = outer_shape[1] if len(outer_shape) == 2 else 1
+    flat_items = [
+        np.reshape(np.asarray(item, dtype=spec.dtype),
+                   (num_streams, num_steps) + tuple(spec.shape))
+        for item, spec in zip(nest.flatten(items), self._flat_specs)]
+
+    for stream in range(num_streams):
+      self._pending.setdefault(stream, []).append(
+          [item[stream] for item in flat_items])
+      self._num_pending[stream] = self._num_pending.get(stream, 0) + num_steps
+      if self._num_pending[stream] >= self._chunk_size:
+        self._write_pending(stream)
+
+  def _write_pending(self, stream, partial=False):
+    """Writes the full chunks of a stream, and the rest if partial."""
+    flat_items = [np.concatenate(leaf) for leaf in zip(*self._pending[stream])]
+    num_items = self._num_pending[stream]
+    start = 0
+    while num_items - start >= self._chunk_size:
+      self._write_chunk(
+          [item[start:start + self._chunk_size] for item in flat_items])
+      start += self._chunk_size
+    if partial and start < num_items:
+      self._write_chunk([item[start:] for item in flat_items])
+      start = num_items
+    if start < num_items:
+      self._pending[stream] = [[item[start:] for item in flat_items]]
+    else:
+      del self._pending[stream]
+    self._num_pending[stream] = num_items - start
+
+  def _write_chunk(self, flat_items):
+    shard_id = self._num_chunks % self._num_shards
+    self._num_chunks += 1
+    blocks = []
+    for item in flat_items:
+      data = np.ascontiguousarray(item).tobytes()
+      if self._compression == 'zlib':
+        data = zlib.compress(data)
+      self._files[shard_id].write(data)
+      blocks.append([self._offsets[shard_id], len(data)])
+      self._offsets[shard_id] += len(data)
+    self._index['shards'][shard_id]['chunks'].append(
+        {'num_items': len(flat_items[0]), 'blocks': blocks})
+
+  def flush(self):
+    """Writes all pending items and the index."""
+    for stream in list(self._pending):
+      self._write_pending(stream, partial=True)
+    for f in self._files:
+      f.flush()
+    with tf.gfile.GFile(os.path.join(self._directory, INDEX_FILENAME),
+                        'w') as f:
+      f.write(json.dumps(self._index))
+
+  def close(self):
+    """Flushes and closes the dataset."""
+    self.flush()
+    for f in self._files:
+      f.close()
+
+
+def read_index(directory):
+  """Returns the index of a chunked dataset, as a dict."""
+  with tf.gfile.GFile(os.path.join(directory, INDEX_FILENAME), 'r') as f:
+    return json.loads(f.read())
+
+
+def _check_specs(index, data_spec):
+  """Checks that data_spec matches the flat specs of an index."""
+  flat_specs = _flat_array_specs(data_spec)
+  written = [(tuple(s['shape']), np.dtype(s['dtype'])) for s in index['specs']]
+  expected = [(tuple(s.shape), np.dtype(s.dtype)) for s in flat_specs]
+  if written != expected:
+    raise ValueError('The data_spec {} does not match the dataset, which '
+                     'holds (shape, dtype) leaves {}.'.format(
+                         data_spec, written))
+  return flat_specs
+
+
+def read_chunk(directory, index, shard_id, chunk_id):
+  """Reads a chunk of a dataset.
+
+  Args:
+    directory: Directory of the dataset.
+    index: The index of the dataset, as returned by `read_index`.
+    shard_id: Id of the shard holding the chunk.
+    chunk_id: Id of the chunk within its shard.
+
+  Returns:
+    A list with one array of shape [num_items, ...] per flat leaf.
+  """
+  shard = index['shards'][shard_id]
+  chunk = shard['chunks'][chunk_id]
+  flat_items = []
+  with tf.gfile.GFile(os.path.join(directory, shard['filename']), 'rb') as f:
+    for (offset, length), spec in zip(chunk['blocks'], index['specs']):
+      f.seek(offset)
+      data = f.read(length)
+      if index['compression'] == 'zlib':
+        data = zlib.decompress(data)
+      flat_items.append(np.frombuffer(data, dtype=spec['dtype']).reshape(
+          [chunk['num_items']] + spec['shape']))
+  return flat_items
+
+
+def read_items(directory, data_spec):
+  """Yields the items of a dataset, one chunk at a time.
+
+  Chunks are read shard after shard, e.g. to warm start a replay buffer with
+  `replay_buffer.add_batch(items)`.
+
+  Args:
+    directory: Directory of the dataset.
+    data_spec: A nest of ArraySpecs or TensorSpecs matching the dataset.
+
+  Yields:
+    Nests of arrays matching data_spec, with an outer [num_items] dimension.
+
+  Raises:
+    ValueError: If data_spec does not match the dataset.
+  """
+  index = read_index(directory)
+  _check_specs(index, data_spec)
+  for shard_id, shard in enumerate(index['shards']):
+    for chunk_id in range(len(shard['chunks'])):
+      yield nest.pack_sequence_as(
+          data_spec, read_chunk(directory, index, shard_id, chunk_id))
+
+
+def _sliding_windows(array, num_steps):
+  """Stacks all the windows of num_steps consecutive items of an array."""
+  num_windows = max(len(array) - num_steps + 1, 0)
+  return np.stack(
+      [array[i:i + num_windows] for i in range(num_steps)], axis=1)
+
+
+def as_dataset(directory,
+               data_spec,
+               num_steps=None,
+               shuffle_buffer_size=None,
+               num_parallel_reads=None,
+               seed=None):
+  """Creates a tf.data.Dataset streaming the items of a chunked dataset.
+
+  Only the chunks being read are held in memory. With `num_parallel_reads`,
+  that many shards are read concurrently and their items interleaved in
+  whatever order they are ready.
+
+  Args:
+    directory: Directory of the dataset.
+    data_spec: A nest of ArraySpecs or TensorSpecs matching the dataset.
+    num_steps: (Optional.) If given, elements are sub-episodes of num_steps
+      consecutive items of a stream, stacked along a time dimension. Sub-
+      episodes do not span chunks.
+    shuffle_buffer_size: (Optional.) If given, shards and chunks are read in
+      random order and elements are shuffled with a buffer of that size.
+    num_parallel_reads: (Optional.) Number of shards read in parallel. If None,
+      shards are read one after the other.
+    seed: (Optional.) Random seed of the shuffles.
+
+  Returns:
+    A tf.data.Dataset whose elements match data_spec, with an outer
+    [num_steps] dimension if num_steps is given.
+
+  Raises:
+    ValueError: If data_spec does not match the dataset.
+  """
+  index = read_index(directory)
+  flat_specs = _check_specs(index, data_spec)
+  num_shards = len(index['shards'])
+  num_chunks = tf.constant(
+      [len(shard['chunks']) for shard in index['shards']], dtype=tf.int64)
+  time_dims = [] if num_steps is None else [num_steps]
+
+  def load_chunk(shard_id, chunk_id):
+    flat_items = read_chunk(directory, index, int(shard_id), int(chunk_id))
+    if num_steps is not None:
+      flat_items = [_sliding_windows(item, num_steps) for item in flat_items]
+    return flat_items
+
+  def chunk_dataset(shard_id, chunk_id):
+    flat_items = tf.py_func(
+        load_chunk, [shard_id, chunk_id],
+        [tf.as_dtype(spec.dtype) for spec in flat_specs],
+        stateful=False,
+        name='read_chunk_py_func')
+    for item, spec in zip(flat_items, flat_specs):
+      item.set_shape([None] + time_dims + list(spec.shape))
+    return tf.data.Dataset.from_tensor_slices(tuple(flat_items))
+
+  def shard_dataset(shard_id):
+    chunk_ids = tf.data.Dataset.range(num_chunks[shard_id])
+    if shuffle_buffer_size is not None:
+      chunk_ids = chunk_ids.shuffle(
+          tf.maximum(num_chunks[shard_id], 1), seed=seed)
+    return chunk_ids.flat_map(
+        lambda chunk_id: chunk_dataset(shard_id, chunk_id))
+
+  ds = tf.data.Dataset.range(num_shards)
+  if shuffle_buffer_size is not None:
+    ds = ds.shuffle(num_shards, seed=seed)
+  if num_parallel_reads is None:
+    ds = ds.flat_map(shard_dataset)
+  else:
+    ds = ds.apply(
+        tf.data.experimental.parallel_interleave(
+            shard_dataset, cycle_length=num_parallel_reads, sloppy=True))
+  if shuffle_buffer_size is not None:
+    ds = ds.shuffle(shuffle_buffer_size, seed=seed)
+  ds = ds.map(lambda *items: nest.pack_sequence_as(data_spec, items))
+  return ds.prefetch(tf.data.experimental.AUTOTUNE)
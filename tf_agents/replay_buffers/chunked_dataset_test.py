@@ -0,0 +1,141 @@
+# coding=utf-8
+# Copyright 2018 The TF-Agents Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unit tests for chunked datasets."""
+
+from __future__ import division
+from __future__ import unicode_literals
+
+import os
+
+from absl.testing import parameterized
+import numpy as np
+import tensorflow as tf
+
+from tf_agents.replay_buffers import chunked_dataset
+from tf_agents.replay_buffers import py_uniform_replay_buffer
+from tf_agents.specs import array_spec
+
+nest = tf.contrib.framework.nest
+
+
+class ChunkedDatasetTest(parameterized.TestCase, tf.test.TestCase):
+
+  def setUp(self):
+    super(ChunkedDatasetTest, self).setUp()
+    self._data_spec = {
+        'obs': array_spec.ArraySpec((2, 3), np.float32),
+        'step': array_spec.ArraySpec((), np.int64),
+    }
+
+  def _items(self, steps):
+    steps = np.asarray(steps, dtype=np.int64)
+    obs = np.ones(steps.shape + (2, 3), dtype=np.float32)
+    return {'obs': obs * steps[..., None, None], 'step': steps}
+
+  def _read_all(self, directory):
+    chunks = list(chunked_dataset.read_items(directory, self._data_spec))
+    return chunks, nest.map_structure(lambda *x: np.concatenate(x), *chunks)
+
+  @parameterized.named_parameters(
+      [('Uncompressed', None), ('Zlib', 'zlib')])
+  def testWriteAndRead(self, compression):
+    directory = os.path.join(self.get_temp_dir(), 'ds')
+    with chunked_dataset.ChunkedDatasetWriter(
+        directory, self._data_spec, num_shards=2, chunk_size=4,
+        compression=compression) as writer:
+      writer.write(self._items([np.arange(10)]))
+
+    index = chunked_dataset.read_index(directory)
+    self.assertEqual(compression, index['compression'])
+    # Chunks of 4, 4 and 2 items alternate between the shards.
+    self.assertEqual([[4, 2], [4]],
+                     [[c['num_items'] for c in s['chunks']]
+                      for s in index['shards']])
+    chunks, items = self._read_all(directory)
+    self.assertEqual(3, len(chunks))
+    self.assertAllEqual([0, 1, 2, 3, 8, 9, 4, 5, 6, 7], items['step'])
+    self.assertAllClose(items['step'], items['obs'][:, 1, 2])
+
+  def testStreamsAreContiguous(self):
+    directory = os.path.join(self.get_temp_dir(), 'ds')
+    writer = chunked_dataset.ChunkedDatasetWriter(
+        directory, self._data_spec, chunk_size=3)
+    # Used as an observer of two environments, one step at a time.
+    for t in range(4):
+      writer(self._items([t, 100 + t]))
+    writer.close()
+
+    chunks, _ = self._read_all(directory)
+    self.assertEqual([[0, 1, 2], [100, 101, 102], [3], [103]],
+                     [chunk['step'].tolist() for chunk in chunks])
+
+  def testExportReplayBufferAndWarmStart(self):
+    directory = os.path.join(self.get_temp_dir(), 'ds')
+    replay_buffer = py_uniform_replay_buffer.PyUniformReplayBuffer(
+        self._data_spec, capacity=8)
+    replay_buffer.add_batch(self._items(np.arange(12)))
+    with chunked_dataset.ChunkedDatasetWriter(
+        directory, self._data_spec, chunk_size=5) as writer:
+      writer.write(replay_buffer.gather_all())
+
+    warm_buffer = py_uniform_replay_buffer.PyUniformReplayBuffer(
+        self._data_spec, capacity=8)
+    for items in chunked_dataset.read_items(directory, self._data_spec):
+      warm_buffer.add_batch(items)
+    self.assertAllEqual([np.arange(4, 12)], warm_buffer.gather_all()['step'])
+
+  def testMismatchingSpec(self):
+    directory = os.path.join(self.get_temp_dir(), 'ds')
+    chunked_dataset.ChunkedDatasetWriter(directory, self._data_spec).close()
+    data_spec = {
+        'obs': array_spec.ArraySpec((2, 3), np.float64),
+        'step': array_spec.ArraySpec((), np.int64),
+    }
+    with self.assertRaises(ValueError):
+      list(chunked_dataset.read_items(directory, data_spec))
+
+  def testInvalidCompression(self):
+    with self.assertRaises(ValueError):
+      chunked_dataset.ChunkedDatasetWriter(
+          self.get_temp_dir(), self._data_spec, compression='lz4')
+
+  @parameterized.named_parameters(
+      [('Sequential', None, None), ('ParallelShuffled', 2, 6)])
+  def testAsDataset(self, num_parallel_reads, shuffle_buffer_size):
+    directory = os.path.join(self.get_temp_dir(), 'ds')
+    with chunked_dataset.ChunkedDatasetWriter(
+        directory, self._data_spec, num_shards=3, chunk_size=5,
+        compression='zlib') as writer:
+      writer.write(self._items([np.arange(30)]))
+
+    ds = chunked_dataset.as_dataset(
+        directory, self._data_spec, num_steps=2,
+        shuffle_buffer_size=shuffle_buffer_size,
+        num_parallel_reads=num_parallel_reads, seed=0)
+    items = ds.batch(24).make_one_shot_iterator().get_next()
+    self.assertEqual([None, 2, 2, 3], items['obs'].shape.as_list())
+    with self.test_session() as sess:
+      items_ = sess.run(items)
+    # Each chunk of 5 items provides 4 sub-episodes of 2 steps.
+    self.assertEqual((24, 2), items_['step'].shape)
+    self.assertAllEqual(items_['step'][:, 0] + 1, items_['step'][:, 1])
+    self.assertEqual(
+        sorted(set(range(30)) - set(range(4, 30, 5))),
+        sorted(items_['step'][:, 0]))
+
+
+if __name__ == '__main__':
+  tf.test.main()
@@ -18,6 +18,10 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import collections
+import os
+import zlib
+
 import numpy as np
 import tensorflow as tf
 
@@ -25,6 +29,197 @@ from tf_agents.specs import array_spec
 
 nest = tf.contrib.framework.nest
 
+try:
+  _Mapping = collections.abc.Mapping
+except AttributeError:
+  # Python 2.
+  _Mapping = collections.Mapping
+
+
+def _spec_paths(spec, prefix=''):
+  """Returns the '/'-joined paths of the leaves of a spec, in flatten order."""
+  # Dicts assigned to a Checkpointable are wrapped in a Mapping, not a dict.
+  if isinstance(spec, _Mapping):
+    children = sorted(spec.items())
+  elif isinstance(spec, tuple) and hasattr(spec, '_fields'):
+    children = zip(spec._fields, spec)
+  elif isinstance(spec, (list, tuple)):
+    children = enumerate(spec)
+  else:
+    return [prefix]
+  paths = []
+  for key, child in children:
+    paths.extend(_spec_paths(
+        child, '{}/{}'.format(prefix, key) if prefix else str(key)))
+  return paths
+
+
+class Float16Codec(object):
+  """Stores a floating point leaf as float16."""
+
+  def stored_dtype(self, spec):
+    del spec  # Unused.
+    return np.float16
+
+  def encode(self, values, spec):
+    del spec  # Unused.
+    return np.asarray(values).astype(np.float16)
+
+  def decode(self, values, spec):
+    return values.astype(spec.dtype)
+
+
+class QuantizeUint8Codec(object):
+  """Stores a floating point leaf as uint8, quantized affinely over a range.
+
+  Values are clipped to [minimum, maximum], which default to the bounds of a
+  BoundedArraySpec, and stored with a resolution of (maximum - minimum) / 255.
+  """
+
+  def __init__(self, minimum=None, maximum=None):
+    """Creates a QuantizeUint8Codec.
+
+    Args:
+      minimum: (Optional.) Lowest value, a scalar or an array broadcastable to
+        the shape of the leaf. Defaults to the minimum of the spec.
+      maximum: (Optional.) Highest value, a scalar or an array broadcastable to
+        the shape of the leaf. Defaults to the maximum of the spec.
+    """
+    self._minimum = minimum
+    self._maximum = maximum
+
+  def _range(self, spec):
+    """Returns the offset and scale of the quantization of a leaf."""
+    minimum = self._minimum
+    maximum = self._maximum
+    if minimum is None or maximum is None:
+      if not isinstance(spec, array_spec.BoundedArraySpec):
+        raise ValueError('QuantizeUint8Codec needs a minimum and a maximum, '
+                         'or a BoundedArraySpec. Got: {}'.format(spec))
+      minimum = spec.minimum if minimum is None else minimum
+      maximum = spec.maximum if maximum is None else maximum
+    minimum = np.asarray(minimum, dtype=np.float64)
+    scale = (np.asarray(maximum, dtype=np.float64) - minimum) / 255.
+    if not np.all(np.isfinite(scale)):
+      raise ValueError('QuantizeUint8Codec needs a finite range, got [{}, {}] '
+                       'for {}.'.format(minimum, maximum, spec))
+    return minimum, np.where(scale > 0, scale, 1.)
+
+  def stored_dtype(self, spec):
+    self._range(spec)
+    return np.uint8
+
+  def encode(self, values, spec):
+    minimum, scale = self._range(spec)
+    quantized = np.round((np.asarray(values) - minimum) / scale)
+    return np.clip(quantized, 0, 255).astype(np.uint8)
+
+  def decode(self, values, spec):
+    minimum, scale = self._range(spec)
+    return (values * scale + minimum).astype(spec.dtype)
+
+
+class ZlibCodec(object):
+  """Stores a leaf in zlib-compressed blocks of consecutive rows.
+
+  The most recently used blocks are kept decompressed. Writes go to these
+  decompressed blocks, and are compressed when the block is evicted, the
+  storage flushed, or a checkpoint saved.
+  """
+
+  def __init__(self, block_size=64, cache_size=4, level=1):
+    """Creates a ZlibCodec.
+
+    Args:
+      block_size: Number of rows compressed together.
+      cache_size: Number of decompressed blocks kept in memory.
+      level: zlib compression level, from 1 (fastest) to 9 (smallest).
+    """
+    self.block_size = block_size
+    self.cache_size = cache_size
+    self.level = level
+
+
+class _ZlibBlocks(object):
+  """The rows of a leaf, stored as zlib-compressed blocks.
+
+  The compressed blocks are attributes of a NumpyState, so that they are the
+  ones checkpointed. Decompressed blocks remember the array they were
+  decompressed from, so that blocks restored from a checkpoint are reloaded.
+  """
+
+  def __init__(self, np_state, name, spec, capacity, codec):
+    self._np_state = np_state
+    self._spec = spec
+    self._capacity = capacity
+    self._codec = codec
+    num_blocks = -(-capacity // codec.block_size)
+    self._names = ['{}_block{}'.format(name, k) for k in range(num_blocks)]
+    for block_name in self._names:
+      # Sentinel value of blocks never written, see NumpyStorage.
+      setattr(self._np_state, block_name, np.int64(0))
+    # Maps a block to [rows, compressed array decompressed, dirty], from the
+    # least to the most recently used.
+    self._cache = collections.OrderedDict()
+
+  def _block_rows(self, block):
+    start = block * self._codec.block_size
+    return min(self._codec.block_size, self._capacity - start)
+
+  def _compress(self, block, entry):
+    rows, _, dirty = entry
+    if dirty:
+      compressed = np.frombuffer(
+          zlib.compress(rows.tobytes(), self._codec.level), dtype=np.uint8)
+      setattr(self._np_state, self._names[block], compressed)
+      entry[1:] = [compressed, False]
+
+  def _block(self, block):
+    """Returns the decompressed rows of a block, as the most recently used."""
+    compressed = getattr(self._np_state, self._names[block])
+    entry = self._cache.pop(block, None)
+    if entry is None or entry[1] is not compressed:
+      shape = (self._block_rows(block),) + tuple(self._spec.shape)
+      if np.ndim(compressed) == 0:
+        rows = np.zeros(shape, dtype=self._spec.dtype)
+      else:
+        rows = np.frombuffer(zlib.decompress(compressed.tobytes()),
+                             dtype=self._spec.dtype).reshape(shape).copy()
+      entry = [rows, compressed, False]
+    self._cache[block] = entry
+    while len(self._cache) > self._codec.cache_size:
+      evicted = next(iter(self._cache))
+      self._compress(evicted, self._cache.pop(evicted))
+    return entry
+
+  def __getitem__(self, idx):
+    idx = np.asarray(idx)
+    flat_idx = idx.reshape(-1)
+    blocks = flat_idx // self._codec.block_size
+    values = np.empty(flat_idx.shape + tuple(self._spec.shape),
+                      dtype=self._spec.dtype)
+    for block in np.unique(blocks):
+      in_block = blocks == block
+      values[in_block] = self._block(block)[0][
+          flat_idx[in_block] % self._codec.block_size]
+    return values.reshape(idx.shape + tuple(self._spec.shape))
+
+  def __setitem__(self, idx, values):
+    idx = np.asarray(idx)
+    flat_idx = idx.reshape(-1)
+    values = np.broadcast_to(values, idx.shape + tuple(self._spec.shape))
+    values = values.reshape(flat_idx.shape + tuple(self._spec.shape))
+    blocks = flat_idx // self._codec.block_size
+    for block in np.unique(blocks):
+      in_block = blocks == block
+      entry = self._block(block)
+      entry[0][flat_idx[in_block] % self._codec.block_size] = values[in_block]
+      entry[2] = True
+
+  def flush(self):
+    for block, entry in self._cache.items():
+      self._compress(block, entry)
+
 
 class NumpyStorage(tf.contrib.checkpoint.Checkpointable):
   """A class to store nested objects in a collection of numpy arrays.
@@ -34,20 +229,41 @@ class NumpyStorage(tf.contrib.checkpoint.Checkpointable):
   two arrays, one for the 'foo' key and one for the 'bar' key. The .get and
   .set methods would return/take Python dictionaries, but break down the
   component arrays before storing them.
+
+  If a directory is given, each array is instead backed by a memory-mapped
+  `.npy` file in that directory, so that the capacity can exceed the available
+  memory. The arrays are then not part of checkpoints: an existing file with
+  the expected shape and dtype is reopened as is, so that restoring a buffer
+  only needs to restore its (small) bookkeeping state.
+
+  Leaves can be stored with a codec, given by the path of the leaf in the
+  data_spec, e.g. `{'bar': QuantizeUint8Codec(0., 1.)}`. A path also applies
+  to all the leaves below it, and the most specific path wins. Values are
+  encoded by .set and decoded by .get, so codecs are transparent to callers
+  except for the precision lost. `Float16Codec` and `QuantizeUint8Codec` store
+  each value with fewer bytes, while `ZlibCodec` compresses blocks of rows; the
+  latter are compressed when evicted from its cache, and the blocks changed
+  since are compressed when a checkpoint is saved.
   """
 
-  def __init__(self, data_spec, capacity):
+  def __init__(self, data_spec, capacity, directory=None, codecs=None):
     """Creates a NumpyStorage object.
 
     Args:
       data_spec: An ArraySpec or a list/tuple/nest of ArraySpecs describing a
         single item that can be stored in this table.
       capacity: The maximum number of items that can be stored in the buffer.
+      directory: Optional directory in which to create (or reopen) one
+        memory-mapped file per array. If None, arrays are kept in memory.
+      codecs: Optional dict mapping paths of the data_spec, with components
+        joined by '/', to the codec storing the leaves at or below that path.
 
     Raises:
-      ValueError: If data_spec is not an instance or nest of ArraySpecs.
+      ValueError: If data_spec is not an instance or nest of ArraySpecs, or if
+        codecs are invalid for their leaves.
     """
     self._capacity = capacity
+    self._directory = directory
     if not all([
         isinstance(spec, array_spec.ArraySpec)
         for spec in nest.flatten(data_spec)
@@ -61,6 +277,32 @@ class NumpyStorage(tf.contrib.checkpoint.Checkpointable):
     self._buf_names = tf.contrib.checkpoint.NoDependency([])
     for idx in range(len(self._flat_specs)):
       self._buf_names.append('buffer{}'.format(idx))
+
+    self._codecs = tf.contrib.checkpoint.NoDependency(
+        self._leaf_codecs(data_spec, codecs))
+    # Specs of the arrays actually stored, and blocks of compressed leaves.
+    self._stored_specs = tf.contrib.checkpoint.NoDependency([])
+    self._blocks = tf.contrib.checkpoint.NoDependency({})
+    for idx, (spec, codec) in enumerate(zip(self._flat_specs, self._codecs)):
+      if isinstance(codec, ZlibCodec):
+        if self._directory is not None:
+          raise ValueError('ZlibCodec cannot be used with memory-mapped '
+                           'storage.')
+        self._blocks[idx] = _ZlibBlocks(self._np_state, self._buf_names[idx],
+                                        spec, capacity, codec)
+      elif codec is not None:
+        spec = array_spec.ArraySpec(spec.shape, codec.stored_dtype(spec))
+      self._stored_specs.append(spec)
+
+    if self._directory is not None:
+      if not os.path.isdir(self._directory):
+        os.makedirs(self._directory)
+      self._memmaps = tf.contrib.checkpoint.NoDependency({})
+      return
+
+    for idx in range(len(self._flat_specs)):
+      if idx in self._blocks:
+        continue
       # Set each buffer to a sentinel value (real buffers will never be
       # scalars) rather than a real value so that if they are restored from
       # checkpoint, we don't end up double-initializing. We don't leave them
@@ -68,25 +310,105 @@ class NumpyStorage(tf.contrib.checkpoint.Checkpointable):
       # this will be a checkpointed attribute and it creates TF ops for it.
       setattr(self._np_state, self._buf_names[idx], np.int64(0))
 
+  def _leaf_codecs(self, data_spec, codecs):
+    """Returns the codec of each flat leaf, or None."""
+    if not codecs:
+      return [None] * len(self._flat_specs)
+    paths = _spec_paths(data_spec)
+    if len(paths) != len(self._flat_specs):
+      raise ValueError('Could not compute the paths of the leaves of the '
+                       'data_spec {}, got {}.'.format(data_spec, paths))
+    unused = set(codecs)
+    leaf_codecs = []
+    for path, spec in zip(paths, self._flat_specs):
+      matches = [key for key in codecs
+                 if not key or path == key or path.startswith(key + '/')]
+      if not matches:
+        leaf_codecs.append(None)
+        continue
+      key = max(matches, key=len)
+      unused.discard(key)
+      codec = codecs[key]
+      if (not isinstance(codec, ZlibCodec) and
+          not np.issubdtype(spec.dtype, np.floating)):
+        raise ValueError('Codec {} of path {!r} only supports floating point '
+                         'leaves, got {}.'.format(codec, path, spec))
+      leaf_codecs.append(codec)
+    if unused:
+      raise ValueError('Codec paths {} do not match any of the paths of the '
+                       'data_spec {}.'.format(sorted(unused), paths))
+    return leaf_codecs
+
   def _array(self, index):
     """Creates or retrieves one of the numpy arrays backing the storage."""
+    if index in self._blocks:
+      return self._blocks[index]
+    if self._directory is not None:
+      return self._memmap(index)
     array = getattr(self._np_state, self._buf_names[index])
     if np.isscalar(array) or array.ndim == 0:
-      spec = self._flat_specs[index]
+      spec = self._stored_specs[index]
       shape = (self._capacity,) + spec.shape
       array = np.zeros(shape=shape, dtype=spec.dtype)
       setattr(self._np_state, self._buf_names[index], array)
     return array
 
+  def _memmap(self, index):
+    """Creates or reopens one of the memory-mapped arrays."""
+    array = self._memmaps.get(index)
+    if array is None:
+      spec = self._stored_specs[index]
+      shape = (self._capacity,) + spec.shape
+      path = os.path.join(self._directory, self._buf_names[index] + '.npy')
+      if os.path.exists(path):
+        array = np.lib.format.open_memmap(path, mode='r+')
+        if array.shape != shape or array.dtype != spec.dtype:
+          raise ValueError(
+              'Existing file {} holds an array of shape {} and dtype {}, '
+              'expected shape {} and dtype {}.'.format(
+                  path, array.shape, array.dtype, shape, spec.dtype))
+      else:
+        array = np.lib.format.open_memmap(
+            path, mode='w+', dtype=spec.dtype, shape=shape)
+      self._memmaps[index] = array
+    return array
+
+  def flush(self):
+    """Writes any pending changes of memory-mapped arrays to disk.
+
+    Also compresses the blocks of leaves stored with a ZlibCodec which were
+    changed since they were decompressed.
+    """
+    for blocks in self._blocks.values():
+      blocks.flush()
+    if self._directory is not None:
+      for array in self._memmaps.values():
+        array.flush()
+
+  def _gather_saveables_for_checkpoint(self):
+    # Compresses the blocks changed in the cache so that the checkpoint holds
+    # the latest rows. The compressed blocks replace the arrays of the existing
+    # NumpyState attributes, which are read when the checkpoint is written.
+    for blocks in self._blocks.values():
+      blocks.flush()
+    return super(NumpyStorage, self)._gather_saveables_for_checkpoint()
+
   def get(self, idx):
     """Get value stored at idx."""
     encoded_item = []
-    for buf_idx in range(len(self._flat_specs)):
-      encoded_item.append(self._array(buf_idx)[idx])
+    for buf_idx, (spec, codec) in enumerate(
+        zip(self._flat_specs, self._codecs)):
+      element = self._array(buf_idx)[idx]
+      if codec is not None and buf_idx not in self._blocks:
+        element = codec.decode(element, spec)
+      encoded_item.append(element)
     return nest.pack_sequence_as(self._data_spec, encoded_item)
 
   def set(self, table_idx, value):
     """Set table_idx to value."""
     for nest_idx, element in enumerate(nest.flatten(value)):
+      codec = self._codecs[nest_idx]
+      if codec is not None and nest_idx not in self._blocks:
+        element = codec.encode(element, self._flat_specs[nest_idx])
       self._array(nest_idx)[table_idx] = element
 
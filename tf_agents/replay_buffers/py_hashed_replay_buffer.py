@@ -23,75 +23,183 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
-import pickle
+import hashlib
 import threading
 
 import numpy as np
 import tensorflow as tf
 
+from tf_agents.environments import lazy_frames
 from tf_agents.environments import trajectory
 from tf_agents.replay_buffers import py_uniform_replay_buffer
 from tf_agents.specs import array_spec
 
 
-class FrameBuffer(tf.contrib.checkpoint.PythonStateWrapper):
+def _hash_frame(frame):
+  """Hashes the bytes of a C-contiguous array without copying them."""
+  digest = hashlib.md5(frame).digest()  # Not used for security.
+  return int(np.frombuffer(digest, dtype=np.int64, count=1)[0])
+
+
+def _has_keyed_frames(observation, split_axis):
+  """Whether `observation` is a LazyFrames of keyed frames along split_axis."""
+  if (not isinstance(observation, lazy_frames.LazyFrames) or
+      observation.keys is None):
+    return False
+  ndim = observation.ndim
+  if observation.axis % ndim != split_axis % ndim:
+    return False
+  return all(frame.shape[split_axis] == 1 for frame in observation.frames)
+
+
+class FrameBuffer(tf.contrib.checkpoint.Checkpointable):
   """Saves some frames in a memory efficient way.
 
+  Each distinct frame is stored once in a contiguous pool array, and frames
+  are referred to by their slot in the pool. Slots are reference counted and
+  recycled through a free list, and the pool doubles in size when it is full.
+  Growing briefly holds both the old and the new pool, so large buffers should
+  preallocate the number of slots they need with `initial_num_slots`.
+  Checkpoints save the pool and its bookkeeping arrays directly.
+
   Thread safety: cannot add multiple frames in parallel.
   """
 
-  def __init__(self):
-    self._frames = {}
+  _INITIAL_NUM_SLOTS = 64
+
+  def __init__(self, initial_num_slots=None):
+    """Creates a FrameBuffer.
 
-  def add_frame(self, frame):
+    Args:
+      initial_num_slots: (Optional.) Number of slots of the pool allocated with
+        the first frame. Defaults to a small pool grown as needed.
+    """
+    self._initial_num_slots = initial_num_slots or self._INITIAL_NUM_SLOTS
+    self._np_state = tf.contrib.checkpoint.NumpyState()
+    # The pool is allocated when the first frame fixes its shape and dtype.
+    # Until then each array is set to a sentinel, see NumpyStorage.
+    self._np_state.pool = np.int64(0)
+    self._np_state.refcounts = np.int64(0)
+    self._np_state.hashes = np.int64(0)
+    # Index from frame hash (or key, see add_frame) to slot, and list of free
+    # slots. Both are derived from the arrays above and rebuilt when those
+    # change, e.g. on restore.
+    self._slots = tf.contrib.checkpoint.NoDependency({})
+    self._free_slots = tf.contrib.checkpoint.NoDependency([])
+    self._indexed_refcounts = None
+
+  def _check_index(self):
+    """Rebuilds the slot index if the arrays were replaced or cleared."""
+    refcounts = self._np_state.refcounts
+    if refcounts is self._indexed_refcounts:
+      return
+    if np.ndim(refcounts) == 0:
+      self._slots = tf.contrib.checkpoint.NoDependency({})
+      self._free_slots = tf.contrib.checkpoint.NoDependency([])
+    else:
+      used = np.flatnonzero(refcounts > 0)
+      self._slots = tf.contrib.checkpoint.NoDependency(
+          dict(zip(self._np_state.hashes[used].tolist(), used.tolist())))
+      # Pop free slots in increasing order.
+      self._free_slots = tf.contrib.checkpoint.NoDependency(
+          np.flatnonzero(refcounts == 0)[::-1].tolist())
+    self._indexed_refcounts = refcounts
+
+  def _allocate_slot(self, frame):
+    """Returns a free slot, allocating or growing the pool if needed."""
+    if not self._free_slots:
+      pool = self._np_state.pool
+      if np.ndim(pool) == 0:
+        num_slots = 0
+        new_num_slots = self._initial_num_slots
+      else:
+        num_slots = len(pool)
+        new_num_slots = 2 * num_slots
+      new_pool = np.zeros((new_num_slots,) + frame.shape, dtype=frame.dtype)
+      new_refcounts = np.zeros(new_num_slots, dtype=np.int64)
+      new_hashes = np.zeros(new_num_slots, dtype=np.int64)
+      if num_slots:
+        new_pool[:num_slots] = pool
+        new_refcounts[:num_slots] = self._np_state.refcounts
+        new_hashes[:num_slots] = self._np_state.hashes
+      self._np_state.pool = new_pool
+      self._np_state.refcounts = new_refcounts
+      self._np_state.hashes = new_hashes
+      self._indexed_refcounts = new_refcounts
+      self._free_slots.extend(range(new_num_slots - 1, num_slots - 1, -1))
+    return self._free_slots.pop()
+
+  def add_frame(self, frame, key=None):
     """Add a frame to the buffer.
 
     Args:
       frame: Numpy array.
+      key: Optional integer identifying the frame, used instead of a hash of
+        its content to deduplicate it. See `lazy_frames.LazyFrames`.
 
     Returns:
-      A deduplicated frame.
+      The slot of the deduplicated frame in the pool.
     """
-    h = hash(frame.tostring())
-    if h in self._frames:
-      _, refcount = self._frames[h]
-      self._frames[h] = (frame, refcount + 1)
-      return h
-    self._frames[h] = (frame, 1)
-    return h
+    self._check_index()
+    if key is None:
+      frame = np.ascontiguousarray(frame)
+      h = _hash_frame(frame)
+    else:
+      h = key
+    slot = self._slots.get(h)
+    if slot is None:
+      slot = self._allocate_slot(frame)
+      self._np_state.pool[slot] = frame
+      self._np_state.hashes[slot] = h
+      self._slots[h] = slot
+    self._np_state.refcounts[slot] += 1
+    return slot
 
   def __len__(self):
-    return len(self._frames)
-
-  def _serialize(self):
-    """Callback for `PythonStateWrapper` to serialize the dictionary."""
-    return pickle.dumps(self._frames)
-
-  def _deserialize(self, string_value):
-    """Callback for `PythonStateWrapper` to deserialize the array."""
-    self._frames = pickle.loads(string_value)
+    self._check_index()
+    return len(self._slots)
 
   def compress(self, observation, split_axis=-1):
-    # e.g. When split_axis is -1, turns an array of size 84x84x4
-    # into a list of arrays of size 84x84x1.
-    frame_list = np.split(observation, observation.shape[split_axis],
-                          split_axis)
-    return np.array([self.add_frame(f) for f in frame_list])
+    if _has_keyed_frames(observation, split_axis):
+      # The frames of a LazyFrames are added by key, copying only new frames.
+      axis = observation.axis
+      return np.array(
+          [self.add_frame(np.squeeze(frame, axis), key=key)
+           for frame, key in zip(observation.frames, observation.keys)],
+          dtype=np.int64)
+    # e.g. When split_axis is -1, turns an array of size 84x84x4 into 4 slots
+    # of frames of size 84x84. A single copy makes all frames contiguous.
+    frames = np.ascontiguousarray(np.moveaxis(observation, split_axis, 0))
+    return np.array([self.add_frame(f) for f in frames], dtype=np.int64)
 
   def decompress(self, observation, split_axis=-1):
-    frames = [self._frames[h][0] for h in observation]
-    return np.concatenate(frames, axis=split_axis)
+    # `observation` holds one slot per frame along its last axis and may have
+    # any number of outer (e.g. batch and time) dimensions, which are all
+    # gathered from the pool at once.
+    slots = np.asarray(observation)
+    frames = self._np_state.pool[slots]
+    stack_axis = slots.ndim - 1
+    if split_axis >= 0:
+      split_axis += stack_axis
+    return np.moveaxis(frames, stack_axis, split_axis)
 
   def on_delete(self, observation, split_axis=-1):
-    for h in observation:
-      frame, refcount = self._frames[h]
-      if refcount > 1:
-        self._frames[h] = (frame, refcount - 1)
-      else:
-        del self._frames[h]
+    # `observation` may have outer dimensions when deleting several items.
+    self._check_index()
+    slots = np.ravel(observation)
+    refcounts = self._np_state.refcounts
+    np.subtract.at(refcounts, slots, 1)
+    freed_slots = np.unique(slots[refcounts[slots] == 0]).tolist()
+    for slot in freed_slots:
+      del self._slots[int(self._np_state.hashes[slot])]
+    self._free_slots.extend(freed_slots)
 
   def clear(self):
-    self._frames = {}
+    refcounts = self._np_state.refcounts
+    if np.ndim(refcounts) > 0:
+      refcounts[:] = 0
+    # Force the index to be rebuilt from the cleared refcounts.
+    self._indexed_refcounts = None
 
 
 class PyHashedReplayBuffer(py_uniform_replay_buffer.PyUniformReplayBuffer):
@@ -106,16 +214,24 @@ class PyHashedReplayBuffer(py_uniform_replay_buffer.PyUniformReplayBuffer):
 
   Note: This replay buffer assumes that the items being stored are
   trajectory.Trajectory instances.
+
+  With frame stacking, each item mostly brings one new frame, so passing
+  `num_frame_slots` of about `capacity` preallocates the frame pool instead of
+  growing it, which avoids the peak memory of copying a large pool.
   """
 
-  def __init__(self, data_spec, capacity, log_interval=None):
+  def __init__(self, data_spec, capacity, log_interval=None,
+               sample_within_episodes=False, storage_codecs=None,
+               sample_without_replacement=False, num_frame_slots=None):
     if not isinstance(data_spec, trajectory.Trajectory):
       raise ValueError(
           'data_spec must be the spec of a trajectory: {}'.format(data_spec))
     super(PyHashedReplayBuffer, self).__init__(
-        data_spec, capacity)
+        data_spec, capacity, sample_within_episodes=sample_within_episodes,
+        storage_codecs=storage_codecs,
+        sample_without_replacement=sample_without_replacement)
 
-    self._frame_buffer = FrameBuffer()
+    self._frame_buffer = FrameBuffer(initial_num_slots=num_frame_slots)
     self._lock_frame_buffer = threading.Lock()
     self._log_interval = log_interval
 
@@ -126,23 +242,26 @@ class PyHashedReplayBuffer(py_uniform_replay_buffer.PyUniformReplayBuffer):
     return self._data_spec._replace(observation=observation)
 
   def _encode(self, traj):
-    """Encodes a trajectory for efficient storage.
+    """Encodes a batch of trajectories for efficient storage.
 
-    The observations in this trajectory are replaced by a compressed
+    The observations in these trajectories are replaced by a compressed
     version of the observations: each frame is only stored exactly once.
 
     Args:
-      traj: The original trajectory.
+      traj: The original batch of trajectories.
 
     Returns:
-      The same trajectory where frames in the observation have been
+      The same trajectories where frames in the observation have been
       de-duplicated.
     """
     with self._lock_frame_buffer:
-      observation = self._frame_buffer.compress(traj.observation)
+      observation = np.stack(
+          [self._frame_buffer.compress(obs) for obs in traj.observation])
 
+    # Log whenever this batch crosses a multiple of `log_interval`.
     if (self._log_interval and
-        self._np_state.item_count % self._log_interval == 0):
+        -self._np_state.item_count % self._log_interval <
+        len(traj.observation)):
       tf.logging.info('Effective Replay buffer frame count: {}'.format(
           len(self._frame_buffer)))
 
@@ -164,9 +283,9 @@ class PyHashedReplayBuffer(py_uniform_replay_buffer.PyUniformReplayBuffer):
     observation = self._frame_buffer.decompress(encoded_trajectory.observation)
     return encoded_trajectory._replace(observation=observation)
 
-  def _on_delete(self, encoded_trajectory):
+  def _on_delete(self, encoded_trajectories):
     with self._lock_frame_buffer:
-      self._frame_buffer.on_delete(encoded_trajectory.observation)
+      self._frame_buffer.on_delete(encoded_trajectories.observation)
 
   def _clear(self):
     super(PyHashedReplayBuffer, self)._clear()
@@ -0,0 +1,208 @@
+# coding=utf-8
+# Copyright 2018 The TF-Agents Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Writer turning trajectories into n-step transitions.
+
+PyNStepWriter is a driver observer which accumulates discounted rewards over
+a rolling window of n steps for every environment in the batch, and passes
+compact n-step transitions to its own observers, e.g. the `add_batch` method
+of a replay buffer. Multi-step agents can then sample single transitions
+instead of windows of n + 1 trajectories.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import collections
+
+import numpy as np
+import tensorflow as tf
+
+from tf_agents.specs import array_spec
+from tf_agents.utils import nest_utils
+
+nest = tf.contrib.framework.nest
+
+
+class NStepTransition(
+    collections.namedtuple('NStepTransition', [
+        'observation',
+        'action',
+        'reward',
+        'discount',
+        'next_observation',
+    ])):
+  """A transition spanning up to n steps of an episode.
+
+  Attributes:
+    observation: The observation s_t at the first step.
+    action: The action a_t taken at the first step.
+    reward: The discounted sum of rewards
+      R_t = sum_k gamma^k (prod_{j<k} d_{t+j+1}) r_{t+k+1} over the k < n steps
+      of the transition.
+    discount: The discount to apply to the value of `next_observation`,
+      gamma^n prod_{k<n} d_{t+k+1}. It is 0 if the episode terminated within
+      the transition.
+    next_observation: The observation s_{t+n}, or the last observation of the
+      episode if it ended within n steps.
+  """
+  __slots__ = ()
+
+
+def n_step_transition_spec(time_step_spec, action_spec):
+  """Returns the spec of the NStepTransitions written by PyNStepWriter.
+
+  Args:
+    time_step_spec: A `TimeStep` of ArraySpecs.
+    action_spec: A nest of ArraySpecs of the actions.
+  Returns:
+    An `NStepTransition` of ArraySpecs.
+  """
+  return NStepTransition(
+      observation=time_step_spec.observation,
+      action=action_spec,
+      reward=array_spec.ArraySpec((), np.float32, 'reward'),
+      discount=array_spec.ArraySpec((), np.float32, 'discount'),
+      next_observation=time_step_spec.observation)
+
+
+class PyNStepWriter(object):
+  """Driver observer writing n-step transitions.
+
+  Each call takes a batch of trajectories, one per environment, as produced by
+  `PyDriver`. A transition is started for every trajectory which is not an
+  episode boundary, and is written once it spans n steps or when its episode
+  ends, whichever comes first. Transitions are written as soon as their last
+  observation is known, i.e. one call after their last reward.
+
+  The rolling windows are kept in arrays of shape [n, batch_size, ...], so the
+  cost of a call does not depend on the number of environments in Python.
+
+  The last observation of an episode is only known from the boundary
+  trajectory which follows its last step. Trajectories collected without
+  boundaries, e.g. by a `PyDriver` stepping an environment with `auto_reset`,
+  are therefore rejected.
+  """
+
+  def __init__(self, n, gamma, observers):
+    """Creates a PyNStepWriter.
+
+    Args:
+      n: Maximum number of steps of a transition.
+      gamma: Discount factor applied to rewards at each step.
+      observers: A list of callables, called with each batch of
+        `NStepTransition`s written, e.g. `[replay_buffer.add_batch]`.
+
+    Raises:
+      ValueError: If n is smaller than 1.
+    """
+    if n < 1:
+      raise ValueError('n must be at least 1, got {}.'.format(n))
+    self._n = n
+    self._gamma = gamma
+    self._observers = observers or []
+    self._valid = None
+
+  @property
+  def n(self):
+    return self._n
+
+  def reset(self):
+    """Drops the transitions in progress, e.g. when environments are reset."""
+    self._valid = None
+
+  def _allocate(self, traj, batch_size):
+    """Allocates the rolling windows for a batch of trajectories."""
+    shape = (self._n, batch_size)
+    window = lambda x: np.zeros(shape + x.shape[1:], dtype=x.dtype)
+    self._observations = nest.map_structure(window, traj.observation)
+    self._actions = nest.map_structure(window, traj.action)
+    self._rewards = np.zeros(shape, dtype=np.float32)
+    self._discounts = np.ones(shape, dtype=np.float32)
+    self._num_steps = np.zeros(shape, dtype=np.int64)
+    self._valid = np.zeros(shape, dtype=np.bool_)
+    self._episode_ended = np.zeros(batch_size, dtype=np.bool_)
+    # Number of transitions started for each environment, which determines
+    # the slot of the next one.
+    self._num_started = np.zeros(batch_size, dtype=np.int64)
+
+  def __call__(self, traj):
+    """Adds a batch of trajectories, writing the transitions completed.
+
+    Args:
+      traj: A `Trajectory` of arrays with an outer batch dimension, or of a
+        single environment without one.
+
+    Raises:
+      ValueError: If the step following the last step of an episode is not a
+        boundary.
+    """
+    if np.ndim(traj.step_type) == 0:
+      traj = nest_utils.batch_nested_array(traj)
+    batch_size = len(traj.step_type)
+    if self._valid is None:
+      self._allocate(traj, batch_size)
+
+    if np.any(self._episode_ended & ~traj.is_boundary()):
+      raise ValueError('PyNStepWriter needs the boundary trajectory following '
+                       'the last step of an episode, which environments with '
+                       'auto_reset do not produce.')
+
+    # Write the transitions whose last observation is the current one.
+    ready = self._valid & ((self._num_steps == self._n) |
+                           self._episode_ended)
+    if np.any(ready):
+      slots, envs = np.nonzero(ready)
+      # Write the transitions of each environment in the order they started.
+      order = np.lexsort((-self._num_steps[slots, envs], envs))
+      slots, envs = slots[order], envs[order]
+      transitions = NStepTransition(
+          observation=nest.map_structure(lambda x: x[slots, envs],
+                                         self._observations),
+          action=nest.map_structure(lambda x: x[slots, envs], self._actions),
+          reward=self._rewards[slots, envs],
+          discount=self._discounts[slots, envs],
+          next_observation=nest.map_structure(lambda x: x[envs],
+                                              traj.observation))
+      self._valid[ready] = False
+      for observer in self._observers:
+        observer(transitions)
+    self._episode_ended[:] = False
+
+    # Boundaries go from the last step of an episode to the first one of the
+    # next, so they neither start transitions nor contribute rewards.
+    active = ~traj.is_boundary()
+    envs = np.flatnonzero(active)
+    slots = self._num_started[envs] % self._n
+    for window, value in zip(nest.flatten(self._observations),
+                             nest.flatten(traj.observation)):
+      window[slots, envs] = value[envs]
+    for window, value in zip(nest.flatten(self._actions),
+                             nest.flatten(traj.action)):
+      window[slots, envs] = value[envs]
+    self._rewards[slots, envs] = 0.
+    self._discounts[slots, envs] = 1.
+    self._num_steps[slots, envs] = 0
+    self._valid[slots, envs] = True
+    self._num_started[envs] += 1
+
+    # Add this step's reward to all the transitions of active environments.
+    update = self._valid & active
+    self._rewards += np.where(update, self._discounts * traj.reward, 0.)
+    self._discounts = np.where(
+        update, self._discounts * self._gamma * traj.discount,
+        self._discounts).astype(np.float32)
+    self._num_steps += update
+    self._episode_ended |= active & traj.is_last()
@@ -0,0 +1,132 @@
+# coding=utf-8
+# Copyright 2018 The TF-Agents Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unit tests for PyNStepWriter."""
+
+from __future__ import division
+from __future__ import unicode_literals
+
+import numpy as np
+import tensorflow as tf
+
+from tf_agents.environments import time_step as ts
+from tf_agents.environments import trajectory
+from tf_agents.replay_buffers import py_n_step_writer
+from tf_agents.replay_buffers import py_uniform_replay_buffer
+from tf_agents.specs import array_spec
+
+nest = tf.contrib.framework.nest
+
+FIRST = ts.StepType.FIRST
+MID = ts.StepType.MID
+LAST = ts.StepType.LAST
+
+
+def _trajectory(step_type, observation, next_step_type, reward, discount):
+  return trajectory.Trajectory(
+      step_type=np.asarray(step_type, dtype=np.int32),
+      observation=np.asarray(observation, dtype=np.int32),
+      action=np.asarray(observation, dtype=np.int32) * 10,
+      policy_info=(),
+      next_step_type=np.asarray(next_step_type, dtype=np.int32),
+      reward=np.asarray(reward, dtype=np.float32),
+      discount=np.asarray(discount, dtype=np.float32))
+
+
+class PyNStepWriterTest(tf.test.TestCase):
+
+  def _write(self, writer, trajectories):
+    transitions = []
+    writer._observers = [transitions.append]
+    for traj in trajectories:
+      writer(traj)
+    return nest.map_structure(lambda *x: np.concatenate(x), *transitions)
+
+  def testNStepReturns(self):
+    writer = py_n_step_writer.PyNStepWriter(n=2, gamma=0.5, observers=[])
+    # An episode with observations 0 to 3, followed by the first step of the
+    # next one. Rewards are 1, 2 and 3, and the episode terminates.
+    transitions = self._write(writer, [
+        _trajectory(FIRST, 0, MID, 1., 1.),
+        _trajectory(MID, 1, MID, 2., 1.),
+        _trajectory(MID, 2, LAST, 3., 0.),
+        _trajectory(LAST, 3, FIRST, 0., 1.),
+        _trajectory(FIRST, 4, MID, 1., 1.),
+    ])
+    self.assertAllEqual([0, 1, 2], transitions.observation)
+    self.assertAllEqual([0, 10, 20], transitions.action)
+    self.assertAllClose([1. + 0.5 * 2., 2. + 0.5 * 3., 3.], transitions.reward)
+    self.assertAllClose([0.25, 0., 0.], transitions.discount)
+    self.assertAllEqual([2, 3, 3], transitions.next_observation)
+
+  def testTruncatedEpisodeBootstraps(self):
+    writer = py_n_step_writer.PyNStepWriter(n=3, gamma=0.5, observers=[])
+    # The episode is cut by a time limit, so the last discount is not 0.
+    transitions = self._write(writer, [
+        _trajectory(FIRST, 0, MID, 1., 1.),
+        _trajectory(MID, 1, LAST, 1., 1.),
+        _trajectory(LAST, 2, FIRST, 0., 1.),
+    ])
+    self.assertAllEqual([0, 1], transitions.observation)
+    self.assertAllClose([1.5, 1.], transitions.reward)
+    self.assertAllClose([0.25, 0.5], transitions.discount)
+    self.assertAllEqual([2, 2], transitions.next_observation)
+
+  def testBatchedEnvironments(self):
+    writer = py_n_step_writer.PyNStepWriter(n=2, gamma=1., observers=[])
+    # Environment 0 ends its episode after one step, environment 1 goes on.
+    transitions = self._write(writer, [
+        _trajectory([FIRST, FIRST], [0, 100], [LAST, MID], [1., 1.],
+                    [0., 1.]),
+        _trajectory([LAST, MID], [1, 101], [FIRST, MID], [0., 1.], [1., 1.]),
+        _trajectory([FIRST, MID], [2, 102], [MID, MID], [1., 1.], [1., 1.]),
+    ])
+    self.assertAllEqual([0, 100], transitions.observation)
+    self.assertAllClose([1., 2.], transitions.reward)
+    self.assertAllClose([0., 1.], transitions.discount)
+    self.assertAllEqual([1, 102], transitions.next_observation)
+
+  def testRejectsEpisodesWithoutBoundaries(self):
+    writer = py_n_step_writer.PyNStepWriter(n=2, gamma=1., observers=[])
+    # With auto_reset, the first step of the next episode follows the last one.
+    writer(_trajectory(FIRST, 0, MID, 1., 1.))
+    writer(_trajectory(MID, 1, LAST, 1., 0.))
+    with self.assertRaises(ValueError):
+      writer(_trajectory(FIRST, 3, MID, 1., 1.))
+
+  def testWritesToReplayBuffer(self):
+    time_step_spec = ts.time_step_spec(array_spec.ArraySpec((), np.int32))
+    spec = py_n_step_writer.n_step_transition_spec(
+        time_step_spec, array_spec.ArraySpec((), np.int32))
+    replay_buffer = py_uniform_replay_buffer.PyUniformReplayBuffer(
+        spec, capacity=10)
+    writer = py_n_step_writer.PyNStepWriter(
+        n=3, gamma=0.9, observers=[replay_buffer.add_batch])
+    writer(_trajectory(FIRST, 0, MID, 1., 1.))
+    for i in range(1, 6):
+      writer(_trajectory(MID, i, MID, 1., 1.))
+    self.assertEqual(3, replay_buffer.size)
+    transition = replay_buffer.get_next()
+    self.assertAllClose(1. + 0.9 + 0.81, transition.reward)
+    self.assertAllClose(0.9**3, transition.discount)
+    self.assertEqual(transition.observation + 3, transition.next_observation)
+
+  def testInvalidN(self):
+    with self.assertRaises(ValueError):
+      py_n_step_writer.PyNStepWriter(n=0, gamma=0.9, observers=[])
+
+
+if __name__ == '__main__':
+  tf.test.main()
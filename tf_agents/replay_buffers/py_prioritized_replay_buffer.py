@@ -0,0 +1,303 @@
+# coding=utf-8
+# Copyright 2018 The TF-Agents Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Prioritized replay buffer in Python.
+
+PyPrioritizedReplayBuffer is a flavor of PyUniformReplayBuffer which samples
+items proportionally to their priority, as described in
+https://arxiv.org/abs/1511.05952.
+
+Priorities are kept in array-backed segment trees, so that both sampling and
+priority updates are O(log N) and vectorized across a whole batch.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import numpy as np
+import tensorflow as tf
+
+from tf_agents.replay_buffers import py_uniform_replay_buffer
+from tf_agents.replay_buffers import tf_uniform_replay_buffer
+from tf_agents.specs import array_spec
+
+nest = tf.contrib.framework.nest
+
+BufferInfo = tf_uniform_replay_buffer.BufferInfo
+
+
+class SegmentTree(tf.contrib.checkpoint.Checkpointable):
+  """A binary tree stored in a numpy array, reducing leaves with `operation`.
+
+  Node 1 is the root, and node i has children 2i and 2i + 1. The leaves start
+  at index `num_leaves`, the smallest power of two not below the capacity.
+  All methods take and return arrays, so that a whole batch of indices is
+  processed with one numpy operation per level of the tree.
+  """
+
+  def __init__(self, capacity, operation, neutral_element):
+    """Creates a SegmentTree.
+
+    Args:
+      capacity: Number of leaves that can be set.
+      operation: Binary numpy ufunc used to combine children, e.g. `np.add`.
+      neutral_element: Neutral element of `operation`, the value of unset
+        leaves.
+    """
+    self._capacity = capacity
+    self._operation = operation
+    self._neutral_element = neutral_element
+    self._depth = int(np.ceil(np.log2(max(capacity, 1))))
+    self._num_leaves = 2**self._depth
+    self._np_state = tf.contrib.checkpoint.NumpyState()
+    self._np_state.tree = np.full(
+        2 * self._num_leaves, neutral_element, dtype=np.float64)
+
+  @property
+  def capacity(self):
+    return self._capacity
+
+  def reduce(self):
+    """Returns the result of reducing all the leaves."""
+    return self._np_state.tree[1]
+
+  def get(self, indices):
+    """Returns the values of the leaves at `indices`."""
+    return self._np_state.tree[np.asarray(indices) + self._num_leaves]
+
+  def set(self, indices, values):
+    """Sets the leaves at `indices` to `values` and updates their ancestors.
+
+    Args:
+      indices: Array of leaf indices in [0, capacity).
+      values: Array of values, broadcastable to the shape of `indices`.
+    """
+    tree = self._np_state.tree
+    nodes = np.ravel(indices) + self._num_leaves
+    tree[nodes] = np.broadcast_to(values, np.shape(indices)).ravel()
+    for _ in range(self._depth):
+      nodes = np.unique(nodes // 2)
+      tree[nodes] = self._operation(tree[2 * nodes], tree[2 * nodes + 1])
+
+  def clear(self):
+    self._np_state.tree[:] = self._neutral_element
+
+
+class SumTree(SegmentTree):
+  """A SegmentTree summing its leaves, supporting proportional sampling."""
+
+  def __init__(self, capacity):
+    super(SumTree, self).__init__(capacity, np.add, 0.0)
+
+  def find_prefix_sum_index(self, prefix_sums):
+    """Finds the leaves at which the running sum reaches `prefix_sums`.
+
+    For each prefix sum s in [0, reduce()), returns the smallest index i such
+    that sum(leaves[:i + 1]) > s. Leaves with a zero value are never returned
+    unless all leaves are zero.
+
+    Args:
+      prefix_sums: Array of prefix sums.
+
+    Returns:
+      An int64 array of leaf indices with the same shape as `prefix_sums`.
+    """
+    tree = self._np_state.tree
+    prefix_sums = np.array(prefix_sums, dtype=np.float64)
+    nodes = np.ones(prefix_sums.shape, dtype=np.int64)
+    for _ in range(self._depth):
+      left = 2 * nodes
+      left_sums = tree[left]
+      # Guard against rounding errors sending us into an empty subtree.
+      go_right = (prefix_sums >= left_sums) & (tree[left + 1] > 0)
+      prefix_sums -= np.where(go_right, left_sums, 0.0)
+      nodes = left + go_right
+    return nodes - self._num_leaves
+
+
+class MinTree(SegmentTree):
+  """A SegmentTree keeping the minimum of its leaves."""
+
+  def __init__(self, capacity):
+    super(MinTree, self).__init__(capacity, np.minimum, np.inf)
+
+
+class PyPrioritizedReplayBuffer(py_uniform_replay_buffer.PyUniformReplayBuffer):
+  """A Python-based replay buffer that supports prioritized sampling.
+
+  Items are sampled with probability p_i^alpha / sum_k p_k^alpha, where p_i is
+  the priority of item i. New items are added with the maximum priority seen
+  so far, so they are sampled at least once before their priority is updated.
+
+  Unlike PyUniformReplayBuffer, `get_next` returns a 2-tuple of the items and
+  a `BufferInfo` holding the items' ids and sampling probabilities, matching
+  TFUniformReplayBuffer. The ids can be used to update the priorities with
+  `update_priorities`.
+
+  Writing and reading to this replay buffer is thread safe.
+  """
+
+  def __init__(self, data_spec, capacity, alpha=0.6, storage_directory=None):
+    """Creates a PyPrioritizedReplayBuffer.
+
+    Args:
+      data_spec: An ArraySpec or a list/tuple/nest of ArraySpecs describing a
+        single item that can be stored in this buffer.
+      capacity: The maximum number of items that can be stored in the buffer.
+      alpha: Exponent applied to the priorities. 0 corresponds to uniform
+        sampling.
+      storage_directory: Optional directory in which the items are stored as
+        memory-mapped files. See `PyUniformReplayBuffer`.
+    """
+    super(PyPrioritizedReplayBuffer, self).__init__(
+        data_spec, capacity, storage_directory=storage_directory)
+    self._alpha = alpha
+    self._sum_tree = SumTree(capacity)
+    self._min_tree = MinTree(capacity)
+
+    # Id of the item stored in each row, and id of the first item added since
+    # the last clear, which is stored in row 0.
+    self._np_state.ids = np.full(capacity, -1, dtype=np.int64)
+    self._np_state.first_id = np.int64(0)
+    self._np_state.max_priority = np.float64(1.0)
+
+  @property
+  def alpha(self):
+    return self._alpha
+
+  @property
+  def min_probability(self):
+    """Smallest sampling probability of an item in the buffer.
+
+    Useful to normalize importance sampling weights.
+    """
+    with self._lock:
+      total = self._sum_tree.reduce()
+      if total <= 0:
+        return 0.0
+      return self._min_tree.reduce() / total
+
+  def _on_insert(self, rows, item_ids):
+    self._np_state.ids[rows] = item_ids
+    value = self._np_state.max_priority**self._alpha
+    self._sum_tree.set(rows, value)
+    self._min_tree.set(rows, value)
+
+  def update_priorities(self, ids, priorities):
+    """Updates the priorities of a batch of items.
+
+    Ids of items that have since been overwritten are ignored.
+
+    Args:
+      ids: Array of item ids, as returned in `BufferInfo.ids`.
+      priorities: Array of non-negative priorities with the same shape as
+        `ids`.
+
+    Raises:
+      ValueError: If the shapes of `ids` and `priorities` differ, or if any
+        priority is negative.
+    """
+    ids = np.asarray(ids, dtype=np.int64)
+    priorities = np.asarray(priorities, dtype=np.float64)
+    if ids.shape != priorities.shape:
+      raise ValueError('ids and priorities must have the same shape, got {} '
+                       'and {}.'.format(ids.shape, priorities.shape))
+    if np.any(priorities < 0):
+      raise ValueError('Priorities must be non-negative: {}'.format(priorities))
+    ids = ids.ravel()
+    priorities = priorities.ravel()
+
+    with self._lock:
+      rows = (ids - self._np_state.first_id) % self._capacity
+      valid = ((ids >= self._np_state.first_id) &
+               (self._np_state.ids[rows] == ids))
+      if not np.any(valid):
+        return
+      rows = rows[valid]
+      priorities = priorities[valid]
+      values = priorities**self._alpha
+      self._sum_tree.set(rows, values)
+      self._min_tree.set(rows, values)
+      self._np_state.max_priority = np.maximum(self._np_state.max_priority,
+                                               np.max(priorities))
+
+  def _get_next(self,
+                sample_batch_size=None,
+                num_steps=None,
+                time_stacked=True):
+    num_steps_value = num_steps if num_steps is not None else 1
+    sample_batch_size_value = (
+        sample_batch_size if sample_batch_size is not None else 1)
+    with self._lock:
+      if self._np_state.size <= 0:
+        raise ValueError('Read error: empty replay buffer')
+      if self._np_state.size < num_steps_value:
+        raise ValueError('Read error: replay buffer holds {} items, fewer than '
+                         'num_steps={}'.format(self._np_state.size,
+                                               num_steps_value))
+
+      # The items just before the head cannot start a sub-episode of
+      # num_steps_value items, so their priority is zeroed while sampling.
+      blocked_rows = ((self._np_state.cur_id -
+                       np.arange(1, num_steps_value)) % self._capacity)
+      blocked_values = self._sum_tree.get(blocked_rows)
+      self._sum_tree.set(blocked_rows, 0.0)
+      try:
+        total = self._sum_tree.reduce()
+        if total <= 0:
+          raise ValueError('Read error: all items have zero priority')
+        # Stratified sampling: one prefix sum per equal-mass segment.
+        prefix_sums = (
+            (np.arange(sample_batch_size_value) +
+             np.random.uniform(size=sample_batch_size_value)) *
+            (total / sample_batch_size_value))
+        start_rows = self._sum_tree.find_prefix_sum_index(prefix_sums)
+        probabilities = (self._sum_tree.get(start_rows) / total).astype(
+            np.float32)
+      finally:
+        self._sum_tree.set(blocked_rows, blocked_values)
+
+      rows = (np.expand_dims(start_rows, 1) +
+              np.arange(num_steps_value)) % self._capacity
+      items = self._decode(self._storage.get(rows))
+      ids = self._np_state.ids[rows]
+
+    items = self._format_sample(items, sample_batch_size, num_steps,
+                                time_stacked)
+    ids = self._format_sample(ids, sample_batch_size, num_steps, time_stacked)
+    if sample_batch_size is None:
+      probabilities = probabilities[0]
+    return items, BufferInfo(ids=ids, probabilities=probabilities)
+
+  def _as_dataset(self, sample_batch_size=None, num_steps=None,
+                  num_parallel_calls=None):
+    outer_dims = () if sample_batch_size is None else (sample_batch_size,)
+    step_dims = outer_dims if num_steps is None else outer_dims + (num_steps,)
+    spec = (array_spec.add_outer_dims_nest(self._data_spec, step_dims),
+            BufferInfo(ids=array_spec.ArraySpec(step_dims, np.int64),
+                       probabilities=array_spec.ArraySpec(outer_dims,
+                                                          np.float32)))
+    return py_uniform_replay_buffer.sample_dataset(
+        spec, lambda: self._get_next(sample_batch_size, num_steps),
+        num_parallel_calls)
+
+  def _clear(self):
+    with self._lock:
+      super(PyPrioritizedReplayBuffer, self)._clear()
+      self._sum_tree.clear()
+      self._min_tree.clear()
+      self._np_state.ids[:] = -1
+      self._np_state.first_id = self._np_state.item_count
+      self._np_state.max_priority = np.float64(1.0)
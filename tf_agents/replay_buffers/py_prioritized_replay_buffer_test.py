@@ -0,0 +1,163 @@
+# coding=utf-8
+# Copyright 2018 The TF-Agents Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unit tests for PyPrioritizedReplayBuffer."""
+
+from __future__ import division
+from __future__ import unicode_literals
+
+import os
+
+import numpy as np
+import tensorflow as tf
+
+from tf_agents.replay_buffers import py_prioritized_replay_buffer
+from tf_agents.specs import array_spec
+
+
+class SumTreeTest(tf.test.TestCase):
+
+  def testReduce(self):
+    tree = py_prioritized_replay_buffer.SumTree(5)
+    tree.set(np.arange(5), [1.0, 0.0, 2.0, 0.0, 1.0])
+    self.assertEqual(4.0, tree.reduce())
+    tree.set([2, 2], [3.0, 0.5])
+    self.assertEqual(2.5, tree.reduce())
+    self.assertAllEqual([1.0, 0.5], tree.get([0, 2]))
+
+  def testFindPrefixSumIndex(self):
+    tree = py_prioritized_replay_buffer.SumTree(5)
+    tree.set(np.arange(5), [1.0, 0.0, 2.0, 0.0, 1.0])
+    indices = tree.find_prefix_sum_index([0.0, 0.99, 1.0, 2.5, 3.0, 4.0])
+    # Leaves with zero value are never selected, even past the total.
+    self.assertAllEqual([0, 0, 2, 2, 4, 4], indices)
+
+  def testMinTree(self):
+    tree = py_prioritized_replay_buffer.MinTree(5)
+    self.assertEqual(np.inf, tree.reduce())
+    tree.set([0, 3], [2.0, 0.5])
+    self.assertEqual(0.5, tree.reduce())
+    tree.clear()
+    self.assertEqual(np.inf, tree.reduce())
+
+
+class PyPrioritizedReplayBufferTest(tf.test.TestCase):
+
+  def _create_replay_buffer(self, capacity=10, alpha=1.0):
+    return py_prioritized_replay_buffer.PyPrioritizedReplayBuffer(
+        data_spec=array_spec.ArraySpec((), np.int32),
+        capacity=capacity,
+        alpha=alpha)
+
+  def testNewItemsSampledUniformly(self):
+    np.random.seed(12345)
+    replay_buffer = self._create_replay_buffer()
+    replay_buffer.add_batch(np.arange(15, dtype=np.int32))
+
+    items, buffer_info = replay_buffer.get_next(sample_batch_size=1000)
+    self.assertEqual((1000,), items.shape)
+    self.assertAllGreaterEqual(items, 5)
+    self.assertAllEqual(items, buffer_info.ids)
+    self.assertAllClose(np.full(1000, 0.1), buffer_info.probabilities)
+
+  def testSampleProportionalToPriority(self):
+    np.random.seed(12345)
+    replay_buffer = self._create_replay_buffer()
+    replay_buffer.add_batch(np.arange(10, dtype=np.int32))
+    priorities = np.zeros(10)
+    priorities[2] = 1.0
+    priorities[7] = 3.0
+    replay_buffer.update_priorities(np.arange(10), priorities)
+
+    items, buffer_info = replay_buffer.get_next(sample_batch_size=1000)
+    self.assertAllEqual([2, 7], np.unique(items))
+    self.assertAllClose(priorities[items] / 4.0, buffer_info.probabilities)
+    self.assertAlmostEqual(250, np.sum(items == 2), delta=50)
+    self.assertEqual(0.0, replay_buffer.min_probability)
+
+  def testSampleWithNumSteps(self):
+    replay_buffer = self._create_replay_buffer()
+    replay_buffer.add_batch(np.arange(15, dtype=np.int32))
+    # All the mass is on the newest item, which cannot start a sub-episode.
+    priorities = np.zeros(10)
+    priorities[-2:] = 1.0
+    replay_buffer.update_priorities(np.arange(5, 15), priorities)
+
+    items, buffer_info = replay_buffer.get_next(sample_batch_size=10,
+                                                num_steps=2)
+    self.assertAllEqual(np.tile([13, 14], [10, 1]), items)
+    self.assertAllEqual(items, buffer_info.ids)
+    self.assertAllClose(np.ones(10), buffer_info.probabilities)
+
+    (first, second), buffer_info = replay_buffer.get_next(num_steps=2,
+                                                          time_stacked=False)
+    self.assertEqual(13, first)
+    self.assertEqual(14, second)
+    self.assertEqual((13, 14), buffer_info.ids)
+
+  def testUpdatePrioritiesIgnoresOverwrittenIds(self):
+    replay_buffer = self._create_replay_buffer(capacity=2)
+    replay_buffer.add_batch(np.arange(4, dtype=np.int32))
+    replay_buffer.update_priorities([1, 2], [0.0, 0.0])
+    items, _ = replay_buffer.get_next(sample_batch_size=10)
+    self.assertAllEqual(np.full(10, 3), items)
+
+    replay_buffer.clear()
+    replay_buffer.add_batch(np.array([10], dtype=np.int32))
+    replay_buffer.update_priorities([3], [0.0])
+    items, buffer_info = replay_buffer.get_next(sample_batch_size=3)
+    self.assertAllEqual([10, 10, 10], items)
+    self.assertAllEqual([4, 4, 4], buffer_info.ids)
+
+  def testUpdatePrioritiesRaisesOnNegativePriority(self):
+    replay_buffer = self._create_replay_buffer()
+    replay_buffer.add_batch(np.arange(2, dtype=np.int32))
+    with self.assertRaises(ValueError):
+      replay_buffer.update_priorities([0, 1], [1.0, -1.0])
+
+  def testAsDataset(self):
+    replay_buffer = self._create_replay_buffer()
+    replay_buffer.add_batch(np.arange(10, dtype=np.int32))
+
+    ds = replay_buffer.as_dataset(sample_batch_size=5, num_steps=3,
+                                 num_parallel_calls=2)
+    items, buffer_info = ds.make_one_shot_iterator().get_next()
+    self.assertEqual([5, 3], items.shape.as_list())
+    self.assertEqual([5, 3], buffer_info.ids.shape.as_list())
+    self.assertEqual([5], buffer_info.probabilities.shape.as_list())
+    with self.test_session() as sess:
+      items_, buffer_info_ = sess.run((items, buffer_info))
+      self.assertAllEqual(items_, buffer_info_.ids)
+      self.assertAllEqual(items_[:, 0] + 1, items_[:, 1])
+
+  def testCheckpointable(self):
+    replay_buffer = self._create_replay_buffer()
+    replay_buffer.add_batch(np.arange(10, dtype=np.int32))
+    replay_buffer.update_priorities([4], [100.0])
+
+    with self.test_session():
+      prefix = os.path.join(self.get_temp_dir(), 'ckpt')
+      save_path = tf.train.Checkpoint(rb=replay_buffer).save(prefix)
+
+      loaded_rb = self._create_replay_buffer()
+      loader = tf.train.Checkpoint(rb=loaded_rb)
+      loader.restore(save_path).initialize_or_restore()
+      self.assertEqual(10, loaded_rb.size)
+      items, _ = loaded_rb.get_next(sample_batch_size=100)
+      self.assertGreater(np.sum(items == 4), 50)
+
+
+if __name__ == '__main__':
+  tf.test.main()
@@ -24,14 +24,53 @@ from absl.testing import parameterized
 import numpy as np
 import tensorflow as tf
 
+from tf_agents.environments import lazy_frames
 from tf_agents.environments import time_step as ts
 from tf_agents.environments import trajectory
 from tf_agents.policies import policy_step
+from tf_agents.replay_buffers import numpy_storage
 from tf_agents.replay_buffers import py_hashed_replay_buffer
 from tf_agents.replay_buffers import py_uniform_replay_buffer
 from tf_agents.specs import array_spec
 from tf_agents.utils import nest_utils
 
+nest = tf.contrib.framework.nest
+
+
+def _trajectory_spec():
+  return trajectory.Trajectory(
+      step_type=array_spec.ArraySpec((), np.int32),
+      observation=array_spec.ArraySpec((), np.int32),
+      action=array_spec.ArraySpec((), np.int32),
+      policy_info=(),
+      next_step_type=array_spec.ArraySpec((), np.int32),
+      reward=array_spec.ArraySpec((), np.float32),
+      discount=array_spec.ArraySpec((), np.float32))
+
+
+def _episodes(episode_lengths):
+  """Returns a batch of trajectories of consecutive episodes.
+
+  Args:
+    episode_lengths: Number of time steps of each episode. An episode of n
+      time steps gives n trajectories, the last one being a boundary.
+
+  Returns:
+    A Trajectory of arrays, whose observations count the items.
+  """
+  step_type = np.concatenate(
+      [[ts.StepType.FIRST] + [ts.StepType.MID] * (n - 2) + [ts.StepType.LAST]
+       for n in episode_lengths]).astype(np.int32)
+  num_items = len(step_type)
+  return trajectory.Trajectory(
+      step_type=step_type,
+      observation=np.arange(num_items, dtype=np.int32),
+      action=np.zeros(num_items, dtype=np.int32),
+      policy_info=(),
+      next_step_type=np.roll(step_type, -1),
+      reward=np.zeros(num_items, dtype=np.float32),
+      discount=np.ones(num_items, dtype=np.float32))
+
 
 class FrameBufferTest(tf.test.TestCase):
 
@@ -49,6 +88,62 @@ class FrameBufferTest(tf.test.TestCase):
     fb.on_delete([h])
     self.assertEqual(1, len(fb))
 
+  def testCompressDecompress(self):
+    fb = py_hashed_replay_buffer.FrameBuffer()
+    frames = np.random.randint(low=0, high=256, size=[5, 8, 8], dtype=np.uint8)
+    # Consecutive observations stack overlapping windows of 4 frames.
+    observations = np.stack(
+        [np.moveaxis(frames[i:i + 4], 0, -1) for i in range(2)])
+    slots = np.stack([fb.compress(obs) for obs in observations])
+    self.assertEqual((2, 4), slots.shape)
+    self.assertEqual(5, len(fb))
+    self.assertAllEqual(slots[0, 1:], slots[1, :-1])
+    self.assertAllEqual(observations, fb.decompress(slots))
+
+    # Freed slots are reused before the pool grows.
+    fb.on_delete(slots[0])
+    self.assertEqual(4, len(fb))
+    new_slot = fb.add_frame(frames[0] + 1)
+    self.assertEqual(slots[0, 0], new_slot)
+    self.assertAllEqual(observations[1], fb.decompress(slots[1]))
+
+  def testCompressLazyFrames(self):
+    fb = py_hashed_replay_buffer.FrameBuffer()
+    frames = [np.full((8, 8, 1), k, dtype=np.uint8) for k in range(5)]
+    observations = [
+        lazy_frames.LazyFrames(frames[i:i + 4], keys=list(range(i, i + 4)),
+                               axis=2) for i in range(2)]
+    slots = np.stack([fb.compress(obs) for obs in observations])
+    self.assertEqual(5, len(fb))
+    self.assertAllEqual(slots[0, 1:], slots[1, :-1])
+    self.assertAllEqual(np.stack([np.asarray(obs) for obs in observations]),
+                        fb.decompress(slots))
+
+    # Frames are identified by their keys rather than by their content.
+    fb.compress(lazy_frames.LazyFrames(frames[:4], keys=[10, 11, 12, 13],
+                                       axis=2))
+    self.assertEqual(9, len(fb))
+    # Stacks of frames without keys are split and hashed.
+    for _ in range(2):
+      fb.compress(lazy_frames.LazyFrames(frames[:4], axis=2))
+    self.assertEqual(13, len(fb))
+
+  def testPoolGrows(self):
+    fb = py_hashed_replay_buffer.FrameBuffer()
+    frames = np.arange(100 * 4, dtype=np.int32).reshape([100, 2, 2])
+    slots = [fb.add_frame(frame) for frame in frames]
+    self.assertEqual(100, len(fb))
+    self.assertAllEqual(frames, fb.decompress(np.expand_dims(slots, -1),
+                                              split_axis=0)[:, 0])
+
+  def testPoolPreallocated(self):
+    fb = py_hashed_replay_buffer.FrameBuffer(initial_num_slots=128)
+    frames = np.arange(100 * 4, dtype=np.int32).reshape([100, 2, 2])
+    for frame in frames:
+      fb.add_frame(frame)
+    self.assertEqual(100, len(fb))
+    self.assertEqual((128, 2, 2), fb._np_state.pool.shape)
+
 
 class PyUniformReplayBufferTest(parameterized.TestCase, tf.test.TestCase):
 
@@ -111,6 +206,111 @@ class PyUniformReplayBufferTest(parameterized.TestCase, tf.test.TestCase):
         self.assertAllEqual(traj.observation[:, :, 0] + 3,
                             traj.observation[:, :, 3])
 
+  @parameterized.named_parameters(
+      [('WithoutHashing', py_uniform_replay_buffer.PyUniformReplayBuffer),
+       ('WithHashing', py_hashed_replay_buffer.PyHashedReplayBuffer)])
+  def testGatherAll(self, rb_cls):
+    self._generate_replay_buffer(rb_cls=rb_cls)
+
+    traj = self._replay_buffer.gather_all()
+    self.assertEqual((1, self._capacity, 15, 15, 4), traj.observation.shape)
+    # Only the last `capacity` items remain, in insertion order.
+    first = self._transition_count - self._capacity
+    self.assertAllEqual(np.arange(first, self._transition_count),
+                        traj.observation[0, :, 0, 0, 0])
+    self.assertAllEqual(traj.observation[0, :, 0, 0, 0] + 3,
+                        traj.observation[0, :, 0, 0, 3])
+
+  def testGatherAllPartiallyFilled(self):
+    replay_buffer = py_uniform_replay_buffer.PyUniformReplayBuffer(
+        data_spec=array_spec.ArraySpec((), np.int32), capacity=10)
+    self.assertEqual((1, 0), replay_buffer.gather_all().shape)
+    replay_buffer.add_batch(np.arange(4, dtype=np.int32))
+    self.assertAllEqual([[0, 1, 2, 3]], replay_buffer.gather_all())
+    replay_buffer.add_batch(np.arange(4, 12, dtype=np.int32))
+    self.assertAllEqual([np.arange(2, 12)], replay_buffer.gather_all())
+
+  def testSampleWithinEpisodes(self):
+    np.random.seed(12345)
+    replay_buffer = py_uniform_replay_buffer.PyUniformReplayBuffer(
+        data_spec=_trajectory_spec(), capacity=20, sample_within_episodes=True)
+    # Adds 25 items in two batches so that the buffer wraps around.
+    items = _episodes([5, 3, 6, 2, 9])
+    replay_buffer.add_batch(nest.map_structure(lambda x: x[:14], items))
+    replay_buffer.add_batch(nest.map_structure(lambda x: x[14:], items))
+
+    traj = replay_buffer.get_next(sample_batch_size=500, num_steps=3)
+    self.assertEqual((500, 3), traj.observation.shape)
+    self.assertAllEqual(traj.observation[:, :-1] + 1, traj.observation[:, 1:])
+    # Only the last item of a sub-episode can be a boundary.
+    self.assertFalse(np.any(traj.is_boundary()[:, :-1]))
+    # The first episode has been overwritten, and the 1 + 4 + 0 + 7 valid
+    # sub-episodes of the other ones are all sampled.
+    self.assertEqual(12, len(np.unique(traj.observation[:, 0])))
+    self.assertAllGreaterEqual(traj.observation, 5)
+
+  def testSampleWithinEpisodesWithoutBoundaries(self):
+    np.random.seed(12345)
+    replay_buffer = py_uniform_replay_buffer.PyUniformReplayBuffer(
+        data_spec=_trajectory_spec(), capacity=20, sample_within_episodes=True)
+    # Episodes collected with auto_reset have no boundary trajectories.
+    items = _episodes([5, 3, 6, 2, 9])
+    items = nest.map_structure(lambda x: x[~items.is_boundary()], items)
+    replay_buffer.add_batch(nest.map_structure(lambda x: x[:9], items))
+    replay_buffer.add_batch(nest.map_structure(lambda x: x[9:], items))
+
+    traj = replay_buffer.get_next(sample_batch_size=500, num_steps=3)
+    self.assertFalse(np.any(traj.is_boundary()))
+    # Only the first item of a sub-episode can start an episode.
+    self.assertFalse(np.any(traj.is_first()[:, 1:]))
+    # The 2 + 0 + 3 + 0 + 6 valid sub-episodes are all sampled.
+    self.assertEqual(11, len(np.unique(traj.observation[:, 0])))
+
+  def testSampleWithinEpisodesRaisesWithoutValidSubEpisodes(self):
+    replay_buffer = py_uniform_replay_buffer.PyUniformReplayBuffer(
+        data_spec=_trajectory_spec(), capacity=20, sample_within_episodes=True)
+    replay_buffer.add_batch(_episodes([2, 2, 2]))
+    replay_buffer.get_next(sample_batch_size=5, num_steps=2)
+    with self.assertRaises(ValueError):
+      replay_buffer.get_next(sample_batch_size=5, num_steps=3)
+
+  def testSampleWithinEpisodesRequiresTrajectories(self):
+    with self.assertRaises(ValueError):
+      py_uniform_replay_buffer.PyUniformReplayBuffer(
+          data_spec=array_spec.ArraySpec((), np.int32), capacity=10,
+          sample_within_episodes=True)
+
+  @parameterized.named_parameters(
+      [('WithoutNumSteps', None, 10), ('WithNumSteps', 2, 9)])
+  def testSampleWithoutReplacement(self, num_steps, epoch_size):
+    replay_buffer = py_uniform_replay_buffer.PyUniformReplayBuffer(
+        data_spec=array_spec.ArraySpec((), np.int32), capacity=10,
+        sample_without_replacement=True)
+    replay_buffer.add_batch(np.arange(13, dtype=np.int32))
+
+    samples = np.concatenate(
+        [replay_buffer.get_next(sample_batch_size=4, num_steps=num_steps)
+         for _ in range(5)])
+    first_items = samples if num_steps is None else samples[:, 0]
+    # Batches span epochs, each of which samples every valid item once.
+    for epoch in range(20 // epoch_size):
+      self.assertAllEqual(
+          np.arange(3, 3 + epoch_size),
+          np.sort(first_items[epoch * epoch_size:(epoch + 1) * epoch_size]))
+
+  def testSampleWithoutReplacementWithinEpisodes(self):
+    replay_buffer = py_uniform_replay_buffer.PyUniformReplayBuffer(
+        data_spec=_trajectory_spec(), capacity=20, sample_within_episodes=True,
+        sample_without_replacement=True)
+    replay_buffer.add_batch(_episodes([5, 3, 6, 2, 4]))
+
+    # Each epoch samples the 3 + 1 + 4 + 0 + 2 valid sub-episodes once.
+    traj = replay_buffer.get_next(sample_batch_size=20, num_steps=3)
+    self.assertFalse(np.any(traj.is_boundary()[:, :-1]))
+    valid_starts = [0, 1, 2, 5, 8, 9, 10, 11, 16, 17]
+    self.assertAllEqual(valid_starts, np.sort(traj.observation[:10, 0]))
+    self.assertAllEqual(valid_starts, np.sort(traj.observation[10:, 0]))
+
   def testSampleDoesNotCrossHead(self):
     np.random.seed(12345)
 
@@ -143,6 +343,103 @@ class PyUniformReplayBufferTest(parameterized.TestCase, tf.test.TestCase):
     for i in range(9):
       self.assertAlmostEqual(10000 / 9, sample_frequency[i], delta=150)
 
+  def testAddBatchWrapsAround(self):
+    data_spec = array_spec.ArraySpec((), np.int32)
+    replay_buffer = py_uniform_replay_buffer.PyUniformReplayBuffer(
+        data_spec=data_spec, capacity=10)
+
+    replay_buffer.add_batch(np.arange(7, dtype=np.int32))
+    self.assertEqual(7, replay_buffer.size)
+    replay_buffer.add_batch(np.arange(7, 14, dtype=np.int32))
+    self.assertEqual(10, replay_buffer.size)
+    items = replay_buffer.get_next(sample_batch_size=100, num_steps=2)
+    # Only items 4-13 remain, and sub-episodes never cross the head.
+    self.assertAllGreaterEqual(items, 4)
+    self.assertAllEqual(items[:, 0] + 1, items[:, 1])
+
+    # A batch larger than the capacity keeps only its most recent items.
+    replay_buffer.add_batch(np.arange(14, 40, dtype=np.int32))
+    self.assertEqual(10, replay_buffer.size)
+    self.assertAllGreaterEqual(replay_buffer.get_next(sample_batch_size=100),
+                               30)
+
+  def testHashedAddBatchReleasesFrames(self):
+    self._generate_replay_buffer(
+        rb_cls=py_hashed_replay_buffer.PyHashedReplayBuffer)
+    num_frames = len(self._replay_buffer._frame_buffer)
+
+    # Overwrite the whole buffer with a single batch of identical items.
+    item = self._replay_buffer.get_next()
+    items = nest_utils.stack_nested_arrays([item] * self._capacity)
+    self._replay_buffer.add_batch(items)
+    self.assertEqual(self._capacity, self._replay_buffer.size)
+    self.assertLess(len(self._replay_buffer._frame_buffer), num_frames)
+    self.assertEqual(4, len(self._replay_buffer._frame_buffer))
+
+  def testHashedAddLazyFrames(self):
+    data_spec = _trajectory_spec()._replace(
+        observation=array_spec.ArraySpec((15, 15, 4), np.uint8))
+    replay_buffer = py_hashed_replay_buffer.PyHashedReplayBuffer(
+        data_spec=data_spec, capacity=8)
+
+    # Consecutive observations share 3 of their 4 frames, as with FrameStack4.
+    frames = [np.full((15, 15, 1), k, dtype=np.uint8) for k in range(9)]
+    observations = lazy_frames.stack(
+        [lazy_frames.LazyFrames(frames[k:k + 4], keys=list(range(k, k + 4)),
+                                axis=2) for k in range(6)])
+    replay_buffer.add_batch(_episodes([6])._replace(observation=observations))
+
+    self.assertEqual(6, replay_buffer.size)
+    self.assertEqual(9, len(replay_buffer._frame_buffer))
+    self.assertAllEqual(np.asarray(observations),
+                        replay_buffer.gather_all().observation[0])
+
+  @parameterized.named_parameters(
+      [('WithoutHashing', py_uniform_replay_buffer.PyUniformReplayBuffer),
+       ('WithHashing', py_hashed_replay_buffer.PyHashedReplayBuffer)])
+  def testGetNextBatchWithNumSteps(self, rb_cls):
+    self._generate_replay_buffer(rb_cls=rb_cls)
+
+    traj = self._replay_buffer.get_next(sample_batch_size=5, num_steps=3)
+    self.assertEqual(traj.observation.shape, (5, 3, 15, 15, 4))
+    self.assertEqual(traj.action.shape, (5, 3))
+    # Each sampled sub-episode is made of consecutive frames.
+    self.assertAllEqual(traj.observation[:, 0, 0, 0, :] + 1,
+                        traj.observation[:, 1, 0, 0, :])
+    self.assertAllEqual(traj.observation[:, 1, 0, 0, :] + 1,
+                        traj.observation[:, 2, 0, 0, :])
+
+    steps = self._replay_buffer.get_next(
+        sample_batch_size=5, num_steps=3, time_stacked=False)
+    self.assertEqual(3, len(steps))
+    for step in steps:
+      self.assertEqual(step.observation.shape, (5, 15, 15, 4))
+      self.assertEqual(step.action.shape, (5,))
+
+  @parameterized.named_parameters(
+      [('WithoutHashing', py_uniform_replay_buffer.PyUniformReplayBuffer,
+        None),
+       ('WithHashing', py_hashed_replay_buffer.PyHashedReplayBuffer, None),
+       ('WithoutHashingParallel',
+        py_uniform_replay_buffer.PyUniformReplayBuffer, 3),
+       ('WithHashingParallel', py_hashed_replay_buffer.PyHashedReplayBuffer,
+        3)])
+  def testAsDatasetBatchWithNumSteps(self, rb_cls, num_parallel_calls):
+    self._generate_replay_buffer(rb_cls=rb_cls)
+
+    ds = self._replay_buffer.as_dataset(
+        sample_batch_size=5, num_steps=3,
+        num_parallel_calls=num_parallel_calls)
+    tf_trajectory = ds.make_one_shot_iterator().get_next()
+    self.assertEqual([5, 3, 15, 15, 4],
+                     tf_trajectory.observation.shape.as_list())
+    self.assertEqual([5, 3], tf_trajectory.action.shape.as_list())
+    with self.test_session() as sess:
+      for _ in range(10):
+        traj = sess.run(tf_trajectory)
+        self.assertAllEqual(traj.observation[:, :-1, 0, 0, :] + 1,
+                            traj.observation[:, 1:, 0, 0, :])
+
   @parameterized.named_parameters(
       [('WithoutHashing', py_uniform_replay_buffer.PyUniformReplayBuffer),
        ('WithHashing', py_hashed_replay_buffer.PyHashedReplayBuffer)])
@@ -230,5 +527,139 @@ class PyUniformReplayBufferTest(parameterized.TestCase, tf.test.TestCase):
                             traj.observation[:, :, 3])
 
 
+  def testMemmapStorage(self):
+    data_spec = array_spec.ArraySpec((3,), np.int32)
+    directory = os.path.join(self.get_temp_dir(), 'memmap')
+    replay_buffer = py_uniform_replay_buffer.PyUniformReplayBuffer(
+        data_spec=data_spec, capacity=10, storage_directory=directory)
+    replay_buffer.add_batch(
+        np.tile(np.arange(12, dtype=np.int32)[:, None], [1, 3]))
+    self.assertEqual(1, len(os.listdir(directory)))
+
+    with self.test_session():
+      prefix = os.path.join(self.get_temp_dir(), 'ckpt')
+      replay_buffer.flush()
+      save_path = tf.train.Checkpoint(rb=replay_buffer).save(prefix)
+
+      # The restored buffer reopens the files and only restores its state.
+      loaded_rb = py_uniform_replay_buffer.PyUniformReplayBuffer(
+          data_spec=data_spec, capacity=10, storage_directory=directory)
+      loader = tf.train.Checkpoint(rb=loaded_rb)
+      loader.restore(save_path).initialize_or_restore()
+      self.assertEqual(10, loaded_rb.size)
+      items = loaded_rb.get_next(sample_batch_size=100, num_steps=2)
+      self.assertAllGreaterEqual(items, 2)
+      self.assertAllEqual(items[:, 0] + 1, items[:, 1])
+
+  def testMemmapStorageRejectsMismatchedFiles(self):
+    directory = os.path.join(self.get_temp_dir(), 'mismatch')
+    replay_buffer = py_uniform_replay_buffer.PyUniformReplayBuffer(
+        data_spec=array_spec.ArraySpec((3,), np.int32), capacity=10,
+        storage_directory=directory)
+    replay_buffer.add_batch(np.zeros((1, 3), dtype=np.int32))
+
+    replay_buffer = py_uniform_replay_buffer.PyUniformReplayBuffer(
+        data_spec=array_spec.ArraySpec((4,), np.int32), capacity=10,
+        storage_directory=directory)
+    with self.assertRaises(ValueError):
+      replay_buffer.add_batch(np.zeros((1, 4), dtype=np.int32))
+
+  def _codec_data_spec(self):
+    return {
+        'obs': array_spec.BoundedArraySpec((6,), np.float32, -1., 1.),
+        'aux': {'vel': array_spec.ArraySpec((2,), np.float32),
+                'count': array_spec.ArraySpec((), np.int32)},
+    }
+
+  def _codec_items(self, start, stop):
+    values = np.arange(start, stop, dtype=np.float32)
+    return {
+        'obs': np.tile(np.sin(values)[:, None], [1, 6]),
+        'aux': {'vel': np.tile(values[:, None], [1, 2]),
+                'count': np.arange(start, stop, dtype=np.int32)},
+    }
+
+  @parameterized.named_parameters(
+      [('Float16', numpy_storage.Float16Codec(), 1e-3),
+       ('QuantizeUint8', numpy_storage.QuantizeUint8Codec(), 1. / 255),
+       ('Zlib', numpy_storage.ZlibCodec(block_size=4, cache_size=2), 0.)])
+  def testStorageCodecs(self, codec, tolerance):
+    replay_buffer = py_uniform_replay_buffer.PyUniformReplayBuffer(
+        data_spec=self._codec_data_spec(), capacity=10,
+        storage_codecs={'obs': codec,
+                        'aux/vel': numpy_storage.ZlibCodec(block_size=3)})
+    replay_buffer.add_batch(self._codec_items(0, 7))
+    replay_buffer.add_batch(self._codec_items(7, 15))
+
+    items = replay_buffer.gather_all()
+    expected = self._codec_items(5, 15)
+    self.assertEqual(np.float32, items['obs'].dtype)
+    self.assertAllClose(expected['obs'], items['obs'][0], atol=tolerance)
+    self.assertAllEqual(expected['aux']['vel'], items['aux']['vel'][0])
+    self.assertAllEqual(expected['aux']['count'], items['aux']['count'][0])
+
+  def testDictDataSpecWithoutCodecs(self):
+    replay_buffer = py_uniform_replay_buffer.PyUniformReplayBuffer(
+        data_spec=self._codec_data_spec(), capacity=10)
+    replay_buffer.add_batch(self._codec_items(0, 4))
+    items = replay_buffer.gather_all()
+    self.assertAllEqual([np.arange(4)], items['aux']['count'])
+
+  def testStorageCodecsRejectInvalidConfigurations(self):
+    data_spec = self._codec_data_spec()
+    for codecs in [{'action': numpy_storage.Float16Codec()},
+                   {'aux': numpy_storage.Float16Codec()},
+                   {'aux/vel': numpy_storage.QuantizeUint8Codec()}]:
+      with self.assertRaises(ValueError):
+        py_uniform_replay_buffer.PyUniformReplayBuffer(
+            data_spec=data_spec, capacity=10, storage_codecs=codecs)
+    with self.assertRaises(ValueError):
+      py_uniform_replay_buffer.PyUniformReplayBuffer(
+          data_spec=data_spec, capacity=10,
+          storage_directory=os.path.join(self.get_temp_dir(), 'zlib'),
+          storage_codecs={'obs': numpy_storage.ZlibCodec()})
+
+  def testZlibCodecCheckpoint(self):
+    data_spec = self._codec_data_spec()
+    codecs = {'': numpy_storage.ZlibCodec(block_size=4, cache_size=1)}
+    replay_buffer = py_uniform_replay_buffer.PyUniformReplayBuffer(
+        data_spec=data_spec, capacity=10, storage_codecs=codecs)
+    replay_buffer.add_batch(self._codec_items(0, 12))
+
+    with self.test_session():
+      prefix = os.path.join(self.get_temp_dir(), 'ckpt')
+      replay_buffer.flush()
+      save_path = tf.train.Checkpoint(rb=replay_buffer).save(prefix)
+
+      loaded_rb = py_uniform_replay_buffer.PyUniformReplayBuffer(
+          data_spec=data_spec, capacity=10, storage_codecs=codecs)
+      loader = tf.train.Checkpoint(rb=loaded_rb)
+      loader.restore(save_path).initialize_or_restore()
+      items = loaded_rb.gather_all()
+      self.assertAllEqual([np.arange(2, 12)], items['aux']['count'])
+      self.assertAllClose(self._codec_items(2, 12)['obs'], items['obs'][0])
+
+  def testZlibCodecCheckpointWithoutFlush(self):
+    data_spec = self._codec_data_spec()
+    codecs = {'': numpy_storage.ZlibCodec(block_size=4, cache_size=2)}
+    replay_buffer = py_uniform_replay_buffer.PyUniformReplayBuffer(
+        data_spec=data_spec, capacity=10, storage_codecs=codecs)
+    replay_buffer.add_batch(self._codec_items(0, 7))
+    # The latest rows are only in the decompressed blocks of the cache.
+    replay_buffer.add_batch(self._codec_items(7, 12))
+
+    with self.test_session():
+      prefix = os.path.join(self.get_temp_dir(), 'ckpt')
+      save_path = tf.train.Checkpoint(rb=replay_buffer).save(prefix)
+
+      loaded_rb = py_uniform_replay_buffer.PyUniformReplayBuffer(
+          data_spec=data_spec, capacity=10, storage_codecs=codecs)
+      loader = tf.train.Checkpoint(rb=loaded_rb)
+      loader.restore(save_path).initialize_or_restore()
+      items = loaded_rb.gather_all()
+      self.assertAllEqual([np.arange(2, 12)], items['aux']['count'])
+      self.assertAllClose(self._codec_items(2, 12)['obs'], items['obs'][0])
+
+
 if __name__ == '__main__':
   tf.test.main()
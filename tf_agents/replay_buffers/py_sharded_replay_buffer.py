@@ -0,0 +1,165 @@
+# coding=utf-8
+# Copyright 2018 The TF-Agents Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Sharded replay buffer in Python.
+
+PyShardedReplayBuffer splits its capacity across independent shards, each a
+replay buffer with its own lock, so that concurrent collectors writing to
+different shards do not contend with each other.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import itertools
+import threading
+
+import numpy as np
+import tensorflow as tf
+
+from tf_agents.replay_buffers import py_uniform_replay_buffer
+from tf_agents.replay_buffers import replay_buffer
+from tf_agents.specs import array_spec
+
+nest = tf.contrib.framework.nest
+
+
+class PyShardedReplayBuffer(replay_buffer.ReplayBuffer):
+  """A Python-based replay buffer made of independent shards.
+
+  Each batch added is written to a single shard, chosen by the id of the
+  collector adding it. Sampling is stratified across shards: every shard
+  contributes a share of each sample batch proportional to the number of
+  sub-episodes it holds, so that samples are uniform over the whole buffer.
+  The items of a sample batch are grouped by shard.
+
+  Sub-episodes are sampled within a single shard, so a collector should always
+  use the same collector id.
+
+  Writing and reading to this replay buffer is thread safe, and writers using
+  different shards never wait on each other.
+  """
+
+  def __init__(self,
+               data_spec,
+               capacity,
+               num_shards,
+               shard_fn=py_uniform_replay_buffer.PyUniformReplayBuffer):
+    """Creates a PyShardedReplayBuffer.
+
+    Args:
+      data_spec: An ArraySpec or a list/tuple/nest of ArraySpecs describing a
+        single item that can be stored in this buffer.
+      capacity: The maximum number of items that can be stored in the buffer,
+        split evenly across the shards.
+      num_shards: Number of shards.
+      shard_fn: Function to create shards `shard_fn(data_spec, capacity)`, e.g.
+        `PyUniformReplayBuffer` or `PyHashedReplayBuffer`.
+
+    Raises:
+      ValueError: If num_shards does not evenly divide capacity.
+    """
+    if capacity % num_shards:
+      raise ValueError('num_shards must evenly divide capacity, got {} and '
+                       '{}.'.format(num_shards, capacity))
+    super(PyShardedReplayBuffer, self).__init__(data_spec, capacity)
+    self._num_shards = num_shards
+    self._shards = [shard_fn(data_spec, capacity // num_shards)
+                    for _ in range(num_shards)]
+    # Collector ids handed out to threads adding without one.
+    self._collector_ids = itertools.count()
+    self._thread_local = threading.local()
+
+  @property
+  def num_shards(self):
+    return self._num_shards
+
+  @property
+  def size(self):
+    return sum(shard.size for shard in self._shards)
+
+  def add_batch(self, items, collector_id=None):
+    """Adds a batch of items to the shard of a collector.
+
+    Args:
+      items: An item or list/tuple/nest of items to be added to the replay
+        buffer. `items` must match the data_spec of this class, with a
+        batch_size dimension added to the beginning of each array.
+      collector_id: (Optional.) Integer id of the collector adding the items,
+        which are written to shard `collector_id % num_shards`. If None, each
+        calling thread is assigned its own collector id.
+    """
+    return self._add_batch(items, collector_id)
+
+  def _add_batch(self, items, collector_id=None):
+    if collector_id is None:
+      collector_id = getattr(self._thread_local, 'collector_id', None)
+      if collector_id is None:
+        collector_id = next(self._collector_ids)
+        self._thread_local.collector_id = collector_id
+    self._shards[collector_id % self._num_shards].add_batch(items)
+
+  def _get_next(self,
+                sample_batch_size=None,
+                num_steps=None,
+                time_stacked=True):
+    num_steps_value = num_steps if num_steps is not None else 1
+    sample_batch_size_value = (
+        sample_batch_size if sample_batch_size is not None else 1)
+
+    # Number of sub-episodes each shard can provide.
+    num_windows = np.array(
+        [max(shard.size - num_steps_value + 1, 0) for shard in self._shards],
+        dtype=np.float64)
+    total = num_windows.sum()
+    if total <= 0:
+      raise ValueError('Read error: no shard holds num_steps={} '
+                       'items'.format(num_steps_value))
+
+    # Stratified sampling: one point per equal-mass segment of the windows.
+    points = ((np.arange(sample_batch_size_value) +
+               np.random.uniform(size=sample_batch_size_value)) *
+              (total / sample_batch_size_value))
+    shard_ids = np.searchsorted(np.cumsum(num_windows), points, side='right')
+    # Guard against rounding errors selecting a trailing empty shard.
+    shard_ids = np.minimum(shard_ids, np.flatnonzero(num_windows)[-1])
+
+    if sample_batch_size is None:
+      return self._shards[shard_ids[0]].get_next(
+          num_steps=num_steps, time_stacked=time_stacked)
+    counts = np.bincount(shard_ids, minlength=self._num_shards)
+    samples = [shard.get_next(count, num_steps, time_stacked)
+               for shard, count in zip(self._shards, counts) if count]
+    return nest.map_structure(lambda *arrays: np.concatenate(arrays),
+                              *samples)
+
+  def _as_dataset(self, sample_batch_size=None, num_steps=None,
+                  num_parallel_calls=None):
+    outer_dims = () if sample_batch_size is None else (sample_batch_size,)
+    if num_steps is not None:
+      outer_dims += (num_steps,)
+    data_spec = array_spec.add_outer_dims_nest(self._data_spec, outer_dims)
+    return py_uniform_replay_buffer.sample_dataset(
+        data_spec, lambda: self._get_next(sample_batch_size, num_steps),
+        num_parallel_calls)
+
+  def _gather_all(self):
+    return nest.map_structure(
+        lambda *arrays: np.concatenate(arrays, axis=1),
+        *[shard.gather_all() for shard in self._shards])
+
+  def _clear(self):
+    for shard in self._shards:
+      shard.clear()
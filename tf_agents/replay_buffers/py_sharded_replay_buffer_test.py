@@ -0,0 +1,125 @@
+# coding=utf-8
+# Copyright 2018 The TF-Agents Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unit tests for PyShardedReplayBuffer."""
+
+from __future__ import division
+from __future__ import unicode_literals
+
+import threading
+
+import numpy as np
+import tensorflow as tf
+
+from tf_agents.replay_buffers import py_sharded_replay_buffer
+from tf_agents.specs import array_spec
+
+
+class PyShardedReplayBufferTest(tf.test.TestCase):
+
+  def _create_replay_buffer(self, capacity=40, num_shards=4):
+    return py_sharded_replay_buffer.PyShardedReplayBuffer(
+        data_spec=array_spec.ArraySpec((), np.int32),
+        capacity=capacity,
+        num_shards=num_shards)
+
+  def testCapacityMustBeDivisible(self):
+    with self.assertRaises(ValueError):
+      self._create_replay_buffer(capacity=10, num_shards=4)
+
+  def testAddBatchRoutedByCollectorId(self):
+    replay_buffer = self._create_replay_buffer()
+    replay_buffer.add_batch(np.arange(3, dtype=np.int32), collector_id=1)
+    replay_buffer.add_batch(np.arange(2, dtype=np.int32), collector_id=5)
+    replay_buffer.add_batch(np.arange(4, dtype=np.int32), collector_id=2)
+    self.assertEqual(9, replay_buffer.size)
+    self.assertEqual([0, 5, 4, 0],
+                     [shard.size for shard in replay_buffer._shards])
+
+  def testAddBatchFromThreads(self):
+    replay_buffer = self._create_replay_buffer()
+
+    def collect(value):
+      for _ in range(5):
+        replay_buffer.add_batch(np.full(2, value, dtype=np.int32))
+
+    threads = [threading.Thread(target=collect, args=(i,)) for i in range(4)]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+    # Each thread wrote all its items to a shard of its own.
+    self.assertEqual(40, replay_buffer.size)
+    for shard in replay_buffer._shards:
+      self.assertEqual(10, shard.size)
+      self.assertEqual(1, len(np.unique(shard.gather_all())))
+
+  def testSampleStratifiedByFillLevel(self):
+    np.random.seed(12345)
+    replay_buffer = self._create_replay_buffer()
+    replay_buffer.add_batch(np.zeros(10, dtype=np.int32), collector_id=0)
+    replay_buffer.add_batch(np.ones(5, dtype=np.int32), collector_id=1)
+    replay_buffer.add_batch(np.full(5, 2, dtype=np.int32), collector_id=2)
+
+    items = replay_buffer.get_next(sample_batch_size=8)
+    self.assertEqual((8,), items.shape)
+    self.assertAllEqual([0, 0, 0, 0, 1, 1, 2, 2], items)
+
+  def testSampleWithNumStepsStaysInShard(self):
+    replay_buffer = self._create_replay_buffer()
+    replay_buffer.add_batch(np.arange(10, dtype=np.int32), collector_id=0)
+    replay_buffer.add_batch(np.arange(100, 102, dtype=np.int32),
+                            collector_id=1)
+    # Shard 2 cannot provide sub-episodes of 3 items.
+    replay_buffer.add_batch(np.arange(200, 202, dtype=np.int32),
+                            collector_id=2)
+
+    items = replay_buffer.get_next(sample_batch_size=50, num_steps=3)
+    self.assertEqual((50, 3), items.shape)
+    self.assertAllLess(items, 10)
+    self.assertAllEqual(items[:, :-1] + 1, items[:, 1:])
+
+    with self.assertRaises(ValueError):
+      replay_buffer.get_next(num_steps=11)
+
+  def testGatherAllAndClear(self):
+    replay_buffer = self._create_replay_buffer(capacity=4, num_shards=2)
+    replay_buffer.add_batch(np.arange(2, dtype=np.int32), collector_id=0)
+    replay_buffer.add_batch(np.arange(2, 4, dtype=np.int32), collector_id=1)
+    self.assertAllEqual([[0, 1, 2, 3]], replay_buffer.gather_all())
+
+    replay_buffer.clear()
+    self.assertEqual(0, replay_buffer.size)
+    with self.assertRaises(ValueError):
+      replay_buffer.get_next()
+
+  def testAsDataset(self):
+    replay_buffer = self._create_replay_buffer()
+    for collector_id in range(4):
+      replay_buffer.add_batch(
+          np.arange(10, dtype=np.int32) + 100 * collector_id,
+          collector_id=collector_id)
+
+    ds = replay_buffer.as_dataset(sample_batch_size=8, num_steps=2,
+                                  num_parallel_calls=2)
+    items = ds.make_one_shot_iterator().get_next()
+    self.assertEqual([8, 2], items.shape.as_list())
+    with self.test_session() as sess:
+      items_ = sess.run(items)
+      self.assertAllEqual(items_[:, 0] + 1, items_[:, 1])
+
+
+if __name__ == '__main__':
+  tf.test.main()
@@ -32,6 +32,7 @@ import threading
 import numpy as np
 import tensorflow as tf
 
+from tf_agents.environments import trajectory
 from tf_agents.replay_buffers import numpy_storage
 from tf_agents.replay_buffers import replay_buffer
 from tf_agents.specs import array_spec
@@ -40,6 +41,48 @@ from tf_agents.utils import nest_utils
 nest = tf.contrib.framework.nest
 
 
+def sample_dataset(spec, sample_fn, num_parallel_calls=None):
+  """Creates a dataset of samples drawn by a Python function.
+
+  Each call to `sample_fn` produces a whole, already time stacked element, so
+  the dataset does no per-step work in the graph. With `num_parallel_calls`,
+  that many generators sample concurrently and their elements are
+  interleaved in whatever order they are ready. The result is prefetched
+  with an automatically tuned buffer size.
+
+  Args:
+    spec: A nest of ArraySpecs describing the elements of the dataset.
+    sample_fn: A function with no arguments returning a nest of arrays
+      matching `spec`.
+    num_parallel_calls: (Optional.) Number of generators sampling in
+      parallel. If None, a single generator is used.
+
+  Returns:
+    A tf.data.Dataset whose elements match `spec`.
+  """
+  flat_spec = nest.flatten(spec)
+  shapes = tuple(s.shape for s in flat_spec)
+  dtypes = tuple(s.dtype for s in flat_spec)
+
+  def generator_fn():
+    while True:
+      yield tuple(nest.flatten(sample_fn()))
+
+  def make_dataset(_=None):
+    return tf.data.Dataset.from_generator(generator_fn, dtypes, shapes)
+
+  if num_parallel_calls is None:
+    ds = make_dataset()
+  else:
+    # Samples are drawn independently, so the order in which the generators
+    # produce them does not matter.
+    ds = tf.data.Dataset.range(num_parallel_calls).apply(
+        tf.data.experimental.parallel_interleave(
+            make_dataset, cycle_length=num_parallel_calls, sloppy=True))
+  ds = ds.map(lambda *items: nest.pack_sequence_as(spec, items))
+  return ds.prefetch(tf.data.experimental.AUTOTUNE)
+
+
 class PyUniformReplayBuffer(replay_buffer.ReplayBuffer):
   """A Python-based replay buffer that supports uniform sampling.
 
@@ -47,21 +90,55 @@ class PyUniformReplayBuffer(replay_buffer.ReplayBuffer):
 
   This replay buffer can be subclassed to change the encoding used for the
   underlying storage by overriding _encoded_data_spec, _encode, _decode, and
-  _on_delete.
+  _on_delete. Subclasses can track newly written items via _on_insert.
   """
 
-  def __init__(self, data_spec, capacity):
+  # Rounds of redrawing sub-episodes spanning several episodes before falling
+  # back to listing all the valid sub-episodes.
+  _MAX_EPISODE_REDRAWS = 10
+
+  def __init__(self, data_spec, capacity, storage_directory=None,
+               sample_within_episodes=False, storage_codecs=None,
+               sample_without_replacement=False):
     """Creates a PyUniformReplayBuffer.
 
     Args:
       data_spec: An ArraySpec or a list/tuple/nest of ArraySpecs describing a
         single item that can be stored in this buffer.
       capacity: The maximum number of items that can be stored in the buffer.
+      storage_directory: Optional directory in which the items are stored as
+        memory-mapped files, allowing buffers larger than the available
+        memory. The items are then not checkpointed: restoring a checkpoint
+        only restores which part of the files holds valid items. See
+        `NumpyStorage`.
+      sample_within_episodes: If True, sub-episodes of `num_steps` items are
+        only sampled within a single episode, i.e. only their last item can be
+        an episode boundary. Requires `data_spec` to be a Trajectory, added in
+        the order the steps were collected. Episodes collected without
+        boundary trajectories, e.g. from an environment with `auto_reset`,
+        end at their last step.
+      storage_codecs: Optional dict mapping paths of the encoded data spec,
+        e.g. 'observation', to the codec used to store the leaves below them,
+        such as `numpy_storage.QuantizeUint8Codec()`. See `NumpyStorage`.
+      sample_without_replacement: If True, `get_next` and `as_dataset` sample
+        in epochs: each epoch is a random permutation of the sub-episodes
+        valid when it starts, and every one of them is sampled exactly once
+        before the next epoch starts. Sample batches can span two epochs.
+        Items overwritten during an epoch are replaced by the newer items.
+
+    Raises:
+      ValueError: If sample_within_episodes is set but data_spec is not a
+        Trajectory, or if storage_codecs are invalid.
     """
+    if sample_within_episodes and not isinstance(data_spec,
+                                                 trajectory.Trajectory):
+      raise ValueError('sample_within_episodes requires data_spec to be the '
+                       'spec of a trajectory: {}'.format(data_spec))
     super(PyUniformReplayBuffer, self).__init__(data_spec, capacity)
 
-    self._storage = numpy_storage.NumpyStorage(self._encoded_data_spec(),
-                                               capacity)
+    self._storage = numpy_storage.NumpyStorage(
+        self._encoded_data_spec(), capacity, directory=storage_directory,
+        codecs=storage_codecs)
     self._lock = threading.Lock()
     self._np_state = tf.contrib.checkpoint.NumpyState()
 
@@ -74,124 +151,298 @@ class PyUniformReplayBuffer(replay_buffer.ReplayBuffer):
     # Total number of items that went through the replay buffer.
     self._np_state.item_count = np.int64(0)
 
+    self._sample_within_episodes = sample_within_episodes
+    if sample_within_episodes:
+      # Episode id of the item in each row: the number of episodes started
+      # before it. An episode starts after a boundary, or after its last step
+      # when no boundary follows. A sub-episode lies within one episode iff
+      # its first and last items have the same episode id.
+      self._np_state.episode_ids = np.zeros(capacity, dtype=np.int64)
+      self._np_state.num_episodes = np.int64(0)
+      # Whether the last item added was a boundary, or the last step of an
+      # episode.
+      self._np_state.last_is_boundary = np.bool_(False)
+      self._np_state.last_is_last = np.bool_(False)
+
+    self._sample_without_replacement = sample_without_replacement
+    self._reset_epoch()
+
   def _encoded_data_spec(self):
     """Spec of data items after encoding using _encode."""
     return self._data_spec
 
-  def _encode(self, item):
-    """Encodes an item (before adding it to the buffer)."""
-    return item
+  def _encode(self, items):
+    """Encodes a batch of items (before adding them to the buffer)."""
+    return items
 
   def _decode(self, item):
-    """Decodes an item."""
+    """Decodes an item, or a batch of items with any number of outer dims."""
     return item
 
-  def _on_delete(self, encoded_item):
-    """Do any necessary cleanup."""
+  def _on_delete(self, encoded_items):
+    """Do any necessary cleanup for a batch of items about to be deleted."""
+    pass
+
+  def _on_insert(self, rows, item_ids):
+    """Do any necessary bookkeeping for a batch of items just written.
+
+    Args:
+      rows: Rows of the underlying storage the items were written to.
+      item_ids: Ids of the items, i.e. their insertion count in the buffer.
+    """
     pass
 
   @property
   def size(self):
     return self._np_state.size
 
+  def flush(self):
+    """Writes the items to disk when using a `storage_directory`.
+
+    Also compresses pending blocks of leaves stored with a `ZlibCodec`, which
+    saving a checkpoint does as well.
+    """
+    with self._lock:
+      self._storage.flush()
+
   def _add_batch(self, items):
     outer_shape = nest_utils.get_outer_array_shape(items, self._data_spec)
-    if outer_shape[0] != 1:
-      raise NotImplementedError('PyUniformReplayBuffer only supports a batch '
-                                'size of 1, but received `items` with batch '
-                                'size {}.'.format(outer_shape[0]))
+    if len(outer_shape) != 1:
+      raise ValueError('PyUniformReplayBuffer expects `items` with a single '
+                       'outer batch dimension, but received `items` with outer '
+                       'shape {}.'.format(outer_shape))
+    batch_size = outer_shape[0]
+    if batch_size > self._capacity:
+      # Only the most recent `capacity` items would survive the write.
+      items = nest.map_structure(lambda x: x[-self._capacity:], items)
 
-    item = nest_utils.unbatch_nested_array(items)
     with self._lock:
-      if self._np_state.size == self._capacity:
-        # If we are at capacity, we are deleting element cur_id.
-        self._on_delete(self._storage.get(self._np_state.cur_id))
-      self._storage.set(self._np_state.cur_id, self._encode(item))
-      self._np_state.size = np.minimum(self._np_state.size + 1,
+      num_items = min(batch_size, self._capacity)
+      # Offsets from the head of the items that are actually written, and the
+      # rows they land in when wrapping around the circular buffer.
+      offsets = np.arange(batch_size - num_items, batch_size)
+      rows = (self._np_state.cur_id + offsets) % self._capacity
+      # The `size` stored items occupy the rows preceding the head, i.e. the
+      # offsets in [capacity - size, capacity) modulo the capacity.
+      deleted = offsets % self._capacity >= self._capacity - self._np_state.size
+      if np.any(deleted):
+        self._on_delete(self._storage.get(rows[deleted]))
+      self._storage.set(rows, self._encode(items))
+      self._on_insert(rows, self._np_state.item_count + offsets)
+      if self._sample_within_episodes and num_items:
+        boundaries = np.asarray(items.is_boundary(), dtype=np.bool_)
+        lasts = np.asarray(items.is_last(), dtype=np.bool_)
+        previous_boundaries = np.concatenate(
+            [[self._np_state.last_is_boundary], boundaries[:-1]])
+        previous_lasts = np.concatenate(
+            [[self._np_state.last_is_last], lasts[:-1]])
+        starts = previous_boundaries | (previous_lasts & ~boundaries)
+        episode_ids = self._np_state.num_episodes + np.cumsum(starts)
+        self._np_state.episode_ids[rows] = episode_ids
+        self._np_state.num_episodes = episode_ids[-1]
+        self._np_state.last_is_boundary = boundaries[-1]
+        self._np_state.last_is_last = lasts[-1]
+      self._np_state.size = np.minimum(self._np_state.size + num_items,
                                        self._capacity)
-      self._np_state.cur_id = (self._np_state.cur_id + 1) % self._capacity
-      self._np_state.item_count += 1
+      self._np_state.cur_id = (
+          (self._np_state.cur_id + batch_size) % self._capacity)
+      self._np_state.item_count += batch_size
 
   def _get_next(self,
                 sample_batch_size=None,
                 num_steps=None,
                 time_stacked=True):
     num_steps_value = num_steps if num_steps is not None else 1
-    def get_single():
-      """Gets a single item from the replay buffer."""
-      with self._lock:
-        if self._np_state.size <= 0:
-          raise ValueError('Read error: empty replay buffer')
-
-        idx = np.random.randint(self._np_state.size - num_steps_value + 1)
+    sample_batch_size_value = (
+        sample_batch_size if sample_batch_size is not None else 1)
+    with self._lock:
+      if self._np_state.size <= 0:
+        raise ValueError('Read error: empty replay buffer')
+
+      if self._sample_without_replacement:
+        ids = self._next_epoch_ids(sample_batch_size_value, num_steps_value)
+      else:
+        # Draw the start of every sub-episode in the batch at once.
+        ids = np.random.randint(self._np_state.size - num_steps_value + 1,
+                                size=sample_batch_size_value)
         if self._np_state.size == self._capacity:
           # If the buffer is full, add cur_id (head of circular buffer) so that
           # we sample from the range [cur_id, cur_id + size - num_steps_value].
           # We will modulo the size below.
-          idx += self._np_state.cur_id
+          ids += self._np_state.cur_id
+        if self._sample_within_episodes and num_steps_value > 1:
+          ids = self._redraw_across_episodes(ids, num_steps_value)
+
+      # Rows have shape [sample_batch_size_value, num_steps_value], so each
+      # underlying array is gathered with a single fancy-index read.
+      rows = (np.expand_dims(ids, 1) +
+              np.arange(num_steps_value)) % self._capacity
+      items = self._decode(self._storage.get(rows))
+
+    return self._format_sample(items, sample_batch_size, num_steps,
+                               time_stacked)
+
+  def _reset_epoch(self):
+    # Permutation of the ids of the sub-episodes of the current epoch, and
+    # number of them already sampled.
+    self._epoch_ids = np.zeros(0, dtype=np.int64)
+    self._epoch_position = 0
+    self._epoch_num_steps = None
 
-        if num_steps is not None:
-          # TODO(b/120242830): Try getting data from numpy in one shot rather
-          # than num_steps_value.
-          item = [self._decode(self._storage.get((idx + n) % self._capacity))
-                  for n in range(num_steps)]
-        else:
-          item = self._decode(self._storage.get(idx % self._capacity))
+  def _next_epoch_ids(self, num_ids, num_steps):
+    """Takes the next ids of the current epoch, starting epochs as needed.
 
-      if num_steps is not None and time_stacked:
-        item = nest_utils.stack_nested_arrays(item)
-      return item
+    An epoch is also started when `num_steps` differs from the one of the
+    current epoch. Must be called with the lock held.
 
+    Args:
+      num_ids: Number of ids to take.
+      num_steps: Number of items in each sub-episode.
+
+    Returns:
+      Array of `num_ids` ids of the first items of sub-episodes.
+
+    Raises:
+      ValueError: If no sub-episode of num_steps items is valid.
+    """
+    ids = []
+    while num_ids:
+      if (num_steps != self._epoch_num_steps or
+          self._epoch_position == len(self._epoch_ids)):
+        self._epoch_ids = np.random.permutation(self._valid_ids(num_steps))
+        self._epoch_position = 0
+        self._epoch_num_steps = num_steps
+      taken = self._epoch_ids[self._epoch_position:
+                              self._epoch_position + num_ids]
+      self._epoch_position += len(taken)
+      num_ids -= len(taken)
+      ids.append(taken)
+    return np.concatenate(ids)
+
+  def _valid_ids(self, num_steps):
+    """Returns the ids of the first items of all the valid sub-episodes.
+
+    Must be called with the lock held.
+
+    Args:
+      num_steps: Number of items in each sub-episode.
+
+    Returns:
+      Array of ids, increasing from the oldest item, which are only taken
+      modulo the capacity when reading.
+
+    Raises:
+      ValueError: If no sub-episode of num_steps items is valid.
+    """
+    first_id = (self._np_state.cur_id
+                if self._np_state.size == self._capacity else 0)
+    num_windows = max(self._np_state.size - num_steps + 1, 0)
+    ids = np.arange(first_id, first_id + num_windows)
+    if self._sample_within_episodes and num_steps > 1:
+      episode_ids = self._np_state.episode_ids
+      ids = ids[episode_ids[ids % self._capacity] ==
+                episode_ids[(ids + num_steps - 1) % self._capacity]]
+    if not ids.size:
+      raise ValueError('Read error: no valid sub-episode of {} items'.format(
+          num_steps))
+    return ids
+
+  def _redraw_across_episodes(self, ids, num_steps):
+    """Redraws the sub-episodes starting at `ids` that span several episodes.
+
+    Invalid sub-episodes are redrawn uniformly, which takes O(1) draws per
+    sample on average unless most sub-episodes span several episodes. After
+    `_MAX_EPISODE_REDRAWS` rounds, the remaining ones are drawn among all the
+    valid sub-episodes. Must be called with the lock held.
+
+    Args:
+      ids: Array of ids of the first items of uniformly drawn sub-episodes.
+      num_steps: Number of items in each sub-episode.
+
+    Returns:
+      Array of ids of sub-episodes uniformly drawn among the ones lying within
+      a single episode.
+
+    Raises:
+      ValueError: If no sub-episode lies within a single episode.
+    """
+    episode_ids = self._np_state.episode_ids
+    num_windows = self._np_state.size - num_steps + 1
+    first_id = (self._np_state.cur_id
+                if self._np_state.size == self._capacity else 0)
+
+    def spans_episodes(ids):
+      return (episode_ids[ids % self._capacity] !=
+              episode_ids[(ids + num_steps - 1) % self._capacity])
+
+    redraw = spans_episodes(ids)
+    for _ in range(self._MAX_EPISODE_REDRAWS):
+      if not np.any(redraw):
+        return ids
+      new_ids = np.random.randint(num_windows, size=np.sum(redraw)) + first_id
+      ids[redraw] = new_ids
+      redraw[redraw] = spans_episodes(new_ids)
+
+    if np.any(redraw):
+      ids[redraw] = np.random.choice(self._valid_ids(num_steps),
+                                     size=np.sum(redraw))
+    return ids
+
+  def _format_sample(self, items, sample_batch_size, num_steps,
+                     time_stacked):
+    """Reshapes a [B, T, ...] sample to match the `get_next` arguments.
+
+    Args:
+      items: A nest of arrays with shape [B, T, ...], where B is the sample
+        batch size (1 if `sample_batch_size` is None) and T is the number of
+        steps (1 if `num_steps` is None).
+      sample_batch_size: See `get_next()` documentation.
+      num_steps: See `get_next()` documentation.
+      time_stacked: See `get_next()` documentation.
+
+    Returns:
+      The items with the outer dimensions requested by the caller.
+    """
     if sample_batch_size is None:
-      return get_single()
+      items = nest_utils.unbatch_nested_array(items)
+      time_axis = 0
     else:
-      samples = [get_single() for _ in range(sample_batch_size)]
-      return nest_utils.stack_nested_arrays(samples)
+      time_axis = 1
 
-  def _as_dataset(self, sample_batch_size=None, num_steps=None,
-                  num_parallel_calls=None):
-    if num_parallel_calls is not None:
-      raise NotImplementedError('PyUniformReplayBuffer does not support '
-                                'num_parallel_calls (must be None).')
-
-    data_spec = self._data_spec
-    if sample_batch_size is not None:
-      data_spec = array_spec.add_outer_dims_nest(
-          data_spec, (sample_batch_size,))
-    if num_steps is not None:
-      data_spec = (data_spec,) * num_steps
-    shapes = tuple(s.shape for s in nest.flatten(data_spec))
-    dtypes = tuple(s.dtype for s in nest.flatten(data_spec))
-
-    def generator_fn():
-      while True:
-        if sample_batch_size is not None:
-          batch = [self._get_next(num_steps=num_steps, time_stacked=False)
-                   for _ in range(sample_batch_size)]
-          item = nest_utils.stack_nested_arrays(batch)
-        else:
-          item = self._get_next(num_steps=num_steps, time_stacked=False)
-        yield tuple(nest.flatten(item))
-
-    def time_stack(*structures):
-      time_axis = 0 if sample_batch_size is None else 1
+    if num_steps is None:
       return nest.map_structure(
-          lambda *elements: tf.stack(elements, axis=time_axis), *structures)
+          lambda x: np.take(x, 0, axis=time_axis), items)
+    if time_stacked:
+      return items
+    return tuple(
+        nest.map_structure(lambda x: np.take(x, n, axis=time_axis), items)  # pylint: disable=cell-var-from-loop
+        for n in range(num_steps))
 
-    ds = tf.data.Dataset.from_generator(generator_fn, dtypes, shapes).map(
-        lambda *items: nest.pack_sequence_as(data_spec, items))
+  def _as_dataset(self, sample_batch_size=None, num_steps=None,
+                  num_parallel_calls=None):
+    outer_dims = () if sample_batch_size is None else (sample_batch_size,)
     if num_steps is not None:
-      return ds.map(time_stack)
-    else:
-      return ds
+      outer_dims += (num_steps,)
+    data_spec = array_spec.add_outer_dims_nest(self._data_spec, outer_dims)
+    return sample_dataset(
+        data_spec, lambda: self._get_next(sample_batch_size, num_steps),
+        num_parallel_calls)
 
   def _gather_all(self):
-    data = [self._decode(self._storage.get(idx))
-            for idx in range(self._capacity)]
-    stacked = nest_utils.stack_nested_arrays(data)
-    batched = nest.map_structure(lambda t: np.expand_dims(t, 0), stacked)
-    return batched
+    """Returns the items in the buffer in insertion order, shape [1, size, ...].
+
+    Returns:
+      All the items currently in the buffer, gathered from each storage array
+      and decoded at once.
+    """
+    with self._lock:
+      # The `size` stored items occupy the rows preceding the head.
+      rows = ((self._np_state.cur_id - self._np_state.size +
+               np.arange(self._np_state.size)) % self._capacity)
+      items = self._decode(self._storage.get(rows))
+    return nest.map_structure(lambda t: np.expand_dims(t, 0), items)
 
   def _clear(self):
     self._np_state.size = np.int64(0)
     self._np_state.cur_id = np.int64(0)
+    self._reset_epoch()
@@ -18,13 +18,20 @@
 The row is the index or location at which the value is saved, and the value is
 a nest of Tensors.
 
-This class is not threadsafe.
+PackedTable is a variant of Table which packs all the slots sharing a dtype
+into the columns of a single variable, so that reading or writing a nest of
+Tensors takes one op per dtype instead of one op per slot.
+
+These classes are not threadsafe.
 """
 
 from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import collections
+
+import numpy as np
 import tensorflow as tf
 
 nest = tf.contrib.framework.nest
@@ -132,3 +139,159 @@ class Table(tf.contrib.checkpoint.Checkpointable):
         for (slot, value) in zip(flattened_slots, flattened_values)
     ]
     return tf.group(*write_ops)
+
+
+class PackedTable(tf.contrib.checkpoint.Checkpointable):
+  """A table storing nested Tensors in one variable per dtype.
+
+  Each slot is flattened into a range of columns of the variable holding its
+  dtype. `read` gathers the requested rows of each dtype group at once and
+  slices the slots out of the columns, and `write` concatenates the values of
+  each group and scatters them at once. This has the same interface as `Table`
+  and can be passed as `table_fn` to `TFUniformReplayBuffer`.
+  """
+
+  def __init__(self, tensor_spec, capacity, scope='PackedTable'):
+    """Creates a packed table.
+
+    Args:
+      tensor_spec: A nest of TensorSpec representing each value that can be
+        stored in the table.
+      capacity: Maximum number of values the table can store.
+      scope: Variable scope for the PackedTable.
+    """
+    self._tensor_spec = tensor_spec
+    self._capacity = capacity
+    # For tracking the group variables as checkpointable dependencies.
+    self._tracker = tf.contrib.checkpoint.UniqueNameTracker()
+
+    def _create_unique_slot_name(spec):
+      return tf.get_default_graph().unique_name(spec.name or 'slot')
+    self._slots = nest.map_structure(_create_unique_slot_name,
+                                     self._tensor_spec)
+
+    # Assign the columns [offset, offset + num_elements) of its dtype group to
+    # each slot, in the order of the flattened spec.
+    self._slot2columns_map = {}
+    num_columns = collections.OrderedDict()
+    for spec, slot in zip(nest.flatten(self._tensor_spec),
+                          nest.flatten(self._slots)):
+      offset = num_columns.get(spec.dtype, 0)
+      size = spec.shape.num_elements()
+      self._slot2columns_map[slot] = (spec, offset, size)
+      num_columns[spec.dtype] = offset + size
+
+    group_names = [tf.get_default_graph().unique_name(dtype.name)
+                   for dtype in num_columns]
+
+    self._storage = collections.OrderedDict()
+    with tf.variable_scope(scope):
+      for (dtype, columns), group_name in zip(num_columns.items(),
+                                              group_names):
+        self._storage[dtype] = tf.get_variable(
+            name=group_name,
+            shape=[self._capacity, columns],
+            dtype=dtype,
+            initializer=tf.zeros_initializer,
+            trainable=False,
+            use_resource=True,
+        )
+        self._tracker.track(self._storage[dtype], group_name)
+
+  @property
+  def slots(self):
+    return self._slots
+
+  def variables(self):
+    return list(self._storage.values())
+
+  def _group_slots(self, flattened_slots):
+    """Returns an ordered mapping from dtype to the indices of its slots."""
+    groups = collections.OrderedDict()
+    for i, slot in enumerate(flattened_slots):
+      spec = self._slot2columns_map[slot][0]
+      groups.setdefault(spec.dtype, []).append(i)
+    return groups
+
+  def read(self, rows, slots=None):
+    """Returns values for the given rows.
+
+    Args:
+      rows: A scalar/list/tensor of location(s) to read values from. If rows is
+        a scalar, a single value is returned without a batch dimension. If rows
+        is a list of integers or a rank-1 int Tensor a batch of values will be
+        returned with each Tensor having an extra first dimension equal to the
+        length of rows.
+      slots: Optional list/tuple/nest of slots to read from. If None, all
+        tensors at the given rows are retrieved and the return value has the
+        same structure as the tensor_spec. Otherwise, only tensors with names
+        matching the slots are retrieved, and the return value has the same
+        structure as slots.
+
+    Returns:
+      Values at given rows.
+    """
+    slots = slots or self._slots
+    flattened_slots = nest.flatten(slots)
+    rows = tf.convert_to_tensor(rows)
+    values = [None] * len(flattened_slots)
+    for dtype, indices in self._group_slots(flattened_slots).items():
+      columns = self._storage[dtype].sparse_read(rows)
+      for i in indices:
+        spec, offset, size = self._slot2columns_map[flattened_slots[i]]
+        value = tf.reshape(
+            columns[..., offset:offset + size],
+            tf.concat([tf.shape(rows),
+                       tf.constant(spec.shape.as_list(), dtype=tf.int32)], 0))
+        value.set_shape(rows.shape.concatenate(spec.shape))
+        values[i] = value
+    return nest.pack_sequence_as(slots, values)
+
+  def write(self, rows, values, slots=None):
+    """Returns ops for writing values at the given rows.
+
+    Writing a subset of the slots of a dtype group updates only their columns,
+    with a single `scatter_nd_update`.
+
+    Args:
+      rows: A scalar/list/tensor of location(s) to write values at.
+      values: A nest of Tensors to write. If rows has more than one element,
+        values can have an extra first dimension representing the batch size.
+        Values must have the same structure as the tensor_spec of this class
+        if `slots` is None, otherwise it must have the same structure as
+        `slots`.
+      slots: Optional list/tuple/nest of slots to write. If None, all tensors
+        in the table are updated. Otherwise, only tensors with names matching
+        the slots are updated.
+
+    Returns:
+      Ops for writing values at rows.
+    """
+    slots = slots or self._slots
+    flattened_slots = nest.flatten(slots)
+    flattened_values = nest.flatten(values)
+    rows = tf.reshape(rows, [-1])
+    num_rows = tf.size(rows)
+    write_ops = []
+    for dtype, indices in self._group_slots(flattened_slots).items():
+      storage = self._storage[dtype]
+      columns = []
+      column_values = []
+      for i in indices:
+        _, offset, size = self._slot2columns_map[flattened_slots[i]]
+        columns.append(np.arange(offset, offset + size))
+        # Values without a batch dimension are written to every row.
+        value = tf.reshape(
+            tf.convert_to_tensor(flattened_values[i], dtype=dtype), [-1, size])
+        column_values.append(tf.broadcast_to(value, [num_rows, size]))
+      columns = np.concatenate(columns)
+      column_values = tf.concat(column_values, axis=-1)
+      if np.array_equal(columns, np.arange(storage.shape[1].value)):
+        write_ops.append(tf.scatter_update(storage, rows, column_values))
+      else:
+        row_indices, column_indices = tf.meshgrid(
+            rows, tf.constant(columns, dtype=rows.dtype), indexing='ij')
+        write_ops.append(tf.scatter_nd_update(
+            storage, tf.stack([row_indices, column_indices], axis=-1),
+            column_values))
+    return tf.group(*write_ops)
@@ -282,5 +282,87 @@ class TableTest(tf.test.TestCase):
     self.assertAllClose(read_value_[1][1], expected_values[1][1])
 
 
+
+class PackedTableTest(tf.test.TestCase):
+
+  def _spec(self):
+    return [
+        specs.TensorSpec([3], tf.float32, 'action'), [
+            specs.TensorSpec([], tf.int64, 'step'),
+            specs.TensorSpec([3, 2], tf.float32, 'lidar')
+        ]
+    ]
+
+  @test_util.run_in_graph_and_eager_modes()
+  def testReadWriteBatch(self):
+    spec = self._spec()
+    replay_table = table.PackedTable(spec, capacity=4)
+    variables = replay_table.variables()
+    self.assertEqual(2, len(variables))
+    self.assertAllEqual(['PackedTable/float32:0', 'PackedTable/int64:0'],
+                        [v.name for v in variables])
+    self.assertEqual([4, 9], variables[0].shape.as_list())
+    self.assertEqual([4, 1], variables[1].shape.as_list())
+
+    batch_size = 2
+    expected_values = [
+        1 * np.ones([batch_size] + spec[0].shape.as_list()),
+        [np.array([2, 3]),
+         np.arange(batch_size * 6).reshape([batch_size, 3, 2])]
+    ]
+    tensors = nest.map_structure(
+        lambda x, s: tf.convert_to_tensor(x, dtype=s.dtype),
+        expected_values, spec)
+
+    write_op = replay_table.write(list(range(batch_size)), tensors)
+    read_op = replay_table.read(list(range(batch_size)))
+    self.assertEqual([batch_size, 3, 2], read_op[1][1].shape.as_list())
+    self.evaluate(tf.global_variables_initializer())
+    self.evaluate(write_op)
+    read_value_ = self.evaluate(read_op)
+    nest.map_structure(self.assertAllClose, read_value_, expected_values)
+
+    read_value_ = self.evaluate(replay_table.read(1))
+    nest.map_structure(self.assertAllClose, read_value_,
+                       nest.map_structure(lambda x: x[1], expected_values))
+
+  @test_util.run_in_graph_and_eager_modes()
+  def testWritePartialSlots(self):
+    spec = self._spec()
+    replay_table = table.PackedTable(spec, capacity=4)
+
+    batch_size = 2
+    action1 = 1 * np.ones([batch_size] + spec[0].shape.as_list())
+    step1 = np.array([2, 3])
+    lidar1 = 3 * np.ones([batch_size] + spec[1][1].shape.as_list())
+    write_op1 = replay_table.write(
+        list(range(batch_size)), [action1, [step1, lidar1]])
+
+    lidar2 = 10 * np.ones([batch_size] + spec[1][1].shape.as_list())
+    write_op2 = replay_table.write([1, 2], [lidar2], ['lidar'])
+    read_op = replay_table.read(
+        list(range(3)), slots=['lidar', ['action', 'step']])
+    self.evaluate(tf.global_variables_initializer())
+    self.evaluate(write_op1)
+    self.evaluate(write_op2)
+    read_value_ = self.evaluate(read_op)
+    self.assertAllClose([lidar1[0], lidar2[0], lidar2[1]], read_value_[0])
+    self.assertAllClose([action1[0], action1[1], np.zeros(3)],
+                        read_value_[1][0])
+    self.assertAllEqual([2, 3, 0], read_value_[1][1])
+
+  @test_util.run_in_graph_and_eager_modes()
+  def testWriteUnbatchedValueToRows(self):
+    spec = self._spec()
+    replay_table = table.PackedTable(spec, capacity=4)
+
+    step = tf.constant(7, dtype=tf.int64)
+    write_op = replay_table.write([1, 2], [step], ['step'])
+    read_op = replay_table.read(list(range(4)), slots=['step'])
+    self.evaluate(tf.global_variables_initializer())
+    self.evaluate(write_op)
+    self.assertAllEqual([0, 7, 7, 0], self.evaluate(read_op)[0])
+
+
 if __name__ == '__main__':
   tf.test.main()
@@ -0,0 +1,350 @@
+# coding=utf-8
+# Copyright 2018 The TF-Agents Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""A batched replay buffer of nests of Tensors with prioritized sampling.
+
+Items are stored as in TFUniformReplayBuffer, but are sampled with probability
+p_i^alpha / sum_k p_k^alpha, where p_i is the priority of item i, as described
+in https://arxiv.org/abs/1511.05952.
+
+The priorities are kept in a sum-tree stored in a `table.Table`, so that
+sampling and updating priorities are O(log N) gathers and scatters that run
+in-graph. All accesses to the tree are serialized by a CriticalSection.
+
+Unlike TFUniformReplayBuffer, each item gets a unique id, which is returned in
+`BufferInfo.ids` and can be passed to `update_priorities`.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import numpy as np
+import tensorflow as tf
+
+from tf_agents.replay_buffers import table
+from tf_agents.replay_buffers import tf_uniform_replay_buffer
+from tf_agents.specs import tensor_spec
+import gin.tf
+
+
+nest = tf.contrib.framework.nest
+
+BufferInfo = tf_uniform_replay_buffer.BufferInfo
+
+
+@gin.configurable
+class TFPrioritizedReplayBuffer(tf_uniform_replay_buffer.TFUniformReplayBuffer):
+  """A TFPrioritizedReplayBuffer with batched adds and prioritized sampling."""
+
+  def __init__(self,
+               data_spec,
+               batch_size,
+               max_length=1000,
+               alpha=0.6,
+               scope='TFPrioritizedReplayBuffer',
+               device='cpu:*',
+               table_fn=table.Table):
+    """Creates a TFPrioritizedReplayBuffer.
+
+    Args:
+      data_spec: A TensorSpec or a list/tuple/nest of TensorSpecs describing a
+        single item that can be stored in this buffer.
+      batch_size: Batch dimension of tensors when adding to buffer.
+      max_length: The maximum number of items that can be stored in a single
+        batch segment of the buffer.
+      alpha: Exponent applied to the priorities. 0 corresponds to uniform
+        sampling.
+      scope: Scope prefix for variables and ops created by this class.
+      device: A TensorFlow device to place the Variables and ops.
+      table_fn: Function to create tables `table_fn(data_spec, capacity)` that
+        can read/write nested tensors, e.g. `table.Table` or
+        `table.PackedTable`.
+    """
+    super(TFPrioritizedReplayBuffer, self).__init__(
+        data_spec,
+        batch_size,
+        max_length=max_length,
+        scope=scope,
+        device=device,
+        table_fn=table_fn)
+    self._alpha = alpha
+    # Node 1 is the root of the tree and node i has children 2i and 2i + 1.
+    # Leaf num_leaves + row holds the priority of the item stored at row.
+    self._depth = int(np.ceil(np.log2(max(self._capacity_value, 1))))
+    self._num_leaves = np.int64(2**self._depth)
+    self._tree_spec = tensor_spec.TensorSpec([], dtype=tf.float64,
+                                             name='priority_tree')
+    with tf.device(self._device), tf.variable_scope(self._scope):
+      self._tree_table = table_fn(self._tree_spec, 2 * self._num_leaves)
+      self._max_priority = tf.get_variable(
+          name='max_priority',
+          shape=[],
+          dtype=tf.float64,
+          initializer=tf.constant_initializer(1.0, dtype=tf.float64),
+          use_resource=True,
+          trainable=False)
+      self._priority_cs = tf.contrib.framework.CriticalSection(
+          name='priority_tree')
+
+  @property
+  def alpha(self):
+    return self._alpha
+
+  def _add_batch(self, items):
+    """Adds a batch of items to the replay buffer with the max priority.
+
+    Args:
+      items: A tensor or list/tuple/nest of tensors representing a batch of
+      items to be added to the replay buffer. Each element of `items` must match
+      the data_spec of this class. Should be shape [batch_size, data_spec, ...]
+    Returns:
+      An op that adds `items` to the replay buffer.
+    """
+    nest.assert_same_structure(items, self._data_spec)
+
+    with tf.device(self._device), tf.name_scope(self._scope):
+      id_ = self._increment_last_id()
+      write_rows = self._get_rows_for_id(id_)
+      # Give each item of the batch its own id, so that ids identify rows.
+      item_ids = id_ * self._batch_size + tf.range(self._batch_size,
+                                                   dtype=tf.int64)
+      write_id_op = self._id_table.write(write_rows, item_ids)
+      write_data_op = self._data_table.write(write_rows, items)
+
+      def _set_max_priority():
+        priorities = tf.fill([self._batch_size],
+                             tf.pow(self._max_priority.value(), self._alpha))
+        return self._set_priorities(write_rows, priorities)
+
+      with tf.control_dependencies([write_id_op, write_data_op]):
+        write_priority_op = self._priority_cs.execute(_set_max_priority)
+      return tf.group(write_id_op, write_data_op, write_priority_op)
+
+  def _get_next(self,
+                sample_batch_size=None,
+                num_steps=None,
+                time_stacked=True):
+    """Returns an item or batch of items sampled by priority from the buffer.
+
+    Args:
+      sample_batch_size: (Optional.) An optional batch_size to specify the
+        number of items to return. See get_next() documentation.
+      num_steps: (Optional.)  Optional way to specify that sub-episodes are
+        desired. See get_next() documentation.
+      time_stacked: Bool, when true and num_steps > 1 get_next on the buffer
+        would return the items stack on the time dimension. The outputs would be
+        [B, T, ..] if sample_batch_size is given or [T, ..] otherwise.
+    Returns:
+      A 2 tuple, containing:
+        - An item, sequence of items, or batch thereof sampled by priority
+          from the buffer.
+        - BufferInfo NamedTuple, containing:
+          - The items' ids.
+          - The sampling probability of each item.
+    """
+    num_steps_value = num_steps if num_steps is not None else 1
+    with tf.device(self._device), tf.name_scope(self._scope):
+      with tf.name_scope('get_next'):
+        last_id = self._get_last_id()
+        min_val, max_val = self._valid_range_ids(
+            last_id, self._max_length, num_steps)
+        assert_nonempty = tf.assert_greater(
+            max_val,
+            min_val,
+            message='TFPrioritizedReplayBuffer is empty. Make sure to add '
+            'items before sampling the buffer.')
+
+        num_samples = 1 if sample_batch_size is None else sample_batch_size
+        with tf.control_dependencies([assert_nonempty]):
+          start_rows, probabilities = self._priority_cs.execute(
+              lambda: self._sample_rows(num_samples, last_id, num_steps_value))
+        if sample_batch_size is None:
+          start_rows = start_rows[0]
+          probabilities = probabilities[0]
+
+        if num_steps is None:
+          data = self._data_table.read(start_rows)
+          data_ids = self._id_table.read(start_rows)
+        elif time_stacked:
+          rows_to_get = self._get_step_rows(
+              tf.expand_dims(start_rows, -1),
+              tf.range(num_steps, dtype=tf.int64))
+          data = self._data_table.read(rows_to_get)
+          data_ids = self._id_table.read(rows_to_get)
+        else:
+          data = []
+          data_ids = []
+          for step in range(num_steps):
+            rows_to_get = self._get_step_rows(start_rows, step)
+            data.append(self._data_table.read(rows_to_get))
+            data_ids.append(self._id_table.read(rows_to_get))
+          data = tuple(data)
+          data_ids = tuple(data_ids)
+
+        buffer_info = BufferInfo(ids=data_ids,
+                                 probabilities=probabilities)
+    return data, buffer_info
+
+  def update_priorities(self, ids, priorities):
+    """Returns an op updating the priorities of a batch of items.
+
+    Ids of items that have since been overwritten are ignored.
+
+    Args:
+      ids: An int64 Tensor of item ids, as returned in `BufferInfo.ids`.
+      priorities: A Tensor of non-negative priorities with the same shape as
+        `ids`.
+
+    Returns:
+      An op that updates the priorities.
+    """
+    with tf.device(self._device), tf.name_scope(self._scope):
+      with tf.name_scope('update_priorities'):
+        ids = tf.reshape(tf.convert_to_tensor(ids, dtype=tf.int64), [-1])
+        priorities = tf.reshape(
+            tf.convert_to_tensor(priorities, dtype=tf.float64), [-1])
+        assert_non_negative = tf.assert_non_negative(
+            priorities, message='Priorities must be non-negative.')
+        rows = (tf.mod(ids, self._batch_size) * self._max_length +
+                tf.mod(tf.floordiv(ids, self._batch_size), self._max_length))
+
+        def _update():
+          valid = tf.equal(self._id_table.read(rows), ids)
+          valid_priorities = tf.boolean_mask(priorities, valid)
+          update_op = self._set_priorities(
+              tf.boolean_mask(rows, valid),
+              tf.pow(valid_priorities, self._alpha))
+          max_priority_op = self._max_priority.assign(
+              tf.reduce_max(
+                  tf.concat([[self._max_priority.value()], valid_priorities],
+                            axis=0)))
+          return tf.group(update_op, max_priority_op)
+
+        with tf.control_dependencies([assert_non_negative]):
+          return self._priority_cs.execute(_update)
+
+  def _clear(self, clear_all_variables=False):
+    """Return op that resets the contents and priorities of replay buffer.
+
+    Args:
+      clear_all_variables: boolean indicating if all variables should be
+        cleared. See TFUniformReplayBuffer.clear().
+
+    Returns:
+      op that clears or unlinks the replay buffer contents.
+    """
+    clear_op = super(TFPrioritizedReplayBuffer, self)._clear(
+        clear_all_variables)
+
+    def _clear_priorities():
+      assignments = [self._max_priority.assign(1.0)]
+      assignments += [
+          v.assign(tf.zeros_like(v)) for v in self._tree_table.variables()
+      ]
+      return tf.group(*assignments)
+    return tf.group(clear_op, self._priority_cs.execute(_clear_priorities))
+
+  #  Helper functions, which must run within the priority CriticalSection.
+
+  def _set_priorities(self, rows, priorities):
+    """Sets the priority leaves at `rows` and updates their ancestors.
+
+    Args:
+      rows: A rank-1 int64 Tensor of rows of the data table.
+      priorities: A rank-1 float64 Tensor of priorities, already raised to
+        the power alpha.
+
+    Returns:
+      An op that updates the tree.
+    """
+    nodes = rows + self._num_leaves
+    update_op = self._tree_table.write(nodes, priorities)
+    for _ in range(self._depth):
+      with tf.control_dependencies([update_op]):
+        nodes = tf.floordiv(nodes, 2)
+        left = self._tree_table.read(2 * nodes)
+        right = self._tree_table.read(2 * nodes + 1)
+        update_op = self._tree_table.write(nodes, left + right)
+    return update_op
+
+  def _find_prefix_sum_rows(self, prefix_sums):
+    """Finds the rows at which the running sum of priorities reaches a value."""
+    nodes = tf.ones_like(prefix_sums, dtype=tf.int64)
+    for _ in range(self._depth):
+      left = 2 * nodes
+      left_sums = self._tree_table.read(left)
+      right_sums = self._tree_table.read(left + 1)
+      # Guard against rounding errors sending us into an empty subtree.
+      go_right = tf.logical_and(prefix_sums >= left_sums, right_sums > 0)
+      prefix_sums -= tf.where(go_right, left_sums, tf.zeros_like(left_sums))
+      nodes = left + tf.to_int64(go_right)
+    return nodes - self._num_leaves
+
+  def _sample_rows(self, num_samples, last_id, num_steps):
+    """Samples rows by priority, excluding rows that can't start num_steps.
+
+    The newest num_steps - 1 items of each batch segment can't start a
+    sub-episode of num_steps items, so their priorities are zeroed while
+    sampling and restored afterwards.
+
+    Args:
+      num_samples: Python int, number of rows to sample.
+      last_id: The last id added to the buffer.
+      num_steps: Python int, number of steps each sampled row must start.
+
+    Returns:
+      A tuple of int64 rows and float32 sampling probabilities, each of shape
+      [num_samples].
+    """
+    blocked_rows = None
+    if num_steps > 1:
+      blocked_ids = last_id - tf.range(num_steps - 1, dtype=tf.int64)
+      blocked_ids = tf.boolean_mask(blocked_ids, blocked_ids >= 0)
+      blocked_rows = tf.reshape(
+          tf.expand_dims(self._batch_offsets, 1) +
+          tf.mod(blocked_ids, self._max_length), [-1])
+      blocked_priorities = self._tree_table.read(blocked_rows +
+                                                 self._num_leaves)
+      with tf.control_dependencies([blocked_priorities]):
+        block_op = self._set_priorities(
+            blocked_rows, tf.zeros_like(blocked_priorities))
+      dependencies = [block_op]
+    else:
+      dependencies = []
+
+    with tf.control_dependencies(dependencies):
+      total = self._tree_table.read(1)
+      # Stratified sampling: one prefix sum per equal-mass segment.
+      prefix_sums = (
+          (tf.range(num_samples, dtype=tf.float64) +
+           tf.random_uniform([num_samples], dtype=tf.float64)) *
+          (total / num_samples))
+      rows = self._find_prefix_sum_rows(prefix_sums)
+      probabilities = tf.to_float(
+          self._tree_table.read(rows + self._num_leaves) / total)
+
+    if blocked_rows is not None:
+      with tf.control_dependencies([rows, probabilities]):
+        restore_op = self._set_priorities(blocked_rows, blocked_priorities)
+      with tf.control_dependencies([restore_op]):
+        rows = tf.identity(rows)
+        probabilities = tf.identity(probabilities)
+    return rows, probabilities
+
+  def _get_step_rows(self, rows, step):
+    """Returns the rows `step` items after `rows` within their batch segment."""
+    segment_start = tf.floordiv(rows, self._max_length) * self._max_length
+    return segment_start + tf.mod(rows + step, self._max_length)
@@ -0,0 +1,143 @@
+# coding=utf-8
+# Copyright 2018 The TF-Agents Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for tf_prioritized_replay_buffer."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from absl.testing import parameterized
+import numpy as np
+import tensorflow as tf
+
+from tf_agents import specs
+from tf_agents.replay_buffers import tf_prioritized_replay_buffer
+
+
+class TFPrioritizedReplayBufferTest(parameterized.TestCase, tf.test.TestCase):
+
+  def _create_replay_buffer(self, batch_size, max_length=10, alpha=1.0):
+    spec = specs.TensorSpec([], tf.int32, 'action')
+    return tf_prioritized_replay_buffer.TFPrioritizedReplayBuffer(
+        spec, batch_size=batch_size, max_length=max_length, alpha=alpha)
+
+  @parameterized.named_parameters(
+      ('BatchSizeOne', 1),
+      ('BatchSizeFive', 5),
+  )
+  def testNewItemsSampledUniformly(self, batch_size):
+    replay_buffer = self._create_replay_buffer(batch_size)
+    actions = tf.stack([tf.Variable(0).count_up_to(10)] * batch_size)
+    add_op = replay_buffer.add_batch(actions)
+    _, buffer_info = replay_buffer.get_next(sample_batch_size=4)
+
+    with self.test_session() as sess:
+      sess.run(tf.global_variables_initializer())
+      for i in range(1, 5):
+        sess.run(add_op)
+        buffer_info_ = sess.run(buffer_info)
+        self.assertAllClose([1. / (i * batch_size)] * 4,
+                            buffer_info_.probabilities)
+        self.assertAllLess(buffer_info_.ids, i * batch_size)
+
+  @parameterized.named_parameters(
+      ('BatchSizeOne', 1),
+      ('BatchSizeFive', 5),
+  )
+  def testSampleProportionalToPriority(self, batch_size):
+    replay_buffer = self._create_replay_buffer(batch_size)
+    actions = tf.stack([tf.Variable(0).count_up_to(10)] * batch_size)
+    add_op = replay_buffer.add_batch(actions)
+    ids_ph = tf.placeholder(tf.int64, [None])
+    priorities_ph = tf.placeholder(tf.float64, [None])
+    update_op = replay_buffer.update_priorities(ids_ph, priorities_ph)
+    sample, buffer_info = replay_buffer.get_next(sample_batch_size=100)
+
+    with self.test_session() as sess:
+      sess.run(tf.global_variables_initializer())
+      for _ in range(10):
+        sess.run(add_op)
+      num_items = 10 * batch_size
+      priorities = np.zeros(num_items)
+      # Ids 0 and 2 * batch_size hold actions 0 and 2.
+      priorities[0] = 1.0
+      priorities[2 * batch_size] = 3.0
+      sess.run(update_op, {ids_ph: np.arange(num_items),
+                           priorities_ph: priorities})
+      sample_, buffer_info_ = sess.run((sample, buffer_info))
+      self.assertAllEqual([0, 2], np.unique(sample_))
+      self.assertAllClose(priorities[buffer_info_.ids] / 4.0,
+                          buffer_info_.probabilities)
+      # Stratified sampling draws exactly a quarter of the batch from id 0.
+      self.assertEqual(25, np.sum(sample_ == 0))
+
+  def testSampleWithNumSteps(self):
+    replay_buffer = self._create_replay_buffer(batch_size=1)
+    actions = tf.stack([tf.Variable(0).count_up_to(15)])
+    add_op = replay_buffer.add_batch(actions)
+    update_op = replay_buffer.update_priorities(
+        tf.range(5, 15, dtype=tf.int64),
+        tf.constant([0.] * 8 + [1., 1.], dtype=tf.float64))
+    steps, buffer_info = replay_buffer.get_next(sample_batch_size=10,
+                                                num_steps=2)
+
+    with self.test_session() as sess:
+      sess.run(tf.global_variables_initializer())
+      for _ in range(15):
+        sess.run(add_op)
+      sess.run(update_op)
+      # All the mass is on the newest item, which cannot start a sub-episode.
+      for _ in range(3):
+        steps_, buffer_info_ = sess.run((steps, buffer_info))
+        self.assertAllEqual(np.tile([13, 14], [10, 1]), steps_)
+        self.assertAllEqual(steps_, buffer_info_.ids)
+        self.assertAllClose(np.ones(10), buffer_info_.probabilities)
+
+  def testUpdatePrioritiesIgnoresOverwrittenIds(self):
+    replay_buffer = self._create_replay_buffer(batch_size=1, max_length=2)
+    actions = tf.stack([tf.Variable(0).count_up_to(4)])
+    add_op = replay_buffer.add_batch(actions)
+    update_op = replay_buffer.update_priorities(
+        tf.constant([1, 2], dtype=tf.int64), tf.constant([0., 0.], tf.float64))
+    sample, _ = replay_buffer.get_next(sample_batch_size=10)
+
+    with self.test_session() as sess:
+      sess.run(tf.global_variables_initializer())
+      for _ in range(4):
+        sess.run(add_op)
+      sess.run(update_op)
+      self.assertAllEqual(np.full(10, 3), sess.run(sample))
+
+  def testClear(self):
+    replay_buffer = self._create_replay_buffer(batch_size=1)
+    actions = tf.stack([tf.Variable(0).count_up_to(10)])
+    add_op = replay_buffer.add_batch(actions)
+    update_op = replay_buffer.update_priorities(
+        tf.constant([0], dtype=tf.int64), tf.constant([5.], tf.float64))
+    clear_op = replay_buffer.clear()
+    _, buffer_info = replay_buffer.get_next()
+
+    with self.test_session() as sess:
+      sess.run(tf.global_variables_initializer())
+      sess.run(add_op)
+      sess.run(update_op)
+      sess.run(clear_op)
+      sess.run(add_op)
+      sess.run(add_op)
+      self.assertAllClose(0.5, sess.run(buffer_info).probabilities)
+
+
+if __name__ == '__main__':
+  tf.test.main()
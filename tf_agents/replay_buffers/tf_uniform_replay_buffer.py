@@ -32,6 +32,7 @@ import collections
 import numpy as np
 import tensorflow as tf
 
+from tf_agents.environments import trajectory
 from tf_agents.replay_buffers import replay_buffer
 from tf_agents.replay_buffers import table
 from tf_agents.specs import tensor_spec
@@ -51,13 +52,19 @@ class TFUniformReplayBuffer(replay_buffer.ReplayBuffer,
                             tf.contrib.eager.Checkpointable):
   """A TFUniformReplayBuffer with batched adds and uniform sampling."""
 
+  # Rounds of redrawing sub-episodes spanning several episodes before falling
+  # back to listing all the valid sub-episodes.
+  _MAX_EPISODE_REDRAWS = 10
+
   def __init__(self,
                data_spec,
                batch_size,
                max_length=1000,
                scope='TFUniformReplayBuffer',
                device='cpu:*',
-               table_fn=table.Table):
+               table_fn=table.Table,
+               sample_within_episodes=False,
+               sample_without_replacement=False):
     """Creates a TFUniformReplayBuffer.
 
     Args:
@@ -69,11 +76,27 @@ class TFUniformReplayBuffer(replay_buffer.ReplayBuffer,
       scope: Scope prefix for variables and ops created by this class.
       device: A TensorFlow device to place the Variables and ops.
       table_fn: Function to create tables `table_fn(data_spec, capacity)` that
-        can read/write nested tensors.
+        can read/write nested tensors, e.g. `table.Table` or
+        `table.PackedTable`.
+      sample_within_episodes: If True, sub-episodes of `num_steps` items are
+        only sampled within a single episode of a single batch segment, i.e.
+        only their last item can be an episode boundary. Requires `data_spec`
+        to be a Trajectory. The returned probabilities are still those of
+        uniform sampling over all sub-episodes.
+      sample_without_replacement: If True, `get_next` and `as_dataset` sample
+        in epochs: each epoch is a random permutation of the sub-episodes
+        valid when it starts, and every one of them is sampled exactly once
+        before the next epoch starts. Sample batches can span two epochs.
+        Items overwritten during an epoch are replaced by the newer items.
 
     Raises:
-      ValueError: If batch_size does not evenly divide capacity.
+      ValueError: If batch_size does not evenly divide capacity, or if
+        sample_within_episodes is set but data_spec is not a Trajectory.
     """
+    if sample_within_episodes and not isinstance(data_spec,
+                                                 trajectory.Trajectory):
+      raise ValueError('sample_within_episodes requires data_spec to be the '
+                       'spec of a trajectory: {}'.format(data_spec))
     self._batch_size = batch_size
     self._max_length = max_length
     capacity = self._batch_size * self._max_length
@@ -86,6 +109,8 @@ class TFUniformReplayBuffer(replay_buffer.ReplayBuffer,
     self._scope = scope
     self._device = device
     self._table_fn = table_fn
+    self._sample_within_episodes = sample_within_episodes
+    self._sample_without_replacement = sample_without_replacement
     # TODO(sguada) move to create_variables function so we can use make_template
     # to handle this.
     with tf.device(self._device), tf.variable_scope(self._scope):
@@ -100,6 +125,54 @@ class TFUniformReplayBuffer(replay_buffer.ReplayBuffer,
           use_resource=True,
           trainable=False)
       self._last_id_cs = tf.contrib.framework.CriticalSection(name='last_id')
+      if sample_within_episodes:
+        # Episode id of the item in each row, unique across batch segments. A
+        # sub-episode lies within one episode iff its first and last items
+        # have the same episode id.
+        self._episode_id_table = table_fn(
+            tensor_spec.TensorSpec([], dtype=tf.int64, name='episode_id'),
+            self._capacity_value)
+        # Number of episode boundaries added to each batch segment.
+        self._num_boundaries = tf.get_variable(
+            name='num_boundaries',
+            shape=[self._batch_size],
+            dtype=tf.int64,
+            initializer=tf.zeros_initializer,
+            use_resource=True,
+            trainable=False)
+      if sample_without_replacement:
+        # Permutation of the ids of the sub-episodes of the current epoch in
+        # its first `epoch_size` entries, of which `epoch_position` were
+        # sampled, and the number of steps of these sub-episodes.
+        self._epoch_ids = tf.get_variable(
+            name='epoch_ids',
+            shape=[capacity],
+            dtype=tf.int64,
+            initializer=tf.zeros_initializer,
+            use_resource=True,
+            trainable=False)
+        self._epoch_size = tf.get_variable(
+            name='epoch_size',
+            shape=[],
+            dtype=tf.int64,
+            initializer=tf.zeros_initializer,
+            use_resource=True,
+            trainable=False)
+        self._epoch_position = tf.get_variable(
+            name='epoch_position',
+            shape=[],
+            dtype=tf.int64,
+            initializer=tf.zeros_initializer,
+            use_resource=True,
+            trainable=False)
+        self._epoch_num_steps = tf.get_variable(
+            name='epoch_num_steps',
+            shape=[],
+            dtype=tf.int64,
+            initializer=tf.zeros_initializer,
+            use_resource=True,
+            trainable=False)
+        self._epoch_cs = tf.contrib.framework.CriticalSection(name='epoch')
 
   def variables(self):
     # TODO(sguada) - make this Eager-compatible. Don't rely on scopes.
@@ -138,7 +211,11 @@ class TFUniformReplayBuffer(replay_buffer.ReplayBuffer,
       write_rows = self._get_rows_for_id(id_)
       write_id_op = self._id_table.write(write_rows, id_)
       write_data_op = self._data_table.write(write_rows, items)
-      return tf.group(write_id_op, write_data_op)
+      if not self._sample_within_episodes:
+        return tf.group(write_id_op, write_data_op)
+      write_episode_id_op = self._episode_id_table.write(
+          write_rows, self._increment_num_boundaries(items.is_boundary()))
+      return tf.group(write_id_op, write_data_op, write_episode_id_op)
 
   def _get_next(self,
                 sample_batch_size=None,
@@ -180,14 +257,13 @@ class TFUniformReplayBuffer(replay_buffer.ReplayBuffer,
             message='TFUniformReplayBuffer is empty. Make sure to add items '
             'before sampling the buffer.')
         with tf.control_dependencies([assert_nonempty]):
-          ids = tf.random_uniform(
-              rows_shape, minval=min_val, maxval=max_val, dtype=tf.int64)
-
-        # Move each id sample to a random batch.
-        batch_offsets = tf.random_uniform(
-            rows_shape, minval=0, maxval=self._batch_size, dtype=tf.int64)
-        batch_offsets *= self._max_length
-        ids += batch_offsets
+          if self._sample_without_replacement:
+            ids = tf.reshape(
+                self._next_epoch_ids(
+                    sample_batch_size or 1, min_val, max_val, num_steps),
+                rows_shape)
+          else:
+            ids = self._sample_ids(rows_shape, min_val, max_val, num_steps)
 
         if num_steps is None:
           rows_to_get = tf.mod(ids, self._capacity)
@@ -315,7 +391,14 @@ class TFUniformReplayBuffer(replay_buffer.ReplayBuffer,
       if clear_all_variables:
         assignments += [v.assign(tf.zeros_like(v)) for v in table_vars]
       return tf.group(*assignments, name='clear')
-    return self._last_id_cs.execute(_init_vars)
+    if not self._sample_without_replacement:
+      return self._last_id_cs.execute(_init_vars)
+
+    def _reset_epoch():
+      return tf.group(self._epoch_size.assign(0),
+                      self._epoch_position.assign(0))
+    return tf.group(self._last_id_cs.execute(_init_vars),
+                    self._epoch_cs.execute(_reset_epoch), name='clear')
 
   #  Helper functions.
 
@@ -357,6 +440,158 @@ class TFUniformReplayBuffer(replay_buffer.ReplayBuffer,
       return self._last_id.assign_add(increment).value()
     return self._last_id_cs.execute(_assign_add)
 
+  def _increment_num_boundaries(self, boundaries):
+    """Counts a batch of episode boundaries in a thread safe manner.
+
+    Args:
+      boundaries: A bool Tensor of shape [batch_size], whether each item added
+        is an episode boundary.
+    Returns:
+      The episode ids of the items: the number of boundaries added to their
+      batch segment before them, times batch_size, plus their batch segment.
+    """
+    boundaries = tf.to_int64(boundaries)
+    def _assign_add():
+      return self._num_boundaries.assign_add(boundaries).value() - boundaries
+    num_boundaries = self._last_id_cs.execute(_assign_add)
+    return (num_boundaries * self._batch_size +
+            tf.range(self._batch_size, dtype=tf.int64))
+
+  def _sample_ids(self, rows_shape, min_val, max_val, num_steps=None):
+    """Draws uniformly the ids of the items or sub-episodes to sample.
+
+    Each id is moved to a random batch segment by adding a multiple of
+    max_length. With `sample_within_episodes`, sub-episodes spanning several
+    episodes are redrawn, which takes O(1) draws per sample on average unless
+    most sub-episodes span several episodes. After `_MAX_EPISODE_REDRAWS`
+    rounds, the remaining ones are drawn among all the valid sub-episodes.
+
+    Args:
+      rows_shape: Shape of the ids to draw.
+      min_val: Smallest valid id, see `_valid_range_ids`.
+      max_val: Largest valid id plus one, see `_valid_range_ids`.
+      num_steps: (Optional.) Number of items in each sub-episode.
+    Returns:
+      An int64 Tensor of shape `rows_shape` with the ids of the first items.
+    """
+    def draw():
+      ids = tf.random_uniform(
+          rows_shape, minval=min_val, maxval=max_val, dtype=tf.int64)
+      # Move each id sample to a random batch.
+      batch_offsets = tf.random_uniform(
+          rows_shape, minval=0, maxval=self._batch_size, dtype=tf.int64)
+      return ids + batch_offsets * self._max_length
+
+    ids = draw()
+    if not self._sample_within_episodes or num_steps is None or num_steps < 2:
+      return ids
+
+    def spans_episodes(ids):
+      return self._spans_episodes(ids, num_steps)
+
+    def keep_redrawing(i, ids):
+      return tf.logical_and(i < self._MAX_EPISODE_REDRAWS,
+                            tf.reduce_any(spans_episodes(ids)))
+
+    def redraw(i, ids):
+      return i + 1, tf.where(spans_episodes(ids), draw(), ids)
+
+    _, ids = tf.while_loop(keep_redrawing, redraw, [tf.constant(0), ids])
+
+    def draw_valid():
+      valid_ids = self._valid_ids(min_val, max_val, num_steps)
+      choices = tf.random_uniform(
+          rows_shape, minval=0,
+          maxval=tf.size(valid_ids, out_type=tf.int64), dtype=tf.int64)
+      return tf.where(spans_episodes(ids), tf.gather(valid_ids, choices), ids)
+
+    return tf.cond(tf.reduce_any(spans_episodes(ids)), draw_valid, lambda: ids)
+
+  def _spans_episodes(self, ids, num_steps):
+    """Returns whether sub-episodes starting at ids span several episodes."""
+    first = self._episode_id_table.read(tf.mod(ids, self._capacity))
+    last = self._episode_id_table.read(
+        tf.mod(ids + num_steps - 1, self._capacity))
+    return tf.not_equal(first, last)
+
+  def _valid_ids(self, min_val, max_val, num_steps=None):
+    """Returns the ids of the first items of all the valid sub-episodes.
+
+    Args:
+      min_val: Smallest valid id, see `_valid_range_ids`.
+      max_val: Largest valid id plus one, see `_valid_range_ids`.
+      num_steps: (Optional.) Number of items in each sub-episode.
+    Returns:
+      A 1-D int64 Tensor of ids in all batch segments, asserted to be
+      non-empty.
+    """
+    all_ids = tf.reshape(
+        tf.expand_dims(tf.range(min_val, max_val), 0) +
+        tf.expand_dims(self._batch_offsets, 1), [-1])
+    if self._sample_within_episodes and num_steps is not None and num_steps > 1:
+      all_ids = tf.boolean_mask(
+          all_ids, tf.logical_not(self._spans_episodes(all_ids, num_steps)))
+    assert_valid = tf.assert_greater(
+        tf.size(all_ids, out_type=tf.int64), tf.constant(0, tf.int64),
+        message='TFUniformReplayBuffer holds no valid sub-episode of '
+        'num_steps items.')
+    with tf.control_dependencies([assert_valid]):
+      return tf.identity(all_ids)
+
+  def _next_epoch_ids(self, num_ids, min_val, max_val, num_steps=None):
+    """Takes the next ids of the current epoch, starting epochs as needed.
+
+    An epoch is also started when `num_steps` differs from the one of the
+    current epoch. The epoch variables are only accessed in `_epoch_cs`, so
+    concurrent calls take disjoint ids.
+
+    Args:
+      num_ids: Number of ids to take.
+      min_val: Smallest valid id, see `_valid_range_ids`.
+      max_val: Largest valid id plus one, see `_valid_range_ids`.
+      num_steps: (Optional.) Number of items in each sub-episode.
+    Returns:
+      A 1-D int64 Tensor of `num_ids` ids of the first items of sub-episodes.
+    """
+    num_steps_value = tf.constant(num_steps or 1, dtype=tf.int64)
+
+    def start_epoch():
+      ids = tf.random_shuffle(self._valid_ids(min_val, max_val, num_steps))
+      epoch_size = tf.size(ids, out_type=tf.int64)
+      return tf.group(
+          tf.scatter_update(self._epoch_ids,
+                            tf.range(epoch_size, dtype=tf.int64), ids),
+          self._epoch_size.assign(epoch_size),
+          self._epoch_position.assign(0),
+          self._epoch_num_steps.assign(num_steps_value))
+
+    def keep_taking(ids):
+      return tf.size(ids, out_type=tf.int64) < num_ids
+
+    def take(ids):
+      exhausted = tf.logical_or(
+          self._epoch_position.read_value() >= self._epoch_size.read_value(),
+          tf.not_equal(self._epoch_num_steps.read_value(), num_steps_value))
+      maybe_start_epoch = tf.cond(exhausted, start_epoch, tf.no_op)
+      with tf.control_dependencies([maybe_start_epoch]):
+        position = self._epoch_position.read_value()
+        num_taken = tf.minimum(num_ids - tf.size(ids, out_type=tf.int64),
+                               self._epoch_size.read_value() - position)
+        taken = self._epoch_ids.sparse_read(
+            tf.range(position, position + num_taken))
+      with tf.control_dependencies([taken]):
+        update_position = self._epoch_position.assign_add(num_taken)
+      with tf.control_dependencies([update_position]):
+        return tf.concat([ids, taken], 0)
+
+    def take_all():
+      return tf.while_loop(
+          keep_taking, take, [tf.zeros([0], dtype=tf.int64)],
+          shape_invariants=[tf.TensorShape([None])],
+          back_prop=False)
+
+    return self._epoch_cs.execute(take_all)
+
   def _get_last_id(self):
 
     def last_id():
@@ -23,6 +23,9 @@ import numpy as np
 import tensorflow as tf
 
 from tf_agents import specs
+from tf_agents.environments import time_step as ts
+from tf_agents.environments import trajectory
+from tf_agents.replay_buffers import table
 from tf_agents.replay_buffers import tf_uniform_replay_buffer
 from tf_agents.utils import test_utils
 
@@ -222,6 +225,108 @@ class TFUniformReplayBufferTest(parameterized.TestCase, tf.test.TestCase):
         step_, next_step_ = sess.run([step, next_step])
         self.assertEqual((step_ + 1) % 10, next_step_)
 
+  def testSampleWithinEpisodes(self):
+    spec = trajectory.Trajectory(
+        step_type=specs.TensorSpec([], tf.int32, 'step_type'),
+        observation=specs.TensorSpec([], tf.int32, 'observation'),
+        action=specs.TensorSpec([], tf.int32, 'action'),
+        policy_info=(),
+        next_step_type=specs.TensorSpec([], tf.int32, 'next_step_type'),
+        reward=specs.TensorSpec([], tf.float32, 'reward'),
+        discount=specs.TensorSpec([], tf.float32, 'discount'))
+    batch_size = 2
+    replay_buffer = tf_uniform_replay_buffer.TFUniformReplayBuffer(
+        spec, batch_size=batch_size, max_length=8, sample_within_episodes=True)
+    items = nest.map_structure(
+        lambda s: tf.placeholder(s.dtype, [batch_size]), spec)
+    add_op = replay_buffer.add_batch(items)
+    sample, _ = replay_buffer.get_next(sample_batch_size=50, num_steps=3)
+
+    # Each segment holds the last 8 of 10 items, from episodes of 4 and 6 time
+    # steps in segment 0, and of 2 and 8 time steps in segment 1.
+    first, mid, last = ts.StepType.FIRST, ts.StepType.MID, ts.StepType.LAST
+    step_types = np.array(
+        [[first, mid, mid, last, first, mid, mid, mid, mid, last],
+         [first, last, first, mid, mid, mid, mid, mid, mid, last]], np.int32)
+    next_step_types = np.roll(step_types, -1, axis=1)
+    observations = np.arange(10) + np.array([[0], [100]])
+    with self.test_session() as sess:
+      sess.run(tf.global_variables_initializer())
+      for t in range(10):
+        values = trajectory.Trajectory(
+            step_type=step_types[:, t],
+            observation=observations[:, t],
+            action=np.zeros(batch_size),
+            policy_info=(),
+            next_step_type=next_step_types[:, t],
+            reward=np.zeros(batch_size),
+            discount=np.ones(batch_size))
+        sess.run(add_op, dict(zip(nest.flatten(items), nest.flatten(values))))
+      for _ in range(10):
+        sample_ = sess.run(sample)
+        self.assertAllEqual(sample_.observation[:, :-1] + 1,
+                            sample_.observation[:, 1:])
+        self.assertAllInSet(sample_.observation[:, 0],
+                            [2, 4, 5, 6, 7, 102, 103, 104, 105, 106, 107])
+
+  @parameterized.named_parameters(
+      ('WithoutNumSteps', None, 10),
+      ('WithNumSteps', 2, 8),
+  )
+  def testSampleWithoutReplacement(self, num_steps, epoch_size):
+    spec = specs.TensorSpec([], tf.int32, 'step')
+    batch_size = 2
+    replay_buffer = tf_uniform_replay_buffer.TFUniformReplayBuffer(
+        spec, batch_size=batch_size, max_length=5,
+        sample_without_replacement=True)
+
+    step = tf.Variable(0).count_up_to(10)
+    add_op = replay_buffer.add_batch(tf.stack([step, step + 100]))
+    sample, _ = replay_buffer.get_next(sample_batch_size=4,
+                                       num_steps=num_steps)
+    with self.test_session() as sess:
+      sess.run(tf.global_variables_initializer())
+      for _ in range(7):
+        sess.run(add_op)
+      samples = np.concatenate([sess.run(sample) for _ in range(6)])
+    first_items = samples if num_steps is None else samples[:, 0]
+    # Batches span epochs, each of which samples every valid item once.
+    valid_items = np.concatenate([np.arange(2, 2 + epoch_size // 2),
+                                  np.arange(102, 102 + epoch_size // 2)])
+    for epoch in range(24 // epoch_size):
+      self.assertAllEqual(
+          valid_items,
+          np.sort(first_items[epoch * epoch_size:(epoch + 1) * epoch_size]))
+
+  def testPackedTable(self):
+    spec = [
+        specs.TensorSpec([3], tf.float32, 'action'), [
+            specs.TensorSpec([], tf.int32, 'step'),
+            specs.TensorSpec([2, 2], tf.float32, 'lidar')
+        ]
+    ]
+    batch_size = 2
+    replay_buffer = tf_uniform_replay_buffer.TFUniformReplayBuffer(
+        spec, batch_size=batch_size, max_length=5, table_fn=table.PackedTable)
+
+    step = tf.stack([tf.Variable(0).count_up_to(10)] * batch_size)
+    value = tf.to_float(step)
+    add_op = replay_buffer.add_batch(
+        [tf.stack([value] * 3, axis=1),
+         [step, -tf.reshape(tf.stack([value] * 4, axis=1), [-1, 2, 2])]])
+    (action, [step_sample, lidar]), _ = replay_buffer.get_next(
+        sample_batch_size=4)
+    with self.test_session() as sess:
+      sess.run(tf.global_variables_initializer())
+      for _ in range(7):
+        sess.run(add_op)
+      for _ in range(10):
+        action_, step_, lidar_ = sess.run([action, step_sample, lidar])
+        self.assertAllGreaterEqual(step_, 2)
+        self.assertAllEqual(np.stack([step_] * 3, axis=1), action_)
+        self.assertAllEqual(-np.reshape(np.stack([step_] * 4, axis=1),
+                                        [-1, 2, 2]), lidar_)
+
   @parameterized.named_parameters(
       ('BatchSizeOne', 1),
       ('BatchSizeFive', 5),